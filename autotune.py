@@ -0,0 +1,278 @@
+# Automatic HSV threshold and exposure tuning
+#
+# Captures a short burst of frames of the empty table and a burst with fingers held on it for each candidate
+# exposure. Both bursts are reduced to saturation/value histograms of the foreground the detector sees
+# (after background subtraction) and every (saturation max, value min) threshold pair is scored at once
+# from cumulative histograms:
+#
+#   noiseRate   - fraction of empty table pixels that pass the threshold
+#   fingerRate  - fraction of touch pixels that pass it, minus the noise rate (i.e. pixels added by fingers)
+#   separation  - finger rate over noise rate, with the noise rate floored at one idle pixel since a lower rate
+#                 can't be measured from the burst
+#
+# The best threshold has the highest separation among those whose noise rate stays under `maxNoiseRate`, and the
+# exposure with the highest separation wins. Ties (e.g. thresholds that let no noise through) go to the higher
+# finger rate. The hue range is then taken from the finger pixels themselves.
+#
+# The result is saved as a profile that touchpad.py loads at startup:
+#
+#   python autotune.py -p 0                                     - tune a camera interactively, writes touchpad.profile.json
+#   python autotune.py --idle emptySession --touch touchSession - tune offline from two recorded sessions (see recorder.py)
+
+import argparse
+import json
+import cv2 as cv
+import numpy as np
+
+defaultProfilePath = "touchpad.profile.json"
+
+# Returns the foreground pixels the detector would threshold for `pixels` given an empty table `background`
+def getForegroundHSV(pixels:np.ndarray, background:np.ndarray = None):
+    foreground = pixels if background is None else cv.subtract(pixels, background)
+    return cv.cvtColor(foreground, cv.COLOR_BGR2HSV)
+
+# Returns a (256, 256) histogram of (saturation, value) over every pixel of `frames`
+def getSaturationValueHistogram(frames:list[np.ndarray], background:np.ndarray = None):
+    histogram = np.zeros(256*256, dtype=np.int64)
+
+    for pixels in frames:
+        hsv = getForegroundHSV(pixels, background)
+        keys = hsv[..., 1].astype(np.int32)*256 + hsv[..., 2]
+        histogram+= np.bincount(keys.ravel(), minlength=256*256)
+
+    return histogram.reshape(256, 256)
+
+# Returns rates[s, v]: the fraction of histogram pixels with saturation <= s and value >= v
+def getPassRates(histogram:np.ndarray):
+    passCounts = np.cumsum(np.cumsum(histogram, axis=0)[:, ::-1], axis=1)[:, ::-1]
+    return passCounts / max(1, histogram.sum())
+
+class ThresholdResult:
+    def __init__(self, saturationMax:int, valueMin:int, fingerRate:float, noiseRate:float, noiseFloor:float = 1e-9) -> None:
+        self.saturationMax = int(saturationMax)
+        self.valueMin = int(valueMin)
+        self.fingerRate = float(fingerRate)
+        self.noiseRate = float(noiseRate)
+        self.noiseFloor = float(noiseFloor)
+
+    def getSeparation(self):
+        return self.fingerRate / max(self.noiseRate, self.noiseFloor)
+
+    # Note: sorts by separation first and finger rate second
+    def getScore(self):
+        return (self.getSeparation(), self.fingerRate)
+
+    def toDict(self):
+        return {
+            "saturationMax": self.saturationMax,
+            "valueMin": self.valueMin,
+            "fingerRate": self.fingerRate,
+            "noiseRate": self.noiseRate,
+            "separation": self.getSeparation(),
+        }
+
+    def __str__(self) -> str:
+        return f"saturation <= {self.saturationMax} | value >= {self.valueMin} | finger pixels {self.fingerRate*100:.3f}% | noise pixels {self.noiseRate*100:.5f}%"
+
+# Scores every (saturation max, value min) pair at once and returns the best ThresholdResult
+# Note: `valueMargin` raises the value threshold a little past the noise floor so sensor noise we didn't sample doesn't leak through
+def searchThresholds(idleHistogram:np.ndarray, touchHistogram:np.ndarray, maxNoiseRate:float = 1e-4, valueMargin:int = 4):
+
+    noiseRates = getPassRates(idleHistogram)
+    fingerRates = getPassRates(touchHistogram) - noiseRates
+    noiseFloor = 1 / max(1, idleHistogram.sum())
+
+    # Note: infeasible thresholds are scored below anything feasible
+    feasible = noiseRates <= maxNoiseRate
+    separations = np.where(feasible, fingerRates / np.maximum(noiseRates, noiseFloor), -np.inf)
+    tieBreaks = np.where(feasible & (separations == separations.max()), fingerRates, -np.inf)
+    saturationMax, valueMin = np.unravel_index(np.argmax(tieBreaks), tieBreaks.shape)
+
+    valueMin = min(255, valueMin + valueMargin)
+    return ThresholdResult(saturationMax, valueMin, fingerRates[saturationMax, valueMin], noiseRates[saturationMax, valueMin], noiseFloor)
+
+# Returns the [min, max] hue of touch pixels that pass `threshold`, widened by `margin`
+def getHueRange(frames:list[np.ndarray], background:np.ndarray, threshold:ThresholdResult, margin:int = 10):
+    histogram = np.zeros(256, dtype=np.int64)
+
+    for pixels in frames:
+        hsv = getForegroundHSV(pixels, background)
+        passed = (hsv[..., 1] <= threshold.saturationMax) & (hsv[..., 2] >= threshold.valueMin)
+        histogram+= np.bincount(hsv[..., 0][passed], minlength=256)
+
+    if histogram.sum() == 0:
+        return [0, 255]
+
+    cumulative = np.cumsum(histogram) / histogram.sum()
+    hueMin = int(np.searchsorted(cumulative, .005))
+    hueMax = int(np.searchsorted(cumulative, .995))
+    return [max(0, hueMin - margin), min(255, hueMax + margin)]
+
+# Note: the empty table background is the per pixel median so a stray hand in one idle frame doesn't bias it
+def getBackground(idleFrames:list[np.ndarray]):
+    return np.median(np.stack(idleFrames), axis=0).astype(np.uint8)
+
+class ExposureResult:
+    def __init__(self, negativeExposure:int, threshold:ThresholdResult, hueRange:list[int]) -> None:
+        self.negativeExposure = negativeExposure
+        self.threshold = threshold
+        self.hueRange = hueRange
+
+    def toDict(self):
+        return {"negativeExposure": self.negativeExposure, "hue": self.hueRange, **self.threshold.toDict()}
+
+# Returns the ExposureResult for bursts of idle and touch frames captured at one exposure
+# Note: `useBackground` should match whether the touchpad subtracts its background model (backgroundRate > 0)
+def tuneBursts(idleFrames:list[np.ndarray], touchFrames:list[np.ndarray], negativeExposure:int = None,
+               useBackground:bool = True, maxNoiseRate:float = 1e-4):
+
+    # Note: with subtraction the idle burst is scored against its own background which is what the model converges to
+    background = getBackground(idleFrames) if useBackground else None
+
+    threshold = searchThresholds(
+        getSaturationValueHistogram(idleFrames, background),
+        getSaturationValueHistogram(touchFrames, background),
+        maxNoiseRate
+    )
+
+    return ExposureResult(negativeExposure, threshold, getHueRange(touchFrames, background, threshold))
+
+def getBestExposure(results:list[ExposureResult]):
+    return max(results, key=lambda result: result.threshold.getScore())
+
+def getProfile(best:ExposureResult, results:list[ExposureResult], sliders:dict):
+
+    profileSliders = {
+        "hue": best.hueRange,
+        "saturation": [0, best.threshold.saturationMax],
+        "value": [best.threshold.valueMin, 255],
+    }
+
+    if best.negativeExposure is not None:
+        profileSliders["negativeExposure"] = best.negativeExposure
+        profileSliders["brightness"] = sliders["brightness"]
+
+    return {
+        "sliders": profileSliders,
+        "autotune": {
+            "best": best.toDict(),
+            "candidates": [result.toDict() for result in results],
+        },
+    }
+
+def loadProfile(path:str):
+    with open(path) as profileFile:
+        return json.load(profileFile)
+
+def saveProfile(path:str, profile:dict):
+    with open(path, "w") as profileFile:
+        json.dump(profile, profileFile, indent=4)
+
+# Captures `numFrames` detection images from `pad` after letting `settleFrames` frames go by
+def captureBurst(pad, numFrames:int, settleFrames:int = 5):
+    frames = []
+
+    for _ in range(settleFrames):
+        pad.source.read()
+
+    while len(frames) < numFrames and pad.source.isOpen():
+        success, pixels = pad.source.read()
+        if success:
+            frames.append(pad.getDetectionImage(pixels).copy())
+
+    return frames
+
+# Runs the interactive tuning session, prompting the operator between bursts
+def tuneCamera(pad, exposures:list[int], numFrames:int, maxNoiseRate:float):
+
+    useBackground = pad.sliders.backgroundRate.getValue() > 0
+
+    input("Clear the table and press enter...")
+    idleBursts = {}
+    for negativeExposure in exposures:
+        pad.sliders.negativeExposure.setValue(negativeExposure)
+        idleBursts[negativeExposure] = captureBurst(pad, numFrames)
+
+    input("Hold a few fingers on the table and press enter (keep them there until told otherwise)...")
+    results = []
+    for negativeExposure in exposures:
+        pad.sliders.negativeExposure.setValue(negativeExposure)
+        touchBurst = captureBurst(pad, numFrames)
+
+        result = tuneBursts(idleBursts[negativeExposure], touchBurst, negativeExposure, useBackground, maxNoiseRate)
+        results.append(result)
+        print(f"-Exposure {negativeExposure}: {result.threshold}")
+
+    print("Done, you can lift your fingers")
+    return results
+
+def main():
+
+    # Note: imported here since touchpad imports this module
+    from framesource import CameraSource, openFrameSource
+    from recorder import SessionReader
+    from touchpad import NullPublisher, Touchpad
+
+    argParser = argparse.ArgumentParser(
+        prog = "AutoTune",
+        description ="Tunes EECS 598 IR Touchpad thresholds and exposure from bursts of empty and touched frames",
+    )
+
+    argParser.add_argument("-p", "--port", metavar="n", action="store", default="0", required=False, help="IR Camera port number (or any touchpad input)")
+    argParser.add_argument("--idle", metavar="path", action="store", default=None, required=False, help="Recorded session of the empty table to tune from instead of a camera")
+    argParser.add_argument("--touch", metavar="path", action="store", default=None, required=False, help="Recorded session with fingers on the table, used with --idle")
+    argParser.add_argument("-e", "--exposures", metavar="list", action="store", default="4,5,6,7,8,9,10", required=False, help="Comma separated -exposure values to try")
+    argParser.add_argument("-n", "--frames", metavar="n", action="store", default="10", required=False, help="Frames per burst")
+    argParser.add_argument("--max-noise", metavar="rate", action="store", default="1e-4", required=False, help="Largest fraction of empty table pixels allowed through the threshold")
+    argParser.add_argument("-c", "--config", metavar="path", action="store", default=None, required=False, help="JSON file of slider values to start with")
+    argParser.add_argument("--clip", metavar="x,y,w,h", action="store", default=None, required=False, help="Touch surface rectangle in camera pixels (see touchpad.py)")
+    argParser.add_argument("-o", "--output", metavar="path", action="store", default=defaultProfilePath, required=False, help="Where to save the profile")
+
+    args = argParser.parse_args()
+
+    config = None
+    if args.config is not None:
+        with open(args.config) as configFile:
+            config = json.load(configFile)
+
+    clip = None if args.clip is None else [int(value) for value in args.clip.split(",")]
+    maxNoiseRate = float(args.max_noise)
+
+    if args.idle is not None:
+        assert args.touch is not None, "--idle needs a --touch session too"
+
+        idleReader = SessionReader(args.idle)
+        touchReader = SessionReader(args.touch)
+
+        # Note: recorded sessions are tuned at the exposure they were captured with
+        pad = Touchpad(openFrameSource(args.idle), publisher=NullPublisher(), headless=True, config=config,
+                       clip=clip if clip is not None else idleReader.header.get("clip"), downscale=idleReader.header.get("downscale", 0))
+
+        idleFrames = [pad.getDetectionImage(pixels).copy() for _, pixels in idleReader]
+        touchFrames = [pad.getDetectionImage(pixels).copy() for _, pixels in touchReader]
+        results = [tuneBursts(idleFrames, touchFrames, None, pad.sliders.backgroundRate.getValue() > 0, maxNoiseRate)]
+
+        idleReader.close()
+        touchReader.close()
+
+    else:
+        source = openFrameSource(args.port)
+        pad = Touchpad(source, publisher=NullPublisher(), headless=True, config=config, clip=clip)
+
+        # Note: only cameras can change exposure so other inputs are tuned at their current one
+        exposures = [int(value) for value in args.exposures.split(",")] if isinstance(source, CameraSource) else [pad.sliders.negativeExposure.getValue()]
+        results = tuneCamera(pad, exposures, int(args.frames), maxNoiseRate)
+
+    best = getBestExposure(results)
+    if best.threshold.fingerRate <= 0:
+        print("Warning: no finger pixels stood out from the empty table, check that fingers were on the table during the touch burst")
+
+    profile = getProfile(best, results, pad.sliders.getConfig())
+    saveProfile(args.output, profile)
+    pad.close()
+
+    print(f"Best: {best.threshold}" + ("" if best.negativeExposure is None else f" at -exposure {best.negativeExposure}"))
+    print(f"Saved profile to '{args.output}': {profile['sliders']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# Adaptive background subtraction and activity gating for the touchpad
+#
+# BackgroundModel keeps a running average of the empty table so slow ambient IR drift is removed
+# before thresholding. ActivityGate compares a tiny thumbnail of each frame against the last fully
+# processed frame so idle tables can skip the contour pipeline entirely.
+
+import cv2 as cv
+import numpy as np
+
+class BackgroundModel:
+
+    # Note: `learningRate` is the weight given to each new frame (0 disables subtraction),
+    #       `protectKernel` grows the foreground mask so finger edges don't bleed into the background and
+    #       the background is only blended every `updateInterval` frames (at a proportionally higher rate).
+    #       Blobs more than `blobThreshold` gray levels brighter than the frame's median and no bigger than `maxBlobFraction`
+    #       of it are left out of the initial background (see seed)
+    def __init__(self, learningRate:float = .005, protectKernelSize = (15, 15), updateInterval:int = 4,
+                 blobThreshold:int = 40, maxBlobFraction:float = .02) -> None:
+        self.learningRate = learningRate
+        self.protectKernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, protectKernelSize)
+        self.updateInterval = updateInterval
+        self.blobThreshold = blobThreshold
+        self.maxBlobFraction = maxBlobFraction
+
+        self.background:np.ndarray = None
+        self.backgroundPixels:np.ndarray = None
+        self.framesSinceUpdate = 0
+
+    def reset(self):
+        self.background = None
+        self.backgroundPixels = None
+        self.framesSinceUpdate = 0
+
+    def isEnabled(self):
+        return self.learningRate > 0
+
+    # Resizes the background to `width` x `height` so a change of detection resolution keeps what was learned
+    # Note: apply would otherwise restart from the next frame, adopting any fingers on the table into the background
+    def rescale(self, width:int, height:int):
+        if self.background is None or self.background.shape[:2] == (height, width):
+            return
+
+        self.background = cv.resize(self.background, (width, height), interpolation=cv.INTER_AREA)
+        self.backgroundPixels = cv.convertScaleAbs(self.background)
+
+    # Starts the background from `pixels` with finger sized bright blobs painted over by their surroundings
+    # Note: fingers resting on the table would otherwise be subtracted from every frame and, since the foreground mask
+    #       keeps them out of updates, never learned out again. Large bright regions are kept since they're ambient IR
+    def seed(self, pixels:np.ndarray):
+
+        intensity = cv.max(cv.max(pixels[..., 0], pixels[..., 1]), pixels[..., 2]) if pixels.ndim == 3 else pixels
+        threshold = min(255, int(np.median(intensity)) + self.blobThreshold)
+        _, brightMask = cv.threshold(intensity, threshold, 255, cv.THRESH_BINARY)
+
+        numLabels, labels, stats, _ = cv.connectedComponentsWithStats(brightMask, connectivity=8)
+        isBlob = stats[:, cv.CC_STAT_AREA] <= self.maxBlobFraction*intensity.size
+        isBlob[0] = False
+
+        seedPixels = pixels
+        if numLabels > 1 and isBlob.any():
+            blobMask = cv.dilate(isBlob[labels].view(np.uint8)*np.uint8(255), self.protectKernel)
+            seedPixels = cv.inpaint(pixels, blobMask, 3, cv.INPAINT_TELEA)
+
+        self.background = seedPixels.astype(np.float32)
+        self.backgroundPixels = seedPixels.copy()
+        self.framesSinceUpdate = 0
+
+    # Returns `pixels` with the background subtracted (saturating at 0)
+    # Note: the first frame (or first frame after a resize) seeds the background
+    def apply(self, pixels:np.ndarray):
+
+        if not self.isEnabled():
+            return pixels
+
+        if self.background is None or self.background.shape != pixels.shape:
+            self.seed(pixels)
+
+        return cv.subtract(pixels, self.backgroundPixels)
+
+    # Blends `pixels` into the background everywhere outside of `foregroundMask`
+    def update(self, pixels:np.ndarray, foregroundMask:np.ndarray = None):
+
+        if not self.isEnabled() or self.background is None or self.background.shape != pixels.shape:
+            return
+
+        self.framesSinceUpdate+= 1
+        if self.framesSinceUpdate < self.updateInterval:
+            return
+
+        self.framesSinceUpdate = 0
+
+        updateMask = None
+        if foregroundMask is not None:
+            updateMask = cv.bitwise_not(cv.dilate(foregroundMask, self.protectKernel))
+
+        # Note: fingers only ever add IR so anything darker than the background is adopted right away.
+        #       This also clears out fingers the seed missed once they move
+        np.minimum(self.background, pixels, out=self.background)
+
+        cv.accumulateWeighted(pixels, self.background, min(1, self.learningRate*self.updateInterval), updateMask)
+        self.backgroundPixels = cv.convertScaleAbs(self.background)
+
+class ActivityGate:
+
+    # Note: a frame is idle when no thumbnail pixel moved more than `threshold` gray levels from the last
+    #       processed frame (0 disables the gate). Area averaging into the thumbnail suppresses sensor noise
+    #       and we still process at least every `maxSkippedFrames` frames so slow changes aren't missed
+    def __init__(self, threshold:int = 16, thumbnailWidth:int = 160, maxSkippedFrames:int = 30) -> None:
+        self.threshold = threshold
+        self.thumbnailWidth = thumbnailWidth
+        self.maxSkippedFrames = maxSkippedFrames
+
+        self.reference:np.ndarray = None
+        self.skippedFrames = 0
+
+    def reset(self):
+        self.reference = None
+        self.skippedFrames = 0
+
+    def getThumbnail(self, pixels:np.ndarray):
+        height, width = pixels.shape[:2]
+        thumbnailWidth = min(width, self.thumbnailWidth)
+        thumbnailHeight = max(1, round(height*thumbnailWidth/width))
+
+        # Note: IR frames are near monochrome so a single channel at every other pixel is plenty and
+        #       costs a fraction of converting and area averaging the whole frame
+        sampledPixels = pixels[::2, ::2, 1] if pixels.ndim == 3 else pixels[::2, ::2]
+        return cv.resize(sampledPixels, (thumbnailWidth, thumbnailHeight), interpolation=cv.INTER_AREA)
+
+    # Returns True if `pixels` hasn't changed meaningfully since the last frame that wasn't idle
+    def isIdle(self, pixels:np.ndarray):
+
+        if self.threshold <= 0:
+            return False
+
+        thumbnail = self.getThumbnail(pixels)
+
+        if self.reference is not None and self.reference.shape == thumbnail.shape and self.skippedFrames < self.maxSkippedFrames:
+            _, maxChange, _, _ = cv.minMaxLoc(cv.absdiff(thumbnail, self.reference))
+            if maxChange < self.threshold:
+                self.skippedFrames+= 1
+                return True
+
+        self.reference = thumbnail
+        self.skippedFrames = 0
+        return False
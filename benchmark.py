@@ -0,0 +1,321 @@
+# Benchmarks the touchpad's finger detection hot path on synthetic IR frames
+#
+# Reports per-stage timings, frames per second and detection precision/recall against
+# the synthetic ground truth across resolutions, finger counts, color modes and detector backends.
+# Localization is reported as the RMS error of the published positions against the ground truth centers and
+# as jitter: the RMS frame to frame change of that error for the same finger, which is what a stationary finger
+# would wobble by. Output filters trade jitter for error (lag) so both are worth watching.
+#
+# With --parity the single channel color modes are checked against the HSV path instead: both see the
+# same synthetic frames and their fingers are diffed frame by frame (exits non-zero on a mismatch), e.g.
+#
+#   python benchmark.py --parity -m value luma -r 1280x720 -f 1 5 -n 60
+#
+# With --capture the capture profiles are simulated instead: synthetic frames are paced like a camera running each
+# profile and read directly and through a ThreadedSource, reporting the achieved fps, frames dropped for newer ones
+# and how old frames are by the time detection starts (driver timestamp to detect start), e.g.
+#
+#   python benchmark.py --capture -p default mjpeg120 -f 2 -n 300
+
+import argparse
+import json
+import math
+import sys
+import time
+
+import touchpad
+from framesource import SyntheticSource, ThreadedSource, captureProfiles, renderSyntheticFrame
+from filters import outputFilters, parseFilterParams
+from recorder import FingerDiff, ReplayStats, getFingerRecord
+from touchpad import Frame, LogLevel, NullPublisher, Touchpad, colorModes, detectorBackends
+from tracker import FingerTracker
+
+def parseResolution(resolution:str):
+    width, height = resolution.lower().split("x")
+    return int(width), int(height)
+
+# Note: greedily matches detections to the closest ground truth finger within its radius
+#       Returns (truePositives, falsePositives, falseNegatives, offsets) where offsets maps
+#       ground truth indices to the (dx, dy) of the detection matched to them
+#       `getPoint` returns a finger's position in camera pixels (defaults to the raw detection)
+def scoreDetections(fingers, groundTruth, getPoint = lambda finger: (finger.cameraX, finger.cameraY)):
+
+    unmatched = list(range(len(groundTruth)))
+    offsets = {}
+    truePositives = 0
+
+    for finger in fingers:
+        x, y = getPoint(finger)
+
+        bestMatch = None
+        bestDistance = None
+        for truthIndex in unmatched:
+            truth = groundTruth[truthIndex]
+            distance = ((truth.x - x)**2 + (truth.y - y)**2)**.5
+            if distance <= max(truth.d1, truth.d2)/2 and (bestDistance is None or distance < bestDistance):
+                bestMatch = truthIndex
+                bestDistance = distance
+
+        if bestMatch is not None:
+            unmatched.remove(bestMatch)
+            offsets[bestMatch] = (x - groundTruth[bestMatch].x, y - groundTruth[bestMatch].y)
+            truePositives+= 1
+
+    return truePositives, len(fingers) - truePositives, len(unmatched), offsets
+
+def runScenario(width:int, height:int, numFingers:int, numFrames:int, noise:float, exposureJitter:float, seed:int, warmupFrames:int = 5, config:dict = None,
+                downscale:int = 0, colorMode:str = "hsv", detector:str = "contours", outputFilter:str = "none", speed:float = 8,
+                frameRate:float = 60, filterParams:dict = None):
+
+    config = {**(config or {}), "detector": detectorBackends.index(detector)}
+
+    # Note: synthetic fingers cover the whole frame so we clip to all of it
+    source = SyntheticSource(width, height, numFingers, numFrames, noise=noise, exposureJitter=exposureJitter, speed=speed, seed=seed)
+    pad = Touchpad(source, publisher=NullPublisher(), headless=True, config=config, clip=(0, 0, width, height), downscale=downscale, colorMode=colorMode,
+                   tracker=FingerTracker(outputFilter=outputFilter, filterParams=filterParams if outputFilter != "none" else None))
+
+    # Note: published positions are normalized to the clip (the whole frame)
+    getPublishedPoint = lambda finger: ((finger.x + 1)*width/2, (finger.y + 1)*height/2)
+
+    # Note: the background is learned from empty frames of the same noise first, like a table before anyone touches it,
+    #       so stationary fingers are measured against the table rather than against themselves
+    for warmupIndex in range(warmupFrames):
+        noiseFrame = source.noiseFrames[warmupIndex % len(source.noiseFrames)] if source.noiseFrames else None
+        pad.detectFingers(Frame(0, renderSyntheticFrame(width, height, [], noise=noiseFrame), (warmupIndex - warmupFrames)/frameRate))
+
+    pad.profiler.enabled = True
+    truePositives = falsePositives = falseNegatives = 0
+    detectTime = 0
+
+    squaredErrors = []
+    squaredJitters = []
+    lastOffsets = {}
+
+    while pad:
+
+        frame = pad.captureFrame()
+        if frame is None:
+            break
+
+        # Note: only detection is timed since generating synthetic frames isn't free.
+        #       Frames are stamped a camera frame apart (rather than when they were generated) so output filters see a realistic rate
+        frame.captureTime = frame.frameId/frameRate
+        startTime = time.perf_counter()
+        pad.detectFingers(frame)
+        detectTime+= time.perf_counter() - startTime
+
+        tp, fp, fn, offsets = scoreDetections(frame.fingers, source.groundTruth, getPublishedPoint)
+        truePositives+= tp
+        falsePositives+= fp
+        falseNegatives+= fn
+
+        for truthIndex, (dx, dy) in offsets.items():
+            squaredErrors.append(dx*dx + dy*dy)
+            if truthIndex in lastOffsets:
+                lastDx, lastDy = lastOffsets[truthIndex]
+                squaredJitters.append((dx - lastDx)**2 + (dy - lastDy)**2)
+
+        lastOffsets = offsets
+
+    pad.close()
+
+    numDetections = truePositives + falsePositives
+    numTruths = truePositives + falseNegatives
+
+    return {
+        "resolution": f"{width}x{height}",
+        "fingers": numFingers,
+        "downscale": downscale,
+        "colorMode": colorMode,
+        "detector": detector,
+        "filter": outputFilter,
+        "frames": numFrames,
+        "fps": numFrames / detectTime if detectTime > 0 else 0,
+        "precision": truePositives / numDetections if numDetections > 0 else 1,
+        "recall": truePositives / numTruths if numTruths > 0 else 1,
+        "error": math.sqrt(sum(squaredErrors)/len(squaredErrors)) if squaredErrors else None,
+        "jitter": math.sqrt(sum(squaredJitters)/len(squaredJitters)) if squaredJitters else None,
+        "stages": {name: stats.getMean()*1000 for name, stats in pad.profiler.stats.items()},
+    }
+
+# Note: error and jitter are None when no finger was ever matched, which is reported rather than shown as a perfect 0
+def formatResult(result:dict):
+    stagesStr = " | ".join(f"{name} {ms:.2f}ms" for name, ms in result["stages"].items())
+    formatPixels = lambda pixels: "n/a" if pixels is None else f"{pixels:.2f}px"
+    return (
+        f"{result['resolution']:>9} | fingers {result['fingers']:>2} | downscale {result['downscale']} | {result['colorMode']:>5} | {result['detector']:>10} | {result['filter']:>7} | "
+        f"fps {result['fps']:7.1f} | precision {result['precision']:.3f} | recall {result['recall']:.3f} | "
+        f"error {formatPixels(result['error'])} | jitter {formatPixels(result['jitter'])} | {stagesStr}"
+    )
+
+# Runs the same synthetic frames through an HSV touchpad and a `colorMode` touchpad and diffs their fingers
+# Note: `positionTolerance` is in published (normalized clip) coordinates
+def checkParity(width:int, height:int, numFingers:int, numFrames:int, noise:float, exposureJitter:float, seed:int, colorMode:str,
+                config:dict = None, downscale:int = 0, positionTolerance:float = .01):
+
+    pads = [
+        Touchpad(SyntheticSource(width, height, numFingers, numFrames, noise=noise, exposureJitter=exposureJitter, seed=seed),
+                 publisher=NullPublisher(), headless=True, config=config, clip=(0, 0, width, height), downscale=downscale, colorMode=mode)
+        for mode in ["hsv", colorMode]
+    ]
+
+    stats = ReplayStats()
+    while all(pads):
+
+        frames = [pad.captureFrame() for pad in pads]
+        if None in frames:
+            break
+
+        for pad, frame in zip(pads, frames):
+            pad.detectFingers(frame)
+
+        expected, actual = ([getFingerRecord(finger) for finger in frame.fingers] for frame in frames)
+        stats.add(FingerDiff(frames[0].frameId, expected, actual, positionTolerance))
+
+    for pad in pads:
+        pad.close()
+
+    return stats
+
+def runParity(args, config:dict):
+
+    # Note: the single channel modes only apply the value sliders so hue and saturation are opened up for the HSV reference,
+    #       otherwise we'd be measuring how much those sliders reject rather than whether the fast path matches
+    config = {**(config or {}), "hue": [0, 255], "saturation": [0, 255]}
+
+    failed = False
+    for resolution in args.resolutions:
+        width, height = parseResolution(resolution)
+
+        for numFingers in args.fingers:
+            for colorMode in args.color_modes:
+                if colorMode == "hsv":
+                    continue
+
+                stats = checkParity(width, height, numFingers, args.frames, args.noise, args.jitter, args.seed, colorMode, config)
+
+                # Note: the background models see slightly different pixels so a finger right at a filter limit can flip now and then.
+                #       Track ids are ignored since one flip renumbers every later finger
+                mismatchRate = (stats.missing + stats.extra) / max(1, stats.frames*numFingers)
+                matched = mismatchRate <= args.max_mismatch and max(stats.positionDeltas, default=0) <= args.tolerance
+                failed|= not matched
+
+                print(f"{resolution:>9} | fingers {numFingers:>2} | {colorMode:>5} vs hsv | {'OK  ' if matched else 'FAIL'} | {stats}")
+
+    return failed
+
+# Runs `numFrames` frames of a simulated camera running `profileName` through a touchpad, optionally with a ThreadedSource
+def runCapture(profileName:str, threaded:bool, numFingers:int, numFrames:int, noise:float, config:dict = None, colorMode:str = "hsv", warmupFrames:int = 10):
+
+    profile = captureProfiles[profileName]
+    width, height = profile["width"], profile["height"]
+
+    source = SyntheticSource(width, height, numFingers, noise=noise, fps=profile["fps"])
+    if threaded:
+        source = ThreadedSource(source)
+
+    pad = Touchpad(source, publisher=NullPublisher(), headless=True, config=config, clip=(0, 0, width, height), colorMode=colorMode)
+
+    for _ in range(warmupFrames):
+        pad.update()
+
+    for stats in pad.latencyStats.values():
+        stats.reset()
+
+    droppedBefore = getattr(source, "dropped", 0)
+    for _ in range(numFrames):
+        pad.update()
+
+    dropped = getattr(source, "dropped", 0) - droppedBefore
+    pad.close()
+
+    latency = {name: stats.getMean()*1000 for name, stats in pad.latencyStats.items()}
+    return {
+        "profile": profileName,
+        "threaded": threaded,
+        "cameraFps": profile["fps"],
+        "fps": pad.getAchievedFps(),
+        "dropped": dropped,
+        "driverToDetect": latency["driverToCapture"] + latency["captureToDetect"],
+        "latency": latency,
+    }
+
+def formatCaptureResult(result:dict):
+    latency = result["latency"]
+    return (
+        f"{result['profile']:>9} | {'threaded' if result['threaded'] else '  direct'} | camera {result['cameraFps']:>3}fps | achieved {result['fps']:6.1f}fps | "
+        f"dropped {result['dropped']:>4} | driver to detect {result['driverToDetect']:6.2f}ms | capture to detect {latency['captureToDetect']:.2f}ms | detect {latency['detect']:.2f}ms"
+    )
+
+def main():
+
+    argParser = argparse.ArgumentParser(
+        prog = "Benchmark",
+        description ="Benchmarks touchpad finger detection on synthetic frames",
+    )
+
+    argParser.add_argument("-r", "--resolutions", metavar="WxH", nargs="+", default=["640x360", "1280x720", "1920x1080"], help="Frame resolutions to benchmark")
+    argParser.add_argument("-f", "--fingers", metavar="n", nargs="+", type=int, default=[1, 2, 5, 10], help="Finger counts to benchmark")
+    argParser.add_argument("-d", "--downscale", metavar="n", nargs="+", type=int, default=[0], help="Downscale levels to benchmark")
+    argParser.add_argument("-m", "--color-modes", metavar="mode", nargs="+", default=["hsv"], choices=colorModes, help="Color modes to benchmark (see touchpad.colorModes)")
+    argParser.add_argument("-b", "--detectors", metavar="backend", nargs="+", default=["contours"], choices=detectorBackends, help="Detector backends to benchmark (see touchpad.detectorBackends)")
+    argParser.add_argument("-s", "--filters", metavar="filter", nargs="+", default=["none"], choices=outputFilters, help="Output filters to benchmark (see filters.py)")
+    argParser.add_argument("--filter-params", metavar="name=value,...", default=None, help="Settings for every benchmarked output filter (see touchpad.py --filter-params)")
+    argParser.add_argument("--speed", metavar="pixels", type=float, default=8, help="Synthetic finger speed in pixels per frame (0 measures stationary jitter)")
+    argParser.add_argument("--parity", action="store_true", help="Check the single channel color modes find the same fingers as 'hsv' instead of timing")
+    argParser.add_argument("--tolerance", metavar="distance", type=float, default=.01, help="Largest finger position difference --parity accepts (normalized coordinates)")
+    argParser.add_argument("--max-mismatch", metavar="fraction", type=float, default=.01, help="Largest fraction of missing or extra fingers --parity accepts")
+    argParser.add_argument("--capture", action="store_true", help="Simulate the capture profiles read directly and threaded instead of timing detection")
+    argParser.add_argument("-p", "--profiles", metavar="name", nargs="+", default=list(captureProfiles), choices=list(captureProfiles), help="Capture profiles --capture simulates (see framesource.captureProfiles)")
+    argParser.add_argument("-n", "--frames", metavar="n", type=int, default=100, help="Frames per scenario")
+    argParser.add_argument("--noise", metavar="sigma", type=float, default=8, help="Standard deviation of per-pixel noise")
+    argParser.add_argument("--jitter", metavar="fraction", type=float, default=.1, help="Random per-frame exposure variation")
+    argParser.add_argument("--seed", metavar="n", type=int, default=0, help="Seed for the synthetic frames")
+    argParser.add_argument("-c", "--config", metavar="path", default=None, help="JSON file of slider values")
+    argParser.add_argument("-o", "--output", metavar="path", default=None, help="Writes results as JSON to path")
+
+    args = argParser.parse_args()
+
+    # Note: per contour debug logging would dominate the timings
+    touchpad.verboseLevel = LogLevel.Error
+
+    config = None
+    if args.config is not None:
+        with open(args.config) as configFile:
+            config = json.load(configFile)
+
+    if args.parity:
+        sys.exit(1 if runParity(args, config) else 0)
+
+    results = []
+    if args.capture:
+        for profileName in args.profiles:
+            for numFingers in args.fingers:
+                for threaded in [False, True]:
+                    result = runCapture(profileName, threaded, numFingers, args.frames, args.noise, config, args.color_modes[0])
+                    results.append(result)
+                    print(formatCaptureResult(result))
+
+    for resolution in [] if args.capture else args.resolutions:
+        width, height = parseResolution(resolution)
+
+        for numFingers in args.fingers:
+            for downscale in args.downscale:
+                for colorMode in args.color_modes:
+                    for detector in args.detectors:
+                        for outputFilter in args.filters:
+                            result = runScenario(width, height, numFingers, args.frames, args.noise, args.jitter, args.seed, config=config,
+                                                 downscale=downscale, colorMode=colorMode, detector=detector, outputFilter=outputFilter, speed=args.speed,
+                                                 filterParams=parseFilterParams(args.filter_params))
+                            results.append(result)
+                            print(formatResult(result))
+
+                            if result["recall"] == 0:
+                                print("Warning: no fingers were detected so error and jitter weren't measured, check the slider config", file=sys.stderr)
+
+    if args.output is not None:
+        with open(args.output, "w") as outputFile:
+            json.dump(results, outputFile, indent=4)
+
+if __name__ == "__main__":
+    main()
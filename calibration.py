@@ -0,0 +1,203 @@
+# Camera to table calibration
+#
+# Fits lens distortion plus a homography from touches at known table positions and saves the result
+# as JSON. At runtime only the detected finger centers are undistorted and transformed so the
+# correction costs nothing per pixel.
+#
+# Workflow: run `python calibration.py -p <port> -o calibration.json`, touch and hold each highlighted
+# target until it turns green, then load the result with `python touchpad.py --calibration calibration.json`
+
+import argparse
+import json
+import cv2 as cv
+import numpy as np
+
+class Calibration:
+
+    def __init__(self, imageSize:tuple[int, int], cameraMatrix = None, distCoeffs = None, homography = None) -> None:
+        width, height = imageSize
+        self.imageSize = (int(width), int(height))
+
+        # Note: default intrinsics are a pinhole with no distortion centered on the frame
+        self.cameraMatrix = np.float64([[width, 0, width/2], [0, width, height/2], [0, 0, 1]]) if cameraMatrix is None else np.float64(cameraMatrix).reshape(3, 3)
+        self.distCoeffs = np.zeros(5) if distCoeffs is None else np.float64(distCoeffs).ravel()
+        self.homography = np.eye(3) if homography is None else np.float64(homography).reshape(3, 3)
+        self.error = None
+
+    def hasDistortion(self):
+        return np.any(self.distCoeffs != 0)
+
+    # Fits the calibration to camera pixel points touched at known table points in [-1, 1]
+    # Note: a single planar view only constrains a few intrinsics so we fix the principal point, aspect ratio
+    #       and tangential terms and fit focal length plus k1, k2
+    def fit(self, cameraPoints, tablePoints, fitDistortion:bool = True):
+
+        cameraPoints = np.float32(cameraPoints).reshape(-1, 2)
+        tablePoints = np.float32(tablePoints).reshape(-1, 2)
+        assert len(cameraPoints) == len(tablePoints), f"Got {len(cameraPoints)} camera points but {len(tablePoints)} table points"
+        assert len(cameraPoints) >= 4, f"Need at least 4 points to fit a homography, got: {len(cameraPoints)}"
+
+        if fitDistortion:
+            assert len(cameraPoints) >= 8, f"Need at least 8 points to fit lens distortion, got: {len(cameraPoints)}"
+
+            objectPoints = np.hstack([tablePoints, np.zeros((len(tablePoints), 1), dtype=np.float32)])
+            flags = cv.CALIB_USE_INTRINSIC_GUESS | cv.CALIB_FIX_PRINCIPAL_POINT | cv.CALIB_FIX_ASPECT_RATIO | \
+                    cv.CALIB_ZERO_TANGENT_DIST | cv.CALIB_FIX_K3
+
+            _, self.cameraMatrix, distCoeffs, _, _ = cv.calibrateCamera(
+                [objectPoints], [cameraPoints], self.imageSize, self.cameraMatrix, np.zeros(5), flags=flags
+            )
+            self.distCoeffs = distCoeffs.ravel()
+
+        self.homography, _ = cv.findHomography(self.undistort(cameraPoints), tablePoints)
+
+        residuals = self.apply(cameraPoints) - tablePoints
+        self.error = float(np.sqrt(np.mean(np.sum(residuals**2, axis=1))))
+        return self.error
+
+    # Removes lens distortion from an (n, 2) array of camera pixel points
+    def undistort(self, cameraPoints):
+        cameraPoints = np.float64(cameraPoints).reshape(-1, 1, 2)
+        if not self.hasDistortion():
+            return cameraPoints.reshape(-1, 2)
+
+        return cv.undistortPoints(cameraPoints, self.cameraMatrix, self.distCoeffs, P=self.cameraMatrix).reshape(-1, 2)
+
+    # Maps an (n, 2) array of camera pixel points to table coordinates
+    def apply(self, cameraPoints):
+        if len(cameraPoints) == 0:
+            return np.zeros((0, 2))
+
+        undistorted = self.undistort(cameraPoints)
+        return cv.perspectiveTransform(undistorted.reshape(-1, 1, 2), self.homography).reshape(-1, 2)
+
+    def toDict(self):
+        return {
+            "imageSize": list(self.imageSize),
+            "cameraMatrix": self.cameraMatrix.tolist(),
+            "distCoeffs": self.distCoeffs.tolist(),
+            "homography": self.homography.tolist(),
+            "error": self.error,
+        }
+
+    def save(self, path:str):
+        with open(path, "w") as file:
+            json.dump(self.toDict(), file, indent=4)
+
+    @staticmethod
+    def fromDict(data:dict):
+        calibration = Calibration(data["imageSize"], data["cameraMatrix"], data["distCoeffs"], data["homography"])
+        calibration.error = data.get("error")
+        return calibration
+
+    @staticmethod
+    def load(path:str):
+        with open(path) as file:
+            return Calibration.fromDict(json.load(file))
+
+# Returns a row major grid of table points spanning [-margin, margin]
+def getTargetGrid(columns:int, rows:int, margin:float = .8):
+    xs = np.linspace(-margin, margin, columns)
+    ys = np.linspace(-margin, margin, rows)
+    return np.float32([(x, y) for y in ys for x in xs])
+
+def drawTargets(tablePoints, currentIndex:int, size:tuple[int, int] = (640, 360)):
+    width, height = size
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    cv.rectangle(image, (0, 0), (width - 1, height - 1), (255, 255, 255), 2)
+
+    for i, (x, y) in enumerate(tablePoints):
+        center = (int((x + 1)/2*width), int((y + 1)/2*height))
+        color = (0, 255, 0) if i < currentIndex else (0, 0, 255) if i == currentIndex else (128, 128, 128)
+        cv.circle(image, center, 12 if i == currentIndex else 6, color, -1)
+
+    return image
+
+# Touch and hold each target; a sample is taken once a single finger has been stable for `samples` frames
+def collectPoints(pad, tablePoints, samples:int = 30, maxSpread:float = 3):
+
+    cameraPoints = []
+    history = []
+    waitingForLift = False
+
+    while pad and len(cameraPoints) < len(tablePoints):
+        pad.update()
+        pad.draw()
+
+        cv.imshow("Calibration", drawTargets(tablePoints, len(cameraPoints)))
+        if cv.waitKey(1) == 27:
+            return None
+
+        fingers = pad.lastFrame.fingers if pad.lastFrame is not None else []
+        if waitingForLift:
+            waitingForLift = len(fingers) > 0
+            continue
+
+        if len(fingers) != 1:
+            history.clear()
+            continue
+
+        history.append((fingers[0].cameraX, fingers[0].cameraY))
+        history = history[-samples:]
+
+        if len(history) == samples and np.max(np.std(history, axis=0)) <= maxSpread:
+            cameraPoints.append(np.mean(history, axis=0))
+            print(f"Target {len(cameraPoints)}/{len(tablePoints)}: {tablePoints[len(cameraPoints) - 1]} -> {cameraPoints[-1]}")
+
+            history.clear()
+            waitingForLift = True
+
+    return np.float32(cameraPoints) if len(cameraPoints) == len(tablePoints) else None
+
+def main():
+
+    # Note: imported here since touchpad itself imports this module
+    from framesource import openFrameSource
+    from touchpad import NullPublisher, Touchpad
+
+    argParser = argparse.ArgumentParser(
+        prog = "Calibration",
+        description ="Calibrates an EECS 598 IR Touchpad camera to table coordinates",
+    )
+
+    argParser.add_argument("-p", "--port", metavar="n", action="store", default="0", required=False, help="IR Camera port number (or any touchpad input)")
+    argParser.add_argument("-o", "--output", metavar="path", action="store", default="calibration.json", required=False, help="Where to save the calibration")
+    argParser.add_argument("-g", "--grid", metavar="CxR", action="store", default="4x3", required=False, help="Number of target columns and rows")
+    argParser.add_argument("-m", "--margin", metavar="fraction", action="store", default=".8", required=False, help="How far towards the table edges targets are placed")
+    argParser.add_argument("--points", metavar="path", action="store", default=None, required=False, help="Fit from a JSON list of {'camera': [x, y], 'table': [x, y]} instead of touching targets")
+    argParser.add_argument("--size", metavar="WxH", action="store", default="1280x720", required=False, help="Camera image size when fitting from --points")
+    argParser.add_argument("--no-distortion", action="store_true", required=False, help="Only fit a homography")
+
+    args = argParser.parse_args()
+
+    if args.points is not None:
+        with open(args.points) as pointsFile:
+            points = json.load(pointsFile)
+
+        cameraPoints = np.float32([point["camera"] for point in points])
+        tablePoints = np.float32([point["table"] for point in points])
+        imageSize = tuple(int(value) for value in args.size.lower().split("x"))
+
+    else:
+        columns, rows = (int(value) for value in args.grid.lower().split("x"))
+        tablePoints = getTargetGrid(columns, rows, float(args.margin))
+
+        source = openFrameSource(args.port)
+        pad = Touchpad(source, windowName="Touchpad", publisher=NullPublisher(), clip=(0, 0, source.width, source.height))
+        imageSize = (source.width, source.height)
+
+        cameraPoints = collectPoints(pad, tablePoints)
+        pad.close()
+
+        if cameraPoints is None:
+            print("Calibration aborted")
+            return
+
+    calibration = Calibration(imageSize)
+    error = calibration.fit(cameraPoints, tablePoints, fitDistortion=not args.no_distortion and len(cameraPoints) >= 8)
+    calibration.save(args.output)
+
+    print(f"Saved calibration to '{args.output}' (rms error: {error:.4f} table units)")
+
+if __name__ == "__main__":
+    main()
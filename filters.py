@@ -0,0 +1,100 @@
+# Temporal smoothing filters for published finger positions
+#
+# Each tracked finger gets its own filter (see tracker.FingerTracker) so detection jitter is smoothed
+# without blending different fingers together. Filters take a numpy point and a timestamp in seconds:
+#
+#   'ema'     - exponential moving average, a fixed blend of each measurement into the previous output
+#   'oneeuro' - One Euro filter (Casiez et al. 2012), an EMA whose cutoff frequency rises with speed so
+#               stationary fingers are heavily smoothed while fast moves pass through with little lag
+
+import math
+import numpy as np
+
+outputFilters = ["none", "ema", "oneeuro"]
+
+# Returns the EMA weight of a new sample `dt` seconds after the last one for a low pass filter at `cutoff` Hz
+def getSmoothingFactor(dt:float, cutoff:float):
+    timeConstant = 1/(2*math.pi*cutoff)
+    return 1/(1 + timeConstant/dt)
+
+class ExponentialFilter:
+
+    # Note: `alpha` is the weight given to each new measurement (1 disables smoothing)
+    def __init__(self, alpha:float = .5) -> None:
+        self.alpha = alpha
+        self.value:np.ndarray = None
+
+    def reset(self):
+        self.value = None
+
+    def filter(self, value:np.ndarray, timestamp:float):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value = self.value + self.alpha*(value - self.value)
+
+        return self.value
+
+class OneEuroFilter:
+
+    # Note: `minCutoff` (Hz) sets the smoothing of a stationary finger, `beta` how quickly the cutoff rises with
+    #       speed (per touchpad unit/second) and `derivativeCutoff` (Hz) smooths the speed estimate itself
+    def __init__(self, minCutoff:float = 1, beta:float = 100, derivativeCutoff:float = 1) -> None:
+        self.minCutoff = minCutoff
+        self.beta = beta
+        self.derivativeCutoff = derivativeCutoff
+
+        self.value:np.ndarray = None
+        self.derivative:np.ndarray = None
+        self.timestamp:float = None
+
+    def reset(self):
+        self.value = None
+        self.derivative = None
+        self.timestamp = None
+
+    def filter(self, value:np.ndarray, timestamp:float):
+
+        if self.value is None:
+            self.value = value
+            self.derivative = np.zeros_like(value, dtype=np.float64)
+            self.timestamp = timestamp
+            return self.value
+
+        dt = timestamp - self.timestamp
+        if dt <= 0:
+            return self.value
+
+        derivativeAlpha = getSmoothingFactor(dt, self.derivativeCutoff)
+        self.derivative = self.derivative + derivativeAlpha*((value - self.value)/dt - self.derivative)
+
+        cutoff = self.minCutoff + self.beta*float(np.linalg.norm(self.derivative))
+        self.value = self.value + getSmoothingFactor(dt, cutoff)*(value - self.value)
+        self.timestamp = timestamp
+
+        return self.value
+
+# Returns a new filter named `name` (see outputFilters) configured with `params`, None for 'none'
+def createFilter(name:str, params:dict = None):
+    assert name in outputFilters, f"Unknown output filter: '{name}' (expected one of {outputFilters})"
+
+    params = params or {}
+    if name == "ema":
+        return ExponentialFilter(**params)
+
+    if name == "oneeuro":
+        return OneEuroFilter(**params)
+
+    return None
+
+# Parses 'name=value,name=value' into a dict of floats
+def parseFilterParams(paramsStr:str):
+    if not paramsStr:
+        return {}
+
+    params = {}
+    for param in paramsStr.split(","):
+        name, _, value = param.partition("=")
+        params[name.strip()] = float(value)
+
+    return params
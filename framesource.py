@@ -0,0 +1,527 @@
+# Frame sources that feed the touchpad
+#
+# Every source exposes:
+#   read() -> (success, pixels)    - pixels are BGR uint8 images
+#   getFrameTime() -> (captureTime, driverTime)
+#                                  - when the last read frame arrived (monotonic seconds) and the timestamp the driver
+#                                    or container gave it (seconds, on its own clock). Either is None when unknown
+#   setProperty(property, value)   - sets a cv.CAP_PROP_* property (no-op when it doesn't apply)
+#   isOpen() -> bool               - False once the source is exhausted or closed
+#   live                           - True when frames arrive in real time (cameras), False for files and recordings whose
+#                                    driver times are presentation timestamps rather than when the frames were delivered
+#   getInfo() -> str
+#   close()
+#   width, height
+
+import glob
+import math
+import os
+import threading
+import time
+import cv2 as cv
+import numpy as np
+
+from recorder import SessionSource, isSessionDirectory
+
+# Note: name -> requested capture mode. A None 'fourcc' keeps the driver's default pixel format (usually uncompressed YUYV
+#       which USB 2 cameras can only deliver at ~30fps at 720p). MJPEG is compressed on the camera so it reaches 60-120fps,
+#       at the cost of decoding every frame (see ThreadedSource to keep that off the detection thread)
+captureProfiles = {
+    "default":  {"width": 1280, "height": 720, "fps": 30,  "fourcc": None},
+    "mjpeg60":  {"width": 1280, "height": 720, "fps": 60,  "fourcc": "MJPG"},
+    "mjpeg120": {"width": 640,  "height": 480, "fps": 120, "fourcc": "MJPG"},
+    "wide120":  {"width": 640,  "height": 360, "fps": 120, "fourcc": "MJPG"},
+}
+
+def decodeFourcc(value:float):
+    code = int(value)
+    return "".join(chr((code >> 8*i) & 0xFF) for i in range(4)) if code > 0 else "n/a"
+
+class CameraSource:
+
+    # Note: `profile` is a captureProfiles name or a dict like its values
+    def __init__(self, port:int, profile = "default") -> None:
+        self.port = port
+        self.live = True
+        self.camera = cv.VideoCapture(port)
+
+        # Note: VideoCapture isn't thread safe so reads and property changes are serialized
+        self.cameraLock = threading.RLock()
+
+        self.profile = captureProfiles[profile] if isinstance(profile, str) else profile
+
+        # Note: the pixel format has to be set before the size so V4L2 picks a mode that supports it
+        if self.profile.get("fourcc"):
+            self.camera.set(cv.CAP_PROP_FOURCC, cv.VideoWriter_fourcc(*self.profile["fourcc"]))
+
+        self.camera.set(cv.CAP_PROP_FRAME_HEIGHT, self.profile["height"])
+        self.camera.set(cv.CAP_PROP_FRAME_WIDTH, self.profile["width"])
+        self.camera.set(cv.CAP_PROP_FPS, self.profile["fps"])
+
+        # Note: a single driver buffer keeps frames from queueing up behind a slow detector (not every backend supports it)
+        self.camera.set(cv.CAP_PROP_BUFFERSIZE, 1)
+
+        # Note: drivers fall back to the closest mode they support so we keep what was actually negotiated
+        self.width  = int(self.camera.get(cv.CAP_PROP_FRAME_WIDTH)) or self.profile["width"]
+        self.height = int(self.camera.get(cv.CAP_PROP_FRAME_HEIGHT)) or self.profile["height"]
+        self.fps    = self.camera.get(cv.CAP_PROP_FPS) or self.profile["fps"]
+        self.fourcc = decodeFourcc(self.camera.get(cv.CAP_PROP_FOURCC))
+
+        self.frameTime = (None, None)
+
+        # Note: property -> [value, step] of changes read() still has to apply, see setProperty
+        self.pendingProperties:dict[int, list] = {}
+        self.pendingLock = threading.Lock()
+
+        self.setProperty(cv.CAP_PROP_AUTO_EXPOSURE, -1)
+        # self.camera.set(cv.CAP_PROP_AUTO_WB, 0)
+
+    # Note: grab() returns as soon as the driver hands over a frame so it's timestamped before retrieve() decodes it
+    def read(self):
+        with self.cameraLock:
+            if not self.camera.grab():
+                return False, None
+
+            # Note: V4L2 reports the buffer's timestamp here, other backends may report 0
+            driverTime = self.camera.get(cv.CAP_PROP_POS_MSEC)/1000
+            self.frameTime = (time.monotonic(), driverTime if driverTime > 0 else None)
+
+            result = self.camera.retrieve()
+
+            if self.pendingProperties:
+                self.applyPendingProperties()
+
+            return result
+
+    def getFrameTime(self):
+        return self.frameTime
+
+    # Note: Hack to get camera properties to apply
+    #       self.camera.get doesn't report properties correctly
+    #       from experimentation camera properties only apply themselves
+    #       if there is a change from the value they are currently set to.
+    #       So we set value-1 and then value with a frame read in between. Rather than reading extra frames
+    #       and sleeping here, the change is queued and stepped by the next two read() calls so capture never stalls.
+    #       Setting a property again before it finished restarts it with the new value
+    def setProperty(self, property:int, value:int):
+        with self.pendingLock:
+            self.pendingProperties.pop(property, None)
+            self.pendingProperties[property] = [value, 0]
+
+    def applyPendingProperties(self):
+        with self.pendingLock:
+            for property, state in list(self.pendingProperties.items()):
+                value, step = state
+                self.camera.set(property, value-1 if step == 0 else value)
+
+                if step == 0:
+                    state[1] = 1
+                else:
+                    del self.pendingProperties[property]
+
+    def hasPendingProperties(self):
+        return len(self.pendingProperties) > 0
+
+    def getProperty(self, property:int):
+        with self.cameraLock:
+            return self.camera.get(property)
+
+    def isOpen(self):
+        return self.camera.isOpened()
+
+    def getInfo(self):
+        props = [
+            "CAP_PROP_APERTURE",
+            "CAP_PROP_AUTOFOCUS",
+            "CAP_PROP_AUTO_EXPOSURE",
+            "CAP_PROP_AUTO_WB",
+            "CAP_PROP_BACKLIGHT",
+            "CAP_PROP_BITRATE",
+            "CAP_PROP_BRIGHTNESS",
+            "CAP_PROP_CODEC_PIXEL_FORMAT",
+            "CAP_PROP_CONTRAST",
+            "CAP_PROP_CONVERT_RGB",
+            "CAP_PROP_EXPOSURE",
+            "CAP_PROP_FPS",
+            "CAP_PROP_FRAME_HEIGHT",
+            "CAP_PROP_FRAME_WIDTH",
+            "CAP_PROP_GAIN",
+            "CAP_PROP_GAMMA",
+            "CAP_PROP_ISO_SPEED",
+            "CAP_PROP_MODE",
+            "CAP_PROP_MONOCHROME",
+            "CAP_PROP_SATURATION",
+            "CAP_PROP_SETTINGS",
+            "CAP_PROP_SHARPNESS",
+            "CAP_PROP_SPEED",
+            "CAP_PROP_WB_TEMPERATURE",
+            "CAP_PROP_ZOOM",
+        ]
+
+        profile = self.profile
+        infoStr = "Camera Info: {\n"
+        infoStr+= f"\tRequested: {profile['width']}x{profile['height']} @ {profile['fps']}fps {profile.get('fourcc') or 'default format'}\n"
+        infoStr+= f"\tNegotiated: {self.width}x{self.height} @ {self.fps:g}fps {self.fourcc}\n"
+        for prop in props:
+            infoStr+= f"\t{prop}: {self.getProperty(getattr(cv, prop))}\n"
+
+        return infoStr+"}\n"
+
+    def close(self):
+        with self.cameraLock:
+            self.camera.release()
+
+class VideoFileSource:
+
+    def __init__(self, path:str, loop:bool = False) -> None:
+        self.path = os.path.abspath(path)
+        self.loop = loop
+        self.live = False
+
+        self.video = cv.VideoCapture(self.path)
+        assert self.video.isOpened(), f"Failed to open video: '{self.path}'"
+
+        self.width  = int(self.video.get(cv.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.video.get(cv.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.video.get(cv.CAP_PROP_FPS)
+        self.exhausted = False
+
+    def read(self):
+        success, pixels = self.video.read()
+
+        if not success and self.loop:
+            self.video.set(cv.CAP_PROP_POS_FRAMES, 0)
+            success, pixels = self.video.read()
+
+        self.exhausted = not success
+        return success, pixels
+
+    # Note: the driver time of a video frame is its presentation timestamp
+    def getFrameTime(self):
+        return None, self.video.get(cv.CAP_PROP_POS_MSEC)/1000
+
+    def setProperty(self, property:int, value:int):
+        pass
+
+    def isOpen(self):
+        return self.video.isOpened() and not self.exhausted
+
+    def getInfo(self):
+        return f"Video Info: {{ path: {self.path} | size: {self.width}x{self.height} | fps: {self.fps} }}\n"
+
+    def close(self):
+        self.video.release()
+
+class ImageDirectorySource:
+
+    def __init__(self, path:str, loop:bool = False, extensions:list[str] = [".png", ".jpg", ".jpeg", ".bmp", ".tiff"]) -> None:
+        self.path = os.path.abspath(path)
+        self.loop = loop
+        self.live = False
+
+        self.imagePaths = sorted(
+            imagePath for imagePath in glob.glob(os.path.join(self.path, "*"))
+            if os.path.splitext(imagePath)[1].lower() in extensions
+        )
+        assert len(self.imagePaths) > 0, f"No images found in: '{self.path}'"
+
+        self.imageIndex = 0
+
+        firstImage = cv.imread(self.imagePaths[0], cv.IMREAD_COLOR)
+        self.height, self.width = firstImage.shape[:2]
+
+    def read(self):
+
+        if self.imageIndex >= len(self.imagePaths):
+            if not self.loop:
+                return False, None
+
+            self.imageIndex = 0
+
+        pixels = cv.imread(self.imagePaths[self.imageIndex], cv.IMREAD_COLOR)
+        self.imageIndex+= 1
+
+        return pixels is not None, pixels
+
+    def getFrameTime(self):
+        return None, None
+
+    def setProperty(self, property:int, value:int):
+        pass
+
+    def isOpen(self):
+        return self.loop or self.imageIndex < len(self.imagePaths)
+
+    def getInfo(self):
+        return f"Image Directory Info: {{ path: {self.path} | images: {len(self.imagePaths)} | size: {self.width}x{self.height} }}\n"
+
+    def close(self):
+        pass
+
+class SyntheticFinger:
+    def __init__(self, x, y, d1, d2, angle, vx, vy) -> None:
+        self.x = x
+        self.y = y
+        self.d1 = d1
+        self.d2 = d2
+        self.angle = angle
+        self.vx = vx
+        self.vy = vy
+
+    def getEllipse(self):
+        return (self.x, self.y), (self.d1, self.d2), self.angle
+
+# Note: Colors are BGR. fingerColor is the touchpad's default target color
+def renderSyntheticFrame(width:int, height:int, fingers:list[SyntheticFinger], exposure:float = 1,
+                         backgroundColor = (20, 20, 20), fingerColor = (227, 203, 210), noise:np.ndarray = None):
+
+    background = tuple(min(255, c*exposure) for c in backgroundColor)
+    color = tuple(min(255, c*exposure) for c in fingerColor)
+
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[:] = background
+
+    for finger in fingers:
+        cv.ellipse(pixels, finger.getEllipse(), color, -1, cv.LINE_AA)
+
+    if noise is not None:
+        pixels = cv.add(pixels, noise, dtype=cv.CV_8U)
+
+    return pixels
+
+# Note: Generates frames of elliptical IR blobs bouncing around the table.
+#       `groundTruth` holds the fingers drawn in the most recently read frame.
+#       With an `fps` reads are paced like a camera: frames are exposed on a fixed clock (their driver time) and a driver
+#       queue of `driverQueue` frames holds the ones nobody read yet, so a slow reader gets stale frames like it would from a camera
+class SyntheticSource:
+
+    def __init__(self, width:int = 1280, height:int = 720, numFingers:int = 2, numFrames:int = None, noise:float = 8,
+                 exposure:float = 1, exposureJitter:float = 0, diameterRange = (30, 60), speed:float = 8, seed:int = 0,
+                 fps:float = None, driverQueue:int = 4) -> None:
+
+        self.width = width
+        self.height = height
+        self.numFrames = numFrames
+        self.exposure = exposure
+        self.exposureJitter = exposureJitter
+        self.diameterRange = diameterRange
+        self.speed = speed
+        self.fps = fps
+        self.driverQueue = driverQueue
+
+        # Note: paced synthetic frames stand in for a camera, unpaced ones have no driver times
+        self.live = True
+
+        self.startTime:float = None
+        self.clockIndex = -1
+        self.frameTime = (None, None)
+
+        self.rng = np.random.default_rng(seed)
+        self.frameIndex = 0
+        self.fingers = [self.createFinger() for _ in range(numFingers)]
+        self.groundTruth:list[SyntheticFinger] = []
+
+        # Note: generating gaussian noise for every frame costs more than detection so we cycle through a few precomputed noise frames
+        numNoiseFrames = 4
+        self.noiseFrames = [
+            self.rng.normal(0, noise, (height, width, 3)).astype(np.int16) for _ in range(numNoiseFrames)
+        ] if noise > 0 else []
+
+    def createFinger(self):
+        d1, d2 = self.rng.uniform(*self.diameterRange, 2)
+        maxDiameter = max(d1, d2)
+
+        x = self.rng.uniform(maxDiameter, self.width - maxDiameter)
+        y = self.rng.uniform(maxDiameter, self.height - maxDiameter)
+
+        heading = self.rng.uniform(0, 2*math.pi)
+        vx = self.speed*math.cos(heading)
+        vy = self.speed*math.sin(heading)
+
+        return SyntheticFinger(x, y, d1, d2, self.rng.uniform(0, 180), vx, vy)
+
+    def moveFingers(self):
+        for finger in self.fingers:
+            radius = max(finger.d1, finger.d2)/2
+
+            finger.x+= finger.vx
+            if not (radius <= finger.x <= self.width - radius):
+                finger.vx = -finger.vx
+                finger.x = min(max(finger.x, radius), self.width - radius)
+
+            finger.y+= finger.vy
+            if not (radius <= finger.y <= self.height - radius):
+                finger.vy = -finger.vy
+                finger.y = min(max(finger.y, radius), self.height - radius)
+
+    # Note: sleeps until the next frame on the camera clock is exposed and returns its driver time
+    def waitForFrame(self):
+        now = time.monotonic()
+        if self.startTime is None:
+            self.startTime = now
+
+        # Note: frames older than the driver queue were overwritten before we got to them
+        exposedIndex = int((now - self.startTime)*self.fps)
+        self.clockIndex = max(self.clockIndex + 1, exposedIndex - self.driverQueue + 1)
+
+        driverTime = self.startTime + self.clockIndex/self.fps
+        if driverTime > now:
+            time.sleep(driverTime - now)
+
+        return driverTime
+
+    def read(self):
+
+        if not self.isOpen():
+            return False, None
+
+        driverTime = None if self.fps is None else self.waitForFrame()
+
+        if self.frameIndex > 0:
+            self.moveFingers()
+
+        exposure = self.exposure
+        if self.exposureJitter > 0:
+            exposure*= 1 + self.rng.uniform(-self.exposureJitter, self.exposureJitter)
+
+        noise = self.noiseFrames[self.frameIndex % len(self.noiseFrames)] if self.noiseFrames else None
+        pixels = renderSyntheticFrame(self.width, self.height, self.fingers, exposure, noise=noise)
+
+        self.groundTruth = [
+            SyntheticFinger(f.x, f.y, f.d1, f.d2, f.angle, f.vx, f.vy) for f in self.fingers
+        ]
+
+        # Note: synthetic driver times share the monotonic clock, rendering stands in for the transfer and decode
+        if driverTime is not None:
+            self.frameTime = (time.monotonic(), driverTime)
+
+        self.frameIndex+= 1
+        return True, pixels
+
+    def getFrameTime(self):
+        return self.frameTime
+
+    def setProperty(self, property:int, value:int):
+        pass
+
+    def isOpen(self):
+        return self.numFrames is None or self.frameIndex < self.numFrames
+
+    def getInfo(self):
+        return f"Synthetic Info: {{ size: {self.width}x{self.height} | fingers: {len(self.fingers)} | frames: {self.numFrames} | fps: {self.fps} }}\n"
+
+    def close(self):
+        pass
+
+# Note: Reads `source` on a worker thread as fast as it delivers frames and keeps only the newest one, so detection
+#       always gets the latest frame instead of one that sat in the driver's queue, and decoding (e.g. MJPEG) happens
+#       off the detection thread. Frames replaced before anybody read them are counted in `dropped`.
+#       Failed reads back off exponentially from `failureBackoff` up to `maxFailureBackoff` seconds so a stalled or unplugged
+#       camera doesn't spin a core, and `maxFailures` of them in a row stop the worker which closes the source
+class ThreadedSource:
+
+    def __init__(self, source, maxFailures:int = 50, failureBackoff:float = .001, maxFailureBackoff:float = .1) -> None:
+        self.source = source
+        self.maxFailures = maxFailures
+        self.failureBackoff = failureBackoff
+        self.maxFailureBackoff = maxFailureBackoff
+        self.failures = 0
+        self.width = source.width
+        self.height = source.height
+        self.live = getattr(source, "live", False)
+
+        # Note: (pixels, captureTime, driverTime) of the newest unread frame
+        self.latest:tuple = None
+        self.frameTime = (None, None)
+        self.condition = threading.Condition()
+
+        self.captured = 0
+        self.dropped = 0
+        self.startTime = time.monotonic()
+
+        self.running = True
+        self.thread = threading.Thread(target=self.captureLoop, name="FrameCapture", daemon=True)
+        self.thread.start()
+
+    def captureLoop(self):
+
+        while self.running and self.source.isOpen():
+            success, pixels = self.source.read()
+            if not success:
+                self.failures+= 1
+                if self.failures >= self.maxFailures:
+                    break
+
+                time.sleep(min(self.maxFailureBackoff, self.failureBackoff*2**(self.failures - 1)))
+                continue
+
+            self.failures = 0
+
+            captureTime, driverTime = self.source.getFrameTime()
+            if captureTime is None:
+                captureTime = time.monotonic()
+
+            with self.condition:
+                if self.latest is not None:
+                    self.dropped+= 1
+
+                self.latest = (pixels, captureTime, driverTime)
+                self.captured+= 1
+                self.condition.notify()
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    # Note: blocks until a frame newer than the last one read arrives
+    def read(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.latest is not None or not self.running)
+            if self.latest is None:
+                return False, None
+
+            pixels, *frameTime = self.latest
+            self.frameTime = tuple(frameTime)
+            self.latest = None
+
+        return True, pixels
+
+    def getFrameTime(self):
+        return self.frameTime
+
+    def getCaptureRate(self):
+        elapsed = time.monotonic() - self.startTime
+        return self.captured/elapsed if elapsed > 0 else 0
+
+    def setProperty(self, property:int, value:int):
+        self.source.setProperty(property, value)
+
+    def isOpen(self):
+        return self.running or self.latest is not None
+
+    def getInfo(self):
+        return self.source.getInfo() + f"Threaded Capture: {{ captured: {self.captured} | dropped: {self.dropped} | failed reads: {self.failures} | fps: {self.getCaptureRate():.1f} }}\n"
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=1)
+        self.source.close()
+
+# Note: `spec` is a camera port, a video file, a directory of images, a recorded session or 'synthetic'.
+#       `captureProfile` (see captureProfiles) configures cameras, synthetic frames simulate a camera running it
+def openFrameSource(spec:str, loop:bool = False, captureProfile:str = None):
+
+    if spec == "synthetic":
+        if captureProfile is None:
+            return SyntheticSource()
+
+        profile = captureProfiles[captureProfile]
+        return SyntheticSource(profile["width"], profile["height"], fps=profile["fps"])
+
+    if os.path.isdir(spec):
+        return SessionSource(spec, loop) if isSessionDirectory(spec) else ImageDirectorySource(spec, loop)
+
+    if os.path.isfile(spec):
+        return VideoFileSource(spec, loop)
+
+    return CameraSource(int(spec), captureProfile or "default")
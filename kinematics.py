@@ -0,0 +1,198 @@
+# Paddle kinematics from tracked fingers
+#
+# Every track keeps its last `window` raw detections and a quadratic (position + velocity*t + acceleration*t^2/2)
+# is fitted to them by least squares at their real capture times. Velocity and acceleration are the derivatives
+# of the same fit at the newest detection so they're consistent with each other, tolerate frame time jitter and
+# update at the full detection rate. Consumers can turn them straight into impulses rather than differencing
+# positions they polled (see the Unity forceCalculator). Fits are batched so one solve covers every track.
+#
+# The harness replays the fingers recorded in sessions (see recorder.py) through the same batched fit:
+#
+#   python kinematics.py session                    - velocity/acceleration ranges and prediction errors of each track
+#   python kinematics.py session --pucks 1024       - also bounces a batch of simulated pucks off the recorded paddles and
+#                                                     compares impulses from fitted kinematics against 50ms polled positions
+
+import argparse
+import math
+import numpy as np
+
+# Note: only keeps singular rows (padding, too few samples for a term) solvable, small enough not to bias real fits
+fitRidge = 1e-9
+
+# Returns (velocity, acceleration) each (B, 2) of quadratics fitted to B rows of samples, evaluated at time 0
+# Note: `times` (B, N) are relative to the time the estimates are for, `positions` is (B, N, 2) and `valid` (B, N) masks padding.
+#       Rows with fewer than 3 valid samples get no acceleration and rows with fewer than 2 no velocity
+def fitKinematics(times:np.ndarray, positions:np.ndarray, valid:np.ndarray):
+
+    count = valid.sum(axis=1)
+
+    # Note: times are scaled to each window's span so the normal equations stay well conditioned
+    span = np.abs(np.where(valid, times, 0)).max(axis=1)
+    scale = np.where(span > 0, span, 1)
+    t = times/scale[:, np.newaxis]
+
+    basis = np.stack([np.ones_like(t), t, t*t/2], axis=2)*valid[..., np.newaxis]
+    basis[..., 1]*= (count >= 2)[:, np.newaxis]
+    basis[..., 2]*= (count >= 3)[:, np.newaxis]
+
+    basisT = basis.transpose(0, 2, 1)
+    coefficients = np.linalg.solve(basisT @ basis + fitRidge*np.eye(3), basisT @ positions)
+
+    velocity = coefficients[:, 1]/scale[:, np.newaxis]
+    acceleration = coefficients[:, 2]/(scale*scale)[:, np.newaxis]
+    return velocity, acceleration
+
+# Returns (velocity, acceleration) each (n, 2) for every sample of a track from the `window` samples ending at it
+# Note: `times` (n,) and `positions` (n, 2) are one track's samples in order
+def getTrackKinematics(times:np.ndarray, positions:np.ndarray, window:int):
+
+    # Note: the first samples are padded with invalid ones so every sample gets a full window
+    paddedTimes = np.concatenate([np.full(window - 1, times[0]), times])
+    paddedPositions = np.concatenate([np.repeat(positions[:1], window - 1, axis=0), positions])
+    paddedValid = np.concatenate([np.zeros(window - 1, dtype=bool), np.ones(len(times), dtype=bool)])
+
+    windowTimes = np.lib.stride_tricks.sliding_window_view(paddedTimes, window)
+    windowPositions = np.lib.stride_tricks.sliding_window_view(paddedPositions, window, axis=0).transpose(0, 2, 1)
+    windowValid = np.lib.stride_tricks.sliding_window_view(paddedValid, window)
+
+    return fitKinematics(windowTimes - times[:, np.newaxis], windowPositions, windowValid)
+
+# Returns {trackId: (times, positions)} of the fingers recorded in a session
+# Note: recorded positions are the published ones so they include the tracker's output filter
+def loadTracks(reader):
+    fields = reader.header.get("fingerFields")
+    xIndex, yIndex, idIndex = (fields.index(name) for name in ["x", "y", "id"])
+
+    samples:dict[int, list] = {}
+    for entry in reader.entries:
+        for finger in entry["fingers"]:
+            if finger[idIndex] >= 0:
+                samples.setdefault(finger[idIndex], []).append((entry["captureTime"], finger[xIndex], finger[yIndex]))
+
+    return {trackId: (np.array(trackSamples)[:, 0], np.array(trackSamples)[:, 1:]) for trackId, trackSamples in samples.items()}
+
+# Returns the RMS distance between positions extrapolated `horizon` seconds ahead and where the track actually was
+# Note: `acceleration` None extrapolates with constant velocity. Samples without a recorded position `horizon` later are skipped
+def getPredictionError(times:np.ndarray, positions:np.ndarray, velocity:np.ndarray, acceleration:np.ndarray, horizon:float):
+
+    inRange = times + horizon <= times[-1]
+    if not inRange.any():
+        return math.nan
+
+    predicted = positions + velocity*horizon
+    if acceleration is not None:
+        predicted+= acceleration*horizon*horizon/2
+
+    futureTimes = times[inRange] + horizon
+    actual = np.stack([np.interp(futureTimes, times, positions[:, axis]) for axis in range(2)], axis=1)
+    return float(np.sqrt(np.mean(np.sum((predicted[inRange] - actual)**2, axis=1))))
+
+# Returns the velocity (n, 2) a consumer polling positions every `pollInterval` seconds would difference out at each sample
+def getPolledVelocity(times:np.ndarray, positions:np.ndarray, pollInterval:float):
+    pollTimes = times[0] + np.floor((times - times[0])/pollInterval)*pollInterval
+    previousTimes = np.maximum(pollTimes - pollInterval, times[0])
+
+    current = np.stack([np.interp(pollTimes, times, positions[:, axis]) for axis in range(2)], axis=1)
+    previous = np.stack([np.interp(previousTimes, times, positions[:, axis]) for axis in range(2)], axis=1)
+
+    dt = (pollTimes - previousTimes)[:, np.newaxis]
+    return np.divide(current - previous, dt, out=np.zeros_like(current), where=dt > 0)
+
+# Note: Simulates `numPucks` independent pucks on the [-1, 1] table against recorded paddle tracks, every puck at once.
+#       Paddles are infinitely heavy so a hit reflects the puck's velocity relative to the paddle along the contact normal.
+#       `paddleVelocities` maps track ids to the velocity used for the impulse at each of the track's samples
+#       Returns (hits, impulses) where impulses are the puck speed changes of every hit
+def simulatePucks(tracks:dict, paddleVelocities:dict, numPucks:int = 256, puckRadius:float = .05, paddleRadius:float = .08,
+                  restitution:float = .9, seed:int = 0):
+
+    rng = np.random.default_rng(seed)
+    puckPositions = rng.uniform(-1 + puckRadius, 1 - puckRadius, (numPucks, 2))
+    puckVelocities = np.zeros((numPucks, 2))
+
+    # Note: one step per recorded frame, paddles that weren't seen in a frame don't collide in it
+    frameTimes = np.unique(np.concatenate([times for times, _ in tracks.values()]))
+    hits = 0
+    impulses = []
+
+    for frameIndex in range(1, len(frameTimes)):
+        timestamp = frameTimes[frameIndex]
+        puckPositions+= puckVelocities*(timestamp - frameTimes[frameIndex - 1])
+
+        # Note: bounce off the table edges
+        outside = np.abs(puckPositions) > 1 - puckRadius
+        puckVelocities[outside]*= -restitution
+        puckPositions = np.clip(puckPositions, -1 + puckRadius, 1 - puckRadius)
+
+        for trackId, (times, positions) in tracks.items():
+            sampleIndex = np.searchsorted(times, timestamp)
+            if sampleIndex >= len(times) or times[sampleIndex] != timestamp:
+                continue
+
+            offsets = puckPositions - positions[sampleIndex]
+            distances = np.linalg.norm(offsets, axis=1)
+            normals = offsets/np.maximum(distances, 1e-9)[:, np.newaxis]
+
+            relativeSpeeds = np.sum((puckVelocities - paddleVelocities[trackId][sampleIndex])*normals, axis=1)
+            contacts = (distances < puckRadius + paddleRadius) & (relativeSpeeds < 0)
+            if not contacts.any():
+                continue
+
+            deltas = -(1 + restitution)*relativeSpeeds[contacts]
+            puckVelocities[contacts]+= deltas[:, np.newaxis]*normals[contacts]
+            puckPositions[contacts] = positions[sampleIndex] + normals[contacts]*(puckRadius + paddleRadius)
+
+            hits+= int(contacts.sum())
+            impulses.append(deltas)
+
+    return hits, np.concatenate(impulses) if impulses else np.zeros(0)
+
+def main():
+
+    # Note: imported here so the tracker doesn't pull in the recorder
+    from recorder import SessionReader
+
+    argParser = argparse.ArgumentParser(
+        prog = "Kinematics",
+        description ="Replays recorded EECS 598 IR Touchpad finger tracks through the batched kinematics fit",
+    )
+
+    argParser.add_argument("sessions", metavar="path", nargs="+", help="Session directories recorded with touchpad.py --record")
+    argParser.add_argument("-w", "--window", metavar="n", type=int, default=6, help="Detections per kinematics fit")
+    argParser.add_argument("--horizon", metavar="seconds", type=float, default=.05, help="How far ahead predictions are checked")
+    argParser.add_argument("--pucks", metavar="n", type=int, default=0, help="Simulated pucks to bounce off the recorded paddles (0 skips the simulation)")
+    argParser.add_argument("--poll", metavar="seconds", type=float, default=.05, help="Position polling interval the simulation compares against")
+    argParser.add_argument("--seed", metavar="n", type=int, default=0, help="Seed for the simulated pucks")
+
+    args = argParser.parse_args()
+
+    for sessionPath in args.sessions:
+        reader = SessionReader(sessionPath)
+        tracks = {trackId: track for trackId, track in loadTracks(reader).items() if len(track[0]) > 1}
+        reader.close()
+
+        print(f"Session '{sessionPath}': {len(tracks)} tracks")
+
+        fittedVelocities = {}
+        for trackId, (times, positions) in tracks.items():
+            velocity, acceleration = getTrackKinematics(times, positions, args.window)
+            fittedVelocities[trackId] = velocity
+
+            speeds = np.linalg.norm(velocity, axis=1)
+            accelerations = np.linalg.norm(acceleration, axis=1)
+            constantVelocityError = getPredictionError(times, positions, velocity, None, args.horizon)
+            constantAccelerationError = getPredictionError(times, positions, velocity, acceleration, args.horizon)
+
+            print(f"\tTrack {trackId}: samples {len(times)} | speed mean {speeds.mean():.3f} max {speeds.max():.3f} | "
+                  f"acceleration mean {accelerations.mean():.2f} max {accelerations.max():.2f} | "
+                  f"{args.horizon*1000:g}ms prediction error: constant velocity {constantVelocityError:.4f} constant acceleration {constantAccelerationError:.4f}")
+
+        if args.pucks > 0 and tracks:
+            polledVelocities = {trackId: getPolledVelocity(times, positions, args.poll) for trackId, (times, positions) in tracks.items()}
+
+            for name, velocities in [("fitted", fittedVelocities), (f"polled {args.poll*1000:g}ms", polledVelocities)]:
+                hits, impulses = simulatePucks(tracks, velocities, args.pucks, seed=args.seed)
+                impulseStr = f"mean {impulses.mean():.3f} max {impulses.max():.3f}" if hits > 0 else "n/a"
+                print(f"\tPucks ({name} paddle velocity): hits {hits} | impulse {impulseStr}")
+
+if __name__ == "__main__":
+    main()
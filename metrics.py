@@ -0,0 +1,244 @@
+# Prometheus style metrics for the touchpad
+#
+# A MetricsRegistry hands out counters, gauges and histograms and renders them in the Prometheus text format.
+# Metrics can be scraped from a local HTTP endpoint (MetricsServer) or written to a snapshot file.
+#
+# A disabled registry hands out shared no-op metrics so instrumented hot paths cost a method call and
+# callers can check `registry.enabled` to skip work that only feeds metrics.
+
+import bisect
+import http.server
+import json
+import math
+import os
+import threading
+
+# Note: seconds, tuned for a 30-120fps camera loop
+defaultLatencyBuckets = [.001, .0025, .005, .0075, .01, .015, .02, .03, .05, .075, .1, .25, .5, 1]
+
+def formatLabels(labels:dict):
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+def formatValue(value:float):
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, labels:dict = None) -> None:
+        self.labels = labels or {}
+        self.value = 0
+
+    def inc(self, amount:float = 1):
+        self.value+= amount
+
+    def getSamples(self, name:str):
+        return [(name, self.labels, self.value)]
+
+    def toDict(self):
+        return self.value
+
+# Note: reads its value from `getValue` at export time so things that already count (e.g. queue drops) cost nothing extra
+class CallbackCounter:
+    def __init__(self, getValue, labels:dict = None) -> None:
+        self.getValue = getValue
+        self.labels = labels or {}
+
+    def inc(self, amount:float = 1):
+        pass
+
+    def getSamples(self, name:str):
+        return [(name, self.labels, self.getValue())]
+
+    def toDict(self):
+        return self.getValue()
+
+# Note: reads its value from `getValue` at export time like CallbackCounter but can go down
+class CallbackGauge:
+    def __init__(self, getValue, labels:dict = None) -> None:
+        self.getValue = getValue
+        self.labels = labels or {}
+
+    def getSamples(self, name:str):
+        return [(name, self.labels, self.getValue())]
+
+    def toDict(self):
+        return self.getValue()
+
+class Histogram:
+    def __init__(self, buckets:list[float], labels:dict = None) -> None:
+        self.buckets = sorted(buckets)
+        self.labels = labels or {}
+
+        # Note: counts are per bucket (not cumulative) until they're exported
+        self.bucketCounts = [0]*(len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value:float):
+        self.bucketCounts[bisect.bisect_left(self.buckets, value)]+= 1
+        self.sum+= value
+        self.count+= 1
+
+    def getSamples(self, name:str):
+        samples = []
+
+        cumulativeCount = 0
+        for upperBound, bucketCount in zip(self.buckets + [math.inf], self.bucketCounts):
+            cumulativeCount+= bucketCount
+            samples.append((f"{name}_bucket", {**self.labels, "le": formatValue(upperBound)}, cumulativeCount))
+
+        samples.append((f"{name}_sum", self.labels, self.sum))
+        samples.append((f"{name}_count", self.labels, self.count))
+        return samples
+
+    def toDict(self):
+        return {"sum": self.sum, "count": self.count, "buckets": dict(zip([formatValue(bound) for bound in self.buckets + [math.inf]], self.bucketCounts))}
+
+# Note: exports stage timings (see touchpad.StageProfiler) as a summary without touching the hot path
+class StatsSummary:
+    def __init__(self, getStats, labelName:str) -> None:
+        self.getStats = getStats
+        self.labelName = labelName
+        self.labels = {}
+
+    def getSamples(self, name:str):
+        samples = []
+        for stats in list(self.getStats()):
+            labels = {self.labelName: stats.name}
+            samples.append((f"{name}_sum", labels, stats.total))
+            samples.append((f"{name}_count", labels, stats.count))
+
+        return samples
+
+    def toDict(self):
+        return {stats.name: {"sum": stats.total, "count": stats.count, "max": stats.max} for stats in list(self.getStats())}
+
+class NullMetric:
+    def inc(self, amount:float = 1):
+        pass
+
+    def observe(self, value:float):
+        pass
+
+class MetricsRegistry:
+
+    nullMetric = NullMetric()
+
+    def __init__(self, enabled:bool = False, prefix:str = "touchpad_") -> None:
+        self.enabled = enabled
+        self.prefix = prefix
+
+        # Note: name -> (type, help, {labelsKey: metric})
+        self.families:dict[str, tuple[str, str, dict]] = {}
+        self.lock = threading.Lock()
+
+    def register(self, name:str, metricType:str, help:str, labels:dict, createMetric):
+        if not self.enabled:
+            return self.nullMetric
+
+        name = self.prefix + name
+        labelsKey = tuple(sorted((labels or {}).items()))
+
+        with self.lock:
+            family = self.families.setdefault(name, (metricType, help, {}))
+            assert family[0] == metricType, f"Metric '{name}' is already registered as a {family[0]}"
+
+            series = family[2]
+            if labelsKey not in series:
+                series[labelsKey] = createMetric()
+
+            return series[labelsKey]
+
+    def counter(self, name:str, help:str, labels:dict = None):
+        return self.register(name, "counter", help, labels, lambda: Counter(labels))
+
+    def callbackCounter(self, name:str, help:str, getValue, labels:dict = None):
+        return self.register(name, "counter", help, labels, lambda: CallbackCounter(getValue, labels))
+
+    def callbackGauge(self, name:str, help:str, getValue, labels:dict = None):
+        return self.register(name, "gauge", help, labels, lambda: CallbackGauge(getValue, labels))
+
+    def histogram(self, name:str, help:str, buckets:list[float] = defaultLatencyBuckets, labels:dict = None):
+        return self.register(name, "histogram", help, labels, lambda: Histogram(buckets, labels))
+
+    def statsSummary(self, name:str, help:str, getStats, labelName:str):
+        return self.register(name, "summary", help, None, lambda: StatsSummary(getStats, labelName))
+
+    # Returns every metric in the Prometheus text exposition format
+    def render(self):
+        lines = []
+
+        with self.lock:
+            families = [(name, metricType, help, list(series.values())) for name, (metricType, help, series) in self.families.items()]
+
+        for name, metricType, help, metrics in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metricType}")
+
+            for metric in metrics:
+                for sampleName, labels, value in metric.getSamples(name):
+                    lines.append(f"{sampleName}{formatLabels(labels)} {formatValue(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def toDict(self):
+        snapshot = {}
+
+        with self.lock:
+            families = [(name, list(series.values())) for name, (_, _, series) in self.families.items()]
+
+        for name, metrics in families:
+            if len(metrics) == 1 and not metrics[0].labels:
+                snapshot[name] = metrics[0].toDict()
+            else:
+                snapshot[name] = {formatLabels(metric.labels): metric.toDict() for metric in metrics}
+
+        return snapshot
+
+    # Atomically writes a JSON snapshot of every metric to `path`
+    def writeSnapshot(self, path:str):
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "w") as snapshotFile:
+            json.dump(self.toDict(), snapshotFile, indent=4)
+
+        os.replace(tmpPath, path)
+
+# Note: serves the registry on http://host:port/metrics from a daemon thread
+class MetricsServer:
+
+    def __init__(self, registry:MetricsRegistry, port:int, host:str = "127.0.0.1") -> None:
+        self.registry = registry
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?")[0] != "/metrics":
+                    handler.send_error(404)
+                    return
+
+                body = registry.render().encode()
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            # Note: keeps scrapes out of the console
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True)
+        self.thread.start()
+
+    def getAddress(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
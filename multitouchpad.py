@@ -0,0 +1,267 @@
+# Multi-camera touchpad
+#
+# Runs one headless Touchpad per camera in its own worker process and merges their fingers into
+# a shared table coordinate space that is published as a single frame per tick.
+#
+# Cameras are described by a JSON file:
+#
+#   {
+#       "tickRate": 60,                       - merged frames published per second
+#       "mergeDistance": 0.1,                 - table distance under which fingers from different cameras are the same finger
+#       "maxAge": 0.1,                        - seconds before a camera's last frame is considered stale
+#       "cameras": [
+#           {
+#               "source": 0,                  - camera port, video file or image directory (see framesource.openFrameSource)
+#               "clip": [0, 0, 1280, 720],    - optional, see Touchpad.setDetectionRegion
+#               "downscale": 0,               - optional
+#               "colorMode": "hsv",           - optional, see touchpad.colorModes
+#               "captureProfile": "mjpeg120", - optional, see framesource.captureProfiles
+#               "frameBudget": 0.008,         - optional, seconds of work per frame before quality degrades (see scheduler.py)
+#               "sliders": {...},             - optional, see Touchpad.Sliders.setConfig
+#               "calibration": "path",        - optional, calibration.py output that maps the camera straight to table coordinates
+#               "transform": [[1, 0, 0],      - optional, homography from the camera's normalized coordinates to table coordinates
+#                             [0, 1, 0],
+#                             [0, 0, 1]]
+#           },
+#           ...
+#       ]
+#   }
+
+import argparse
+import json
+import multiprocessing
+import queue
+import time
+import cv2 as cv
+import numpy as np
+
+import touchpad
+from calibration import Calibration
+from framesource import openFrameSource
+from touchpad import Finger, Frame, LogLevel, Touchpad, createPublisher, log, publisherTransports
+from tracker import FingerTracker
+
+# Note: Sends each frame's fingers to the merger, dropping frames rather than blocking detection when the merger falls behind
+class QueuePublisher:
+
+    def __init__(self, cameraIndex:int, detectionQueue) -> None:
+        self.cameraIndex = cameraIndex
+        self.detectionQueue = detectionQueue
+        self.dropped = 0
+
+    def publish(self, frame:Frame):
+        fingers = [(finger.x, finger.y, finger.d1, finger.d2, finger.angle) for finger in frame.fingers]
+
+        try:
+            self.detectionQueue.put_nowait((self.cameraIndex, frame.frameId, frame.captureTime, fingers))
+        except queue.Full:
+            self.dropped+= 1
+
+    def close(self):
+        pass
+
+def runCameraWorker(cameraIndex:int, cameraConfig:dict, detectionQueue, stopEvent, verboseLevel:int):
+
+    touchpad.verboseLevel = verboseLevel
+
+    source = openFrameSource(str(cameraConfig["source"]), cameraConfig.get("loop", False), cameraConfig.get("captureProfile"))
+    publisher = QueuePublisher(cameraIndex, detectionQueue)
+
+    calibrationPath = cameraConfig.get("calibration")
+    calibration = None if calibrationPath is None else Calibration.load(calibrationPath)
+
+    pad = Touchpad(source, windowName=f"Camera {cameraIndex}", publisher=publisher, headless=True,
+                   config=cameraConfig.get("sliders"), clip=cameraConfig.get("clip"), downscale=cameraConfig.get("downscale", 0),
+                   calibration=calibration, colorMode=cameraConfig.get("colorMode", "hsv"), frameBudget=cameraConfig.get("frameBudget", 0))
+
+    # Note: Ctrl+C reaches every process in the group so workers just wind down and let the parent stop them
+    try:
+        while pad and not stopEvent.is_set():
+            pad.update()
+
+    except KeyboardInterrupt:
+        pass
+
+    log(f"Camera {cameraIndex} stopped after {pad.frameId} frames ({publisher.dropped} dropped)", LogLevel.Warn)
+    pad.close()
+
+class CameraTransform:
+
+    def __init__(self, homography = None) -> None:
+        self.homography = np.float64(np.eye(3) if homography is None else homography).reshape(3, 3)
+
+    # Maps an (n, 2) array of camera normalized points to table coordinates
+    def apply(self, points:np.ndarray):
+        if len(points) == 0:
+            return points
+
+        return cv.perspectiveTransform(np.float64(points).reshape(-1, 1, 2), self.homography).reshape(-1, 2)
+
+class CameraMerger:
+
+    def __init__(self, transforms:list[CameraTransform], mergeDistance:float = .1, maxAge:float = .1) -> None:
+        self.transforms = transforms
+        self.mergeDistance = mergeDistance
+        self.maxAge = maxAge
+
+        # Note: latest (frameId, captureTime, fingers) per camera
+        self.latest:list[tuple] = [None]*len(transforms)
+        self.hasNewFrames = False
+
+    def add(self, cameraIndex:int, frameId:int, captureTime:float, fingers:list[tuple]):
+        self.latest[cameraIndex] = (frameId, captureTime, fingers)
+        self.hasNewFrames = True
+
+    # Returns (captureTime, fingers) combining every camera's latest fresh frame or None if no camera has one
+    # Note: captureTime is the oldest contributing capture time so latency is never under reported
+    def merge(self, now:float):
+
+        self.hasNewFrames = False
+
+        captureTimes = []
+        merged:list[tuple[list, int]] = []
+        for cameraIndex, latest in enumerate(self.latest):
+            if latest is None:
+                continue
+
+            _, captureTime, fingers = latest
+            if now - captureTime > self.maxAge:
+                continue
+
+            captureTimes.append(captureTime)
+            if len(fingers) == 0:
+                continue
+
+            tablePoints = self.transforms[cameraIndex].apply(np.float64([finger[:2] for finger in fingers]))
+            for (x, y), (_, _, d1, d2, angle) in zip(tablePoints, fingers):
+                self.mergeFinger(merged, [x, y, d1, d2, angle], cameraIndex)
+
+        if len(captureTimes) == 0:
+            return None
+
+        fingers = [Finger(x, y, d1, d2, angle) for (x, y, d1, d2, angle), _, _ in merged]
+        return min(captureTimes), fingers
+
+    # Note: fingers seen by several cameras in overlapping regions are averaged into one
+    def mergeFinger(self, merged:list, finger:list, cameraIndex:int):
+
+        for i, (mergedFinger, count, cameras) in enumerate(merged):
+            if cameraIndex in cameras:
+                continue
+
+            distance = np.hypot(mergedFinger[0] - finger[0], mergedFinger[1] - finger[1])
+            if distance <= self.mergeDistance:
+                averaged = [(m*count + f)/(count + 1) for m, f in zip(mergedFinger, finger)]
+                merged[i] = (averaged, count + 1, cameras | {cameraIndex})
+                return
+
+        merged.append((finger, 1, {cameraIndex}))
+
+class MultiTouchpad:
+
+    def __init__(self, config:dict, publisher, tracker:FingerTracker = None) -> None:
+        self.config = config
+        self.publisher = publisher
+        self.tracker = tracker if tracker is not None else FingerTracker()
+
+        cameraConfigs = config["cameras"]
+        self.tickInterval = 1/config.get("tickRate", 60)
+        self.merger = CameraMerger(
+            [CameraTransform(cameraConfig.get("transform")) for cameraConfig in cameraConfigs],
+            config.get("mergeDistance", .1),
+            config.get("maxAge", .1)
+        )
+
+        # Note: spawn keeps workers from inheriting the parent's OpenCV/GUI state and matches Windows behavior
+        context = multiprocessing.get_context("spawn")
+        self.detectionQueue = context.Queue(maxsize=4*len(cameraConfigs))
+        self.stopEvent = context.Event()
+        self.workers = [
+            context.Process(target=runCameraWorker, name=f"TouchpadCamera{i}", daemon=True,
+                            args=(i, cameraConfig, self.detectionQueue, self.stopEvent, touchpad.verboseLevel))
+            for i, cameraConfig in enumerate(cameraConfigs)
+        ]
+
+        self.frameId = 0
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def __bool__(self):
+        return any(worker.is_alive() for worker in self.workers)
+
+    def update(self):
+
+        # Gather detections until the next tick
+        tickDeadline = time.monotonic() + self.tickInterval
+        while True:
+            timeout = tickDeadline - time.monotonic()
+            if timeout <= 0:
+                break
+
+            try:
+                self.merger.add(*self.detectionQueue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        if not self.merger.hasNewFrames:
+            return
+
+        merged = self.merger.merge(time.monotonic())
+        if merged is None:
+            return
+
+        captureTime, fingers = merged
+
+        self.frameId+= 1
+        frame = Frame(self.frameId, None, captureTime)
+        frame.fingers = fingers
+
+        self.tracker.update(frame.fingers, frame.captureTime)
+        self.publisher.publish(frame)
+
+    def stop(self):
+        self.stopEvent.set()
+
+        for worker in self.workers:
+            worker.join(timeout=5)
+
+        self.publisher.close()
+
+def main():
+
+    argParser = argparse.ArgumentParser(
+        prog = "MultiTouchpad",
+        description ="Driver for multi-camera EECS 598 IR Touchpads",
+    )
+
+    argParser.add_argument("-c", "--config", metavar="path", action="store", required=True, help="JSON file describing the cameras")
+    argParser.add_argument("-o", "--output", metavar="path", action="store", default="touchpad.out", required=False, help="Output filepath to write finger positions to")
+    argParser.add_argument("-t", "--transport", metavar="type", action="store", default="file", choices=publisherTransports, required=False, help="How fingers are published: 'file' (text file), 'ring' (memory-mapped ring buffer), 'udp' or 'tcp' (see netpublisher.py)")
+    argParser.add_argument("--address", metavar="host:port", action="store", default=None, required=False, help="Address the udp and tcp transports publish on (defaults to 127.0.0.1:5005)")
+    argParser.add_argument("-v", "--verbose", metavar="level", action="store", default="0", required=False, help="Sets the verbose level (higher means more logging)")
+
+    args = argParser.parse_args()
+
+    touchpad.verboseLevel = int(args.verbose)
+
+    with open(args.config) as configFile:
+        config = json.load(configFile)
+
+    publisher = createPublisher(args.transport, args.output, args.address)
+    multiTouchpad = MultiTouchpad(config, publisher)
+    multiTouchpad.start()
+
+    try:
+        while multiTouchpad:
+            multiTouchpad.update()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        multiTouchpad.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+# Network transports for touchpad fingers
+#
+# Each frame is sent as one binary message so subscribers get pushed updates instead of polling touchpad.out:
+#
+#   Message (little-endian)
+#     0   uint32  magic         - 0x4E505054 ("TPPN")
+#     4   uint16  version       - netVersion
+#     6   uint16  fingerCount
+#     8   uint64  frameId
+#     16  float64 timestamp     - capture time in seconds since the unix epoch
+#     24  Record  records[fingerCount]  - same 64 byte records as the ring buffer (see ringbuffer.py)
+#
+#   UDP: every message is one datagram. Subscribers register by sending "TPPS" to the publisher's address
+#        and have to repeat it at least every `subscriberTimeout` seconds, "TPPU" unsubscribes.
+#   TCP: subscribers connect to the publisher's address and every message is prefixed with its uint32 length.
+#
+# Sockets never block the publishing thread. UDP datagrams that don't fit in the socket buffer are dropped and
+# TCP subscribers that fall behind drop their oldest unsent messages, so slow subscribers only ever lose frames.
+#
+#   python netpublisher.py udp 127.0.0.1:5005               - print frames and latency from a running touchpad
+#   python netpublisher.py benchmark                        - loopback latency of file, udp and tcp publishing
+
+import argparse
+import collections
+import os
+import select
+import socket
+import struct
+import threading
+import time
+import numpy as np
+
+from ringbuffer import fillRecords, monotonicToUnix, recordDtype
+
+netMagic = 0x4E505054
+netVersion = 2
+netHeader = struct.Struct("<IHHQd")
+netLength = struct.Struct("<I")
+
+subscribeRequest = b"TPPS"
+unsubscribeRequest = b"TPPU"
+
+defaultAddress = ("127.0.0.1", 5005)
+
+# Note: `spec` is "host:port", "port" or None for the default address
+def parseAddress(spec:str):
+    if spec is None:
+        return defaultAddress
+
+    host, _, port = spec.rpartition(":")
+    return (host or defaultAddress[0], int(port))
+
+# Note: packs every message into the same preallocated buffer and returns a memoryview of it, so the message is
+#       only valid until the next pack (copy it to keep it). `lengthPrefix` reserves room for the netLength prefix
+#       stream transports frame messages with
+class MessagePacker:
+
+    def __init__(self, maxFingers:int = 16, lengthPrefix:bool = False) -> None:
+        self.maxFingers = maxFingers
+        self.lengthPrefix = lengthPrefix
+
+        self.headerOffset = netLength.size if lengthPrefix else 0
+        self.recordsOffset = self.headerOffset + netHeader.size
+
+        self.buffer = bytearray(self.recordsOffset + maxFingers*recordDtype.itemsize)
+        self.view = memoryview(self.buffer)
+        self.records = np.frombuffer(self.buffer, recordDtype, maxFingers, self.recordsOffset)
+
+    def pack(self, frameId:int, timestamp:float, fingers:list):
+
+        fingerCount = fillRecords(self.records, frameId, timestamp, fingers)
+        size = self.recordsOffset + fingerCount*recordDtype.itemsize
+
+        if self.lengthPrefix:
+            netLength.pack_into(self.buffer, 0, size - netLength.size)
+        netHeader.pack_into(self.buffer, self.headerOffset, netMagic, netVersion, fingerCount, frameId, timestamp)
+
+        return self.view[:size]
+
+# Returns (frameId, timestamp, records) from a message or None if it isn't one
+def unpackMessage(message:bytes):
+
+    if len(message) < netHeader.size:
+        return None
+
+    magic, version, fingerCount, frameId, timestamp = netHeader.unpack_from(message)
+    if magic != netMagic or version != netVersion:
+        return None
+
+    records = np.frombuffer(message, recordDtype, fingerCount, netHeader.size)
+    return frameId, timestamp, records
+
+class UdpPublisher:
+
+    def __init__(self, address:tuple[str, int] = defaultAddress, subscriberTimeout:float = 5, maxFingers:int = 16) -> None:
+        self.address = address
+        self.subscriberTimeout = subscriberTimeout
+        self.packer = MessagePacker(maxFingers)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(address)
+        self.socket.setblocking(False)
+
+        # Note: subscriber address -> monotonic time of its last subscribe request
+        self.subscribers:dict[tuple, float] = {}
+        self.dropped = 0
+
+    def updateSubscribers(self, now:float):
+
+        while True:
+            try:
+                request, subscriber = self.socket.recvfrom(16)
+            except (BlockingIOError, ConnectionResetError):
+                break
+
+            if request == subscribeRequest:
+                self.subscribers[subscriber] = now
+            elif request == unsubscribeRequest:
+                self.subscribers.pop(subscriber, None)
+
+        for subscriber, lastSeen in list(self.subscribers.items()):
+            if now - lastSeen > self.subscriberTimeout:
+                del self.subscribers[subscriber]
+
+    def publish(self, frame):
+
+        self.updateSubscribers(time.monotonic())
+        if not self.subscribers:
+            return
+
+        message = self.packer.pack(frame.frameId, monotonicToUnix(frame.captureTime), frame.fingers)
+        for subscriber in list(self.subscribers):
+            try:
+                self.socket.sendto(message, subscriber)
+            except BlockingIOError:
+                self.dropped+= 1
+            except OSError:
+                self.subscribers.pop(subscriber, None)
+
+    def close(self):
+        self.socket.close()
+
+class TcpSubscriberConnection:
+
+    def __init__(self, connection:socket.socket, address) -> None:
+        self.connection = connection
+        self.address = address
+
+        # Note: messages waiting to be sent, the first one may already be partially sent
+        self.messages:collections.deque[memoryview] = collections.deque()
+
+    # Sends as much as the socket takes without blocking, returns False if the subscriber disconnected
+    def flush(self):
+
+        while self.messages:
+            try:
+                sent = self.connection.send(self.messages[0])
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+
+            if sent == len(self.messages[0]):
+                self.messages.popleft()
+            else:
+                self.messages[0] = self.messages[0][sent:]
+
+        return True
+
+    # Sends `message` after anything already queued, returns False if the subscriber disconnected
+    # Note: the packer reuses `message` so only what the socket didn't take is copied into the queue
+    def send(self, message:memoryview):
+
+        if not self.flush():
+            return False
+
+        sent = 0
+        if not self.messages:
+            try:
+                sent = self.connection.send(message)
+            except BlockingIOError:
+                pass
+            except OSError:
+                return False
+
+        if sent < len(message):
+            self.messages.append(memoryview(bytes(message[sent:])))
+
+        return True
+
+class TcpPublisher:
+
+    # Note: subscribers that have more than `maxQueuedMessages` unsent messages drop all but the one in flight
+    def __init__(self, address:tuple[str, int] = defaultAddress, maxQueuedMessages:int = 4, maxFingers:int = 16) -> None:
+        self.address = address
+        self.maxQueuedMessages = maxQueuedMessages
+        self.packer = MessagePacker(maxFingers, lengthPrefix=True)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(address)
+        self.socket.listen()
+        self.socket.setblocking(False)
+
+        self.subscribers:list[TcpSubscriberConnection] = []
+        self.dropped = 0
+
+    def acceptSubscribers(self):
+
+        while True:
+            try:
+                connection, address = self.socket.accept()
+            except BlockingIOError:
+                break
+
+            connection.setblocking(False)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.subscribers.append(TcpSubscriberConnection(connection, address))
+
+    def publish(self, frame):
+
+        self.acceptSubscribers()
+        if not self.subscribers:
+            return
+
+        message = self.packer.pack(frame.frameId, monotonicToUnix(frame.captureTime), frame.fingers)
+
+        connectedSubscribers = []
+        for subscriber in self.subscribers:
+
+            if len(subscriber.messages) >= self.maxQueuedMessages:
+                # Note: a partially sent message has to finish or the stream loses its framing
+                inFlight = subscriber.messages[0]
+                self.dropped+= len(subscriber.messages) - 1
+                subscriber.messages.clear()
+                subscriber.messages.append(inFlight)
+
+            if subscriber.send(message):
+                connectedSubscribers.append(subscriber)
+            else:
+                subscriber.connection.close()
+
+        self.subscribers = connectedSubscribers
+
+    def close(self):
+        for subscriber in self.subscribers:
+            subscriber.connection.close()
+
+        self.socket.close()
+
+class UdpSubscriber:
+
+    def __init__(self, address:tuple[str, int] = defaultAddress, renewInterval:float = 1) -> None:
+        self.address = address
+        self.renewInterval = renewInterval
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.connect(address)
+        self.lastRenewTime = -np.inf
+
+    # Returns (frameId, timestamp, records) of the next message or None on timeout
+    def read(self, timeout:float = None):
+
+        now = time.monotonic()
+        if now - self.lastRenewTime >= self.renewInterval:
+            self.socket.send(subscribeRequest)
+            self.lastRenewTime = now
+
+        self.socket.settimeout(timeout)
+        try:
+            return unpackMessage(self.socket.recv(65536))
+        except (socket.timeout, ConnectionRefusedError):
+            return None
+
+    def close(self):
+        try:
+            self.socket.send(unsubscribeRequest)
+        except OSError:
+            pass
+
+        self.socket.close()
+
+class TcpSubscriber:
+
+    def __init__(self, address:tuple[str, int] = defaultAddress) -> None:
+        self.socket = socket.create_connection(address)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = bytearray()
+
+    # Returns (frameId, timestamp, records) of the next message or None on timeout
+    def read(self, timeout:float = None):
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+
+            if len(self.buffer) >= netLength.size:
+                length, = netLength.unpack_from(self.buffer)
+                if len(self.buffer) >= netLength.size + length:
+                    message = bytes(self.buffer[netLength.size:netLength.size + length])
+                    del self.buffer[:netLength.size + length]
+                    return unpackMessage(message)
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+
+            readable, _, _ = select.select([self.socket], [], [], remaining)
+            if not readable:
+                return None
+
+            data = self.socket.recv(65536)
+            if not data:
+                raise ConnectionError("Publisher closed the connection")
+
+            self.buffer+= data
+
+    def close(self):
+        self.socket.close()
+
+# Note: reads touchpad.out the way the Unity reader does, returning the frame id once its contents change
+class FileSubscriber:
+
+    def __init__(self, path:str) -> None:
+        self.path = os.path.abspath(path)
+        self.lastContents = None
+
+    def read(self, timeout:float = None):
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            try:
+                with open(self.path) as file:
+                    contents = file.read()
+            except OSError:
+                contents = None
+
+            if contents and contents != self.lastContents:
+                self.lastContents = contents
+                return int(contents.split()[1])
+
+        return None
+
+    def close(self):
+        pass
+
+def runClient(transport:str, address:tuple[str, int]):
+
+    subscriber = UdpSubscriber(address) if transport == "udp" else TcpSubscriber(address)
+    print(f"Listening for {transport} frames from {address[0]}:{address[1]}")
+
+    try:
+        while True:
+            message = subscriber.read(timeout=1)
+            if message is None:
+                continue
+
+            frameId, timestamp, records = message
+            print(f"frameId: {frameId} | fingers: {len(records)} | latency: {(time.time() - timestamp)*1000:.2f}ms")
+            for record in records:
+                print(f"\tid: {record['id']} x: {record['x']:.4f} y: {record['y']:.4f} vx: {record['vx']:.4f} vy: {record['vy']:.4f} ax: {record['ax']:.3f} ay: {record['ay']:.3f}")
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        subscriber.close()
+
+# Returns publish -> receive latencies in seconds for `numFrames` frames sent over `transport` on loopback
+# Note: the subscriber runs on its own thread so both ends share a process but never wait on each other
+def benchmarkTransport(transport:str, numFrames:int, numFingers:int, address:tuple[str, int], outputPath:str, interval:float):
+
+    # Note: imported here since touchpad imports this module
+    from touchpad import FilePublisher, Finger, Frame
+
+    if transport == "file":
+        publisher = FilePublisher(outputPath)
+        subscriber = FileSubscriber(outputPath)
+    elif transport == "udp":
+        publisher = UdpPublisher(address)
+        subscriber = UdpSubscriber(address)
+    else:
+        publisher = TcpPublisher(address)
+        subscriber = TcpSubscriber(address)
+
+    publishTimes = {}
+    receiveTimes = {}
+
+    def receiveLoop():
+        while len(receiveTimes) < numFrames:
+            message = subscriber.read(timeout=1)
+            if message is None:
+                if stopEvent.is_set():
+                    break
+                continue
+
+            frameId = message if transport == "file" else message[0]
+            receiveTimes[frameId] = time.perf_counter()
+
+    stopEvent = threading.Event()
+
+    # Note: udp subscribers have to register before anything is sent to them
+    if transport == "udp":
+        subscriber.read(timeout=.1)
+
+    receiver = threading.Thread(target=receiveLoop, daemon=True)
+    receiver.start()
+
+    fingers = [Finger(i/numFingers, -i/numFingers, 40, 40, 0) for i in range(numFingers)]
+    for frameId in range(1, numFrames + 1):
+        frame = Frame(frameId, None, time.monotonic())
+        frame.fingers = fingers
+
+        publishTimes[frameId] = time.perf_counter()
+        publisher.publish(frame)
+
+        time.sleep(interval)
+
+    time.sleep(.1)
+    stopEvent.set()
+    receiver.join()
+
+    subscriber.close()
+    publisher.close()
+
+    return np.array([receiveTimes[frameId] - publishTimes[frameId] for frameId in receiveTimes if frameId in publishTimes])
+
+def runBenchmark(numFrames:int, numFingers:int, address:tuple[str, int], outputPath:str, interval:float):
+
+    for transport in ["file", "udp", "tcp"]:
+        latencies = benchmarkTransport(transport, numFrames, numFingers, address, outputPath, interval)
+        if len(latencies) == 0:
+            print(f"{transport:>4} | nothing received")
+            continue
+
+        print(f"{transport:>4} | received {len(latencies):4d}/{numFrames} | mean {np.mean(latencies)*1e6:8.1f}us | " +
+              f"p50 {np.percentile(latencies, 50)*1e6:8.1f}us | p99 {np.percentile(latencies, 99)*1e6:8.1f}us")
+
+    for path in [outputPath, outputPath + ".tmp"]:
+        if os.path.exists(path):
+            os.remove(path)
+
+def main():
+
+    argParser = argparse.ArgumentParser(
+        prog = "NetPublisher",
+        description ="Test client and loopback benchmark for the EECS 598 IR Touchpad network transports",
+    )
+
+    argParser.add_argument("mode", metavar="mode", action="store", choices=["udp", "tcp", "benchmark"], help="'udp' or 'tcp' to print frames from a running touchpad, 'benchmark' to compare transports")
+    argParser.add_argument("address", metavar="host:port", action="store", nargs="?", default=None, help=f"Publisher address (defaults to {defaultAddress[0]}:{defaultAddress[1]})")
+    argParser.add_argument("-n", "--frames", metavar="n", action="store", default="500", required=False, help="Frames to publish per transport when benchmarking")
+    argParser.add_argument("-f", "--fingers", metavar="n", action="store", default="4", required=False, help="Fingers per frame when benchmarking")
+    argParser.add_argument("--interval", metavar="seconds", action="store", default=".002", required=False, help="Delay between benchmark frames")
+    argParser.add_argument("-o", "--output", metavar="path", action="store", default="netbenchmark.out", required=False, help="Scratch file for the file transport benchmark")
+
+    args = argParser.parse_args()
+    address = parseAddress(args.address)
+
+    if args.mode == "benchmark":
+        runBenchmark(int(args.frames), int(args.fingers), address, args.output, float(args.interval))
+    else:
+        runClient(args.mode, address)
+
+if __name__ == "__main__":
+    main()
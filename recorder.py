@@ -0,0 +1,400 @@
+# Session recording and deterministic replay
+#
+# A session is a directory:
+#
+#   session.json    - header: format version, frame size, codec, detection region, tracker and calibration settings
+#   frames.bin      - frames back to back, either raw BGR pixels ("raw") or PNG encoded ("png")
+#   frames.jsonl    - one JSON object per recorded frame:
+#                       frameId, captureTime  - as seen by the touchpad (monotonic seconds)
+#                       driverTime            - only present when the source timestamped the frame (see framesource.py)
+#                       offset, size          - where the frame's pixels live in frames.bin
+#                       fingers               - detected (and published) fingers, each a list ordered like `fingerFields`
+#                       sliders               - only present when slider values changed since the previous recorded frame
+#                       dropped               - only present when frames were dropped by the recorder right before this one
+#                       quality               - only present when the quality level (see scheduler.py) changed since the previous recorded frame
+#
+# Recording hands frames to a writer thread through a bounded queue and writes them in batches so disk
+# stalls never reach the capture loop. When the queue is full the frame is dropped (and counted) instead.
+#
+# Replay feeds the recorded frames, capture times and slider values back through a headless Touchpad and
+# diffs the fingers it detects against the recorded ones:
+#
+#   python touchpad.py --record session                   - record while running as usual
+#   python recorder.py session                            - replay with the current detector and report differences
+#   python recorder.py session -c sliders.json            - replay with different slider values
+
+import argparse
+import json
+import mmap
+import os
+import queue
+import threading
+import cv2 as cv
+import numpy as np
+
+from calibration import Calibration
+from tracker import solveAssignment
+
+sessionVersion = 1
+sessionCodecs = ["raw", "png"]
+
+fingerFields = ["x", "y", "d1", "d2", "angle", "id", "vx", "vy", "predictedX", "predictedY", "cameraX", "cameraY", "ax", "ay"]
+
+def isSessionDirectory(path:str):
+    return os.path.isfile(os.path.join(path, "session.json"))
+
+def toJsonValue(value):
+    if value is None or isinstance(value, int):
+        return value
+
+    return float(value)
+
+def getFingerRecord(finger):
+    return [toJsonValue(getattr(finger, field)) for field in fingerFields]
+
+class SessionRecorder:
+
+    # Note: `header` describes how the touchpad was configured (see Touchpad.getSessionHeader)
+    #       At most `maxQueuedFrames` frames wait for the writer which writes up to `batchSize` frames per flush
+    def __init__(self, path:str, header:dict, codec:str = "raw", maxQueuedFrames:int = 32, batchSize:int = 8) -> None:
+        assert codec in sessionCodecs, f"Unknown session codec: '{codec}', expected one of {sessionCodecs}"
+
+        self.path = os.path.abspath(path)
+        self.codec = codec
+        self.batchSize = batchSize
+
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "session.json"), "w") as headerFile:
+            json.dump({**header, "version": sessionVersion, "codec": codec, "fingerFields": fingerFields}, headerFile, indent=4)
+
+        self.framesFile = open(os.path.join(self.path, "frames.bin"), "wb")
+        self.indexFile = open(os.path.join(self.path, "frames.jsonl"), "w")
+        self.offset = 0
+
+        self.frameQueue = queue.Queue(maxQueuedFrames)
+        self.lastConfig:dict = None
+        self.lastQualityLevel = 0
+        self.recorded = 0
+        self.dropped = 0
+        self.droppedSinceLastRecord = 0
+
+        self.writerThread = threading.Thread(target=self.writeLoop, name="SessionRecorder", daemon=True)
+        self.writerThread.start()
+
+    # Queues the frame's raw pixels, fingers and the slider `config` it was detected with
+    # Note: the raw pixels are never modified after capture so they're queued without copying
+    def record(self, frame, config:dict):
+
+        entry = {
+            "frameId": frame.frameId,
+            "captureTime": frame.captureTime,
+            "fingers": [getFingerRecord(finger) for finger in frame.fingers],
+        }
+
+        if frame.driverTime is not None:
+            entry["driverTime"] = frame.driverTime
+
+        if config != self.lastConfig:
+            entry["sliders"] = config
+
+        if frame.qualityLevel != self.lastQualityLevel:
+            entry["quality"] = frame.qualityLevel
+
+        if self.droppedSinceLastRecord > 0:
+            entry["dropped"] = self.droppedSinceLastRecord
+
+        try:
+            self.frameQueue.put_nowait((entry, frame.rawImage.pixels))
+            self.lastConfig = config
+            self.lastQualityLevel = frame.qualityLevel
+            self.droppedSinceLastRecord = 0
+
+        except queue.Full:
+            self.dropped+= 1
+            self.droppedSinceLastRecord+= 1
+
+    def encode(self, pixels:np.ndarray):
+
+        if self.codec == "png":
+            # Note: PNG is lossless so replay stays deterministic, low compression keeps the writer fast
+            _, data = cv.imencode(".png", pixels, [cv.IMWRITE_PNG_COMPRESSION, 1])
+            return data
+
+        return np.ascontiguousarray(pixels)
+
+    def writeLoop(self):
+
+        stopping = False
+        while not stopping:
+
+            batch = [self.frameQueue.get()]
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self.frameQueue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in batch:
+                if item is None:
+                    stopping = True
+                    continue
+
+                entry, pixels = item
+                data = self.encode(pixels)
+
+                entry["offset"] = self.offset
+                entry["size"] = data.nbytes
+
+                self.framesFile.write(data.data)
+                self.indexFile.write(json.dumps(entry) + "\n")
+                self.offset+= data.nbytes
+
+            self.recorded+= sum(item is not None for item in batch)
+            self.framesFile.flush()
+            self.indexFile.flush()
+
+    def close(self):
+        # Note: blocks until every queued frame is on disk
+        self.frameQueue.put(None)
+        self.writerThread.join()
+
+        self.framesFile.close()
+        self.indexFile.close()
+
+class SessionReader:
+
+    def __init__(self, path:str) -> None:
+        self.path = os.path.abspath(path)
+
+        with open(os.path.join(self.path, "session.json")) as headerFile:
+            self.header = json.load(headerFile)
+
+        assert self.header["version"] == sessionVersion, f"Unsupported session version: {self.header['version']}"
+
+        self.width = self.header["width"]
+        self.height = self.header["height"]
+        self.codec = self.header["codec"]
+
+        with open(os.path.join(self.path, "frames.jsonl")) as indexFile:
+            self.entries = [json.loads(line) for line in indexFile if line.strip()]
+
+        # Note: frames are read straight out of a memory map so replay never copies the whole session into memory
+        self.framesFile = open(os.path.join(self.path, "frames.bin"), "rb")
+        self.frames = mmap.mmap(self.framesFile.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.framesFile.name) > 0 else None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def getPixels(self, index:int):
+        entry = self.entries[index]
+        data = np.frombuffer(self.frames, np.uint8, entry["size"], entry["offset"])
+
+        if self.codec == "png":
+            return cv.imdecode(data, cv.IMREAD_UNCHANGED)
+
+        channels = entry["size"]//(self.width*self.height)
+        return data.reshape(self.height, self.width, channels) if channels > 1 else data.reshape(self.height, self.width)
+
+    def __iter__(self):
+        for index, entry in enumerate(self.entries):
+            yield entry, self.getPixels(index)
+
+    # Returns the number of frames that were detected but dropped by the recorder
+    # Note: gaps in frameId can also come from frames the pipeline dropped before detection which don't affect replay
+    def getMissingFrames(self):
+        return sum(entry.get("dropped", 0) for entry in self.entries)
+
+    def close(self):
+
+        # Note: the map can't be closed while frames we handed out still view it, it's released along with them instead
+        if self.frames is not None:
+            try:
+                self.frames.close()
+            except BufferError:
+                pass
+
+        self.framesFile.close()
+
+# Note: plays a session back like any other frame source (see framesource.py)
+class SessionSource:
+
+    def __init__(self, path:str, loop:bool = False) -> None:
+        self.reader = SessionReader(path)
+        self.loop = loop
+        self.live = False
+
+        self.width = self.reader.width
+        self.height = self.reader.height
+        self.frameIndex = 0
+
+    def read(self):
+
+        if self.frameIndex >= len(self.reader):
+            if not self.loop or len(self.reader) == 0:
+                return False, None
+
+            self.frameIndex = 0
+
+        pixels = self.reader.getPixels(self.frameIndex)
+        self.frameIndex+= 1
+
+        # Note: frames are views into the session's memory map so we hand out copies the caller can keep
+        return True, pixels.copy()
+
+    def getFrameTime(self):
+        return None, self.reader.entries[self.frameIndex - 1].get("driverTime")
+
+    def setProperty(self, property:int, value:int):
+        pass
+
+    def isOpen(self):
+        return self.loop or self.frameIndex < len(self.reader)
+
+    def getInfo(self):
+        return f"Session Info: {{ path: {self.reader.path} | frames: {len(self.reader)} | size: {self.width}x{self.height} | codec: {self.reader.codec} }}\n"
+
+    def close(self):
+        self.reader.close()
+
+class FingerDiff:
+
+    def __init__(self, frameId:int, recorded:list, replayed:list, positionTolerance:float) -> None:
+        self.frameId = frameId
+        self.recordedCount = len(recorded)
+        self.replayedCount = len(replayed)
+
+        recordedPoints = np.float64([finger[:2] for finger in recorded]).reshape(-1, 2)
+        replayedPoints = np.float64([finger[:2] for finger in replayed]).reshape(-1, 2)
+
+        distances = np.linalg.norm(recordedPoints[:, np.newaxis, :] - replayedPoints[np.newaxis, :, :], axis=2)
+        pairs = solveAssignment(distances)
+
+        self.positionDeltas = [distances[i, j] for i, j in pairs]
+        self.idChanges = sum(recorded[i][fingerFields.index("id")] != replayed[j][fingerFields.index("id")] for i, j in pairs)
+        self.missing = self.recordedCount - len(pairs)
+        self.extra = self.replayedCount - len(pairs)
+
+        self.maxPositionDelta = max(self.positionDeltas, default=0)
+        self.isIdentical = self.missing == 0 and self.extra == 0 and self.idChanges == 0 and self.maxPositionDelta <= positionTolerance
+
+    def toDict(self):
+        return {
+            "frameId": self.frameId,
+            "recorded": self.recordedCount,
+            "replayed": self.replayedCount,
+            "missing": self.missing,
+            "extra": self.extra,
+            "idChanges": int(self.idChanges),
+            "maxPositionDelta": float(self.maxPositionDelta),
+        }
+
+class ReplayStats:
+
+    def __init__(self) -> None:
+        self.frames = 0
+        self.identicalFrames = 0
+        self.missing = 0
+        self.extra = 0
+        self.idChanges = 0
+        self.positionDeltas = []
+
+    def add(self, diff:FingerDiff):
+        self.frames+= 1
+        self.identicalFrames+= diff.isIdentical
+        self.missing+= diff.missing
+        self.extra+= diff.extra
+        self.idChanges+= diff.idChanges
+        self.positionDeltas.extend(diff.positionDeltas)
+
+    def __str__(self) -> str:
+        meanDelta = np.mean(self.positionDeltas) if self.positionDeltas else 0
+        maxDelta = np.max(self.positionDeltas) if self.positionDeltas else 0
+
+        return f"Replay Stats: {{ frames: {self.frames} | identical: {self.identicalFrames} | missing fingers: {self.missing} | " + \
+               f"extra fingers: {self.extra} | id changes: {self.idChanges} | position delta mean: {meanDelta:.6f} max: {maxDelta:.6f} }}"
+
+# Feeds every recorded frame back through a headless touchpad, yields (entry, frame) after each detection
+# Note: recorded slider changes are applied as they happened unless `config` overrides them for the whole replay
+def replaySession(reader:SessionReader, config:dict = None, downscale:int = None):
+
+    # Note: imported here since touchpad imports this module
+    from touchpad import Frame, NullPublisher, Touchpad
+    from tracker import FingerTracker
+
+    header = reader.header
+    calibration = None if header.get("calibration") is None else Calibration.fromDict(header["calibration"])
+
+    pad = Touchpad(SessionSource(reader.path), windowName=f"Replay: {reader.path}", publisher=NullPublisher(), headless=True,
+                   config=config, clip=header.get("clip"), downscale=header.get("downscale", 0) if downscale is None else downscale,
+                   tracker=FingerTracker(predictionHorizon=header.get("predictionHorizon", .05), outputFilter=header.get("outputFilter", "none"),
+                                         filterParams=header.get("filterParams")), calibration=calibration,
+                   colorMode=header.get("colorMode", "hsv"))
+
+    for entry, pixels in reader:
+
+        if config is None and "sliders" in entry:
+            pad.sliders.setConfig(entry["sliders"])
+
+        if "quality" in entry:
+            pad.setQualityLevel(entry["quality"])
+
+        frame = Frame(entry["frameId"], pixels, entry["captureTime"], entry.get("driverTime"))
+        pad.detectFingers(frame)
+
+        yield entry, frame
+
+    pad.close()
+
+def main():
+
+    argParser = argparse.ArgumentParser(
+        prog = "Recorder",
+        description ="Replays a recorded EECS 598 IR Touchpad session and diffs the detected fingers against the recording",
+    )
+
+    argParser.add_argument("session", metavar="path", action="store", help="Session directory recorded with touchpad.py --record")
+    argParser.add_argument("-c", "--config", metavar="path", action="store", default=None, required=False, help="JSON file of slider values to replay with instead of the recorded ones")
+    argParser.add_argument("--downscale", metavar="n", action="store", default=None, required=False, help="Override the recorded downscale")
+    argParser.add_argument("--tolerance", metavar="units", action="store", default="1e-6", required=False, help="Position difference under which fingers count as identical")
+    argParser.add_argument("-o", "--output", metavar="path", action="store", default=None, required=False, help="Write a JSON line per frame that differs")
+    argParser.add_argument("-v", "--verbose", metavar="level", action="store", default="0", required=False, help="Sets the verbose level (higher means more logging)")
+
+    args = argParser.parse_args()
+
+    # Note: imported here since touchpad imports this module
+    import touchpad
+    touchpad.verboseLevel = int(args.verbose)
+
+    config = None
+    if args.config is not None:
+        with open(args.config) as configFile:
+            config = json.load(configFile)
+
+    reader = SessionReader(args.session)
+    print(f"Replaying {len(reader)} frames from '{reader.path}'")
+
+    missingFrames = reader.getMissingFrames()
+    if missingFrames > 0:
+        print(f"Warning: {missingFrames} frames were dropped while recording so detector state may diverge from the recording")
+
+    positionTolerance = float(args.tolerance)
+    downscale = None if args.downscale is None else int(args.downscale)
+
+    outputFile = None if args.output is None else open(args.output, "w")
+    stats = ReplayStats()
+
+    for entry, frame in replaySession(reader, config, downscale):
+        diff = FingerDiff(entry["frameId"], entry["fingers"], [getFingerRecord(finger) for finger in frame.fingers], positionTolerance)
+        stats.add(diff)
+
+        if outputFile is not None and not diff.isIdentical:
+            outputFile.write(json.dumps(diff.toDict()) + "\n")
+
+    if outputFile is not None:
+        outputFile.close()
+
+    reader.close()
+    print(stats)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Debug window renderer
+#
+# Lays the touchpad's render images out in a grid inside a cached window buffer. The layout and buffer
+# are only rebuilt when the window size or the set of image shapes changes and every image is resized
+# straight into its tile, so a repaint allocates next to nothing. Labels are drawn onto the tiles so the
+# pipeline's own images are never modified, and repaints can be capped below the detection rate.
+
+import time
+import cv2 as cv
+import numpy as np
+
+class GridTile:
+    def __init__(self, view:np.ndarray) -> None:
+        self.view = view
+
+        # Note: monochrome images are resized into this scratch buffer before being expanded into the view
+        self.grayPixels:np.ndarray = None
+
+    def blit(self, pixels:np.ndarray, interpolation:int):
+        height, width = self.view.shape[:2]
+
+        if pixels.ndim == 3:
+            cv.resize(pixels, (width, height), dst=self.view, interpolation=interpolation)
+            return
+
+        if self.grayPixels is None:
+            self.grayPixels = np.empty((height, width), dtype=np.uint8)
+
+        cv.resize(pixels, (width, height), dst=self.grayPixels, interpolation=interpolation)
+        cv.cvtColor(self.grayPixels, cv.COLOR_GRAY2BGR, dst=self.view)
+
+class GridRenderer:
+
+    # Note: `maxRenderRate` caps repaints per second (0 repaints every call). Skipped calls still pump
+    #       window events so the window and sliders stay responsive
+    def __init__(self, windowName:str, maxRenderRate:float = 0, interpolation:int = cv.INTER_LINEAR) -> None:
+        self.windowName = windowName
+        self.interpolation = interpolation
+        self.setMaxRenderRate(maxRenderRate)
+
+        self.layoutKey = None
+        self.windowImage:np.ndarray = None
+        self.tiles:list[GridTile] = []
+
+        self.lastRenderTime = -np.inf
+        self.renderedFrames = 0
+        self.skippedFrames = 0
+
+    def setMaxRenderRate(self, maxRenderRate:float):
+        self.renderInterval = 1/maxRenderRate if maxRenderRate > 0 else 0
+
+    # Returns True if enough time has passed since the last repaint
+    def isDue(self, now:float = None):
+        now = time.monotonic() if now is None else now
+        return now - self.lastRenderTime >= self.renderInterval
+
+    # Rebuilds the window buffer and tile views if the window or images changed shape
+    def updateLayout(self, windowWidth:int, windowHeight:int, imageShapes:list[tuple]):
+
+        layoutKey = (windowWidth, windowHeight, tuple(imageShapes))
+        if layoutKey == self.layoutKey:
+            return
+
+        self.layoutKey = layoutKey
+        self.windowImage = np.zeros((windowHeight, windowWidth, 3), dtype=np.uint8)
+        self.tiles = []
+
+        numImages = len(imageShapes)
+        numXImages = max(1, int(np.ceil(np.sqrt(numImages))))
+        numYImages = max(1, int(np.ceil(numImages/numXImages)))
+
+        maxImageWidth  = windowWidth//numXImages
+        maxImageHeight = windowHeight//numYImages
+        maxImageAspect = maxImageWidth/max(1, maxImageHeight)
+
+        for i, (height, width) in enumerate(imageShapes):
+
+            row = i//numXImages
+            col = i - row*numXImages
+
+            y = row*maxImageHeight
+            x = col*maxImageWidth
+
+            imageAspect = width/height
+            if imageAspect >= maxImageAspect:
+
+                # Fit to width of image
+                imageWidth = maxImageWidth
+                imageHeight = int(imageWidth/imageAspect + .5)
+                y+= (maxImageHeight - imageHeight)//2
+
+            else:
+                # Fit to height of image
+                imageHeight = maxImageHeight
+                imageWidth = int(imageAspect*imageHeight + .5)
+                x+= (maxImageWidth - imageWidth)//2
+
+            imageWidth = max(1, imageWidth)
+            imageHeight = max(1, imageHeight)
+            self.tiles.append(GridTile(self.windowImage[y:y+imageHeight, x:x+imageWidth]))
+
+    # Blits `images` (objects with `getPixels()` and `drawLabel(pixels)`) into the window buffer and returns it
+    # Note: lazy images are built here, which keeps their cost on the thread that renders
+    # Note: returns None if the window currently has no area (e.g. minimized)
+    def render(self, images:list):
+
+        _, _, windowWidth, windowHeight = cv.getWindowImageRect(self.windowName)
+        if windowWidth <= 0 or windowHeight <= 0:
+            return None
+
+        imagePixels = [image.getPixels() for image in images]
+        self.updateLayout(windowWidth, windowHeight, [pixels.shape[:2] for pixels in imagePixels])
+
+        for image, pixels, tile in zip(images, imagePixels, self.tiles):
+            tile.blit(pixels, self.interpolation)
+            image.drawLabel(tile.view)
+
+        return self.windowImage
+
+    # Repaints the window with `images` if a repaint is due, returns True if it did
+    def show(self, images:list):
+
+        now = time.monotonic()
+        if not self.isDue(now):
+            self.skippedFrames+= 1
+
+            # Note: pollKey processes window events without waitKey's minimum 1ms sleep
+            cv.pollKey()
+            return False
+
+        self.lastRenderTime = now
+
+        windowImage = self.render(images)
+        if windowImage is not None:
+            cv.imshow(self.windowName, windowImage)
+            self.renderedFrames+= 1
+
+        # Note: We need to pause via waitKey to allow opencv to display frame
+        cv.waitKey(1)
+        return True
@@ -0,0 +1,208 @@
+# Shared-memory ring buffer transport for touchpad fingers
+#
+# The buffer is a memory-mapped file with a fixed little-endian layout so readers in
+# other processes (e.g. Unity via MemoryMappedFile) can grab the latest frame without locks or syscalls.
+#
+# Layout:
+#
+#   Header (64 bytes)
+#     0   uint32  magic         - 0x42525054 ("TPRB")
+#     4   uint32  version       - ringBufferVersion
+#     8   uint32  slotCount     - number of frame slots in the ring
+#     12  uint32  maxFingers    - number of finger records reserved per slot
+#     16  uint32  slotSize      - size of a slot in bytes
+#     20  uint32  recordSize    - size of a finger record in bytes
+#     24  uint64  reserved
+#     32  uint64  sequence      - sequence number of the last completely written frame (0 = nothing written yet)
+#     40  ...     padding up to 64 bytes
+#
+#   Slot i starts at 64 + i*slotSize. Frame with sequence s is written to slot s % slotCount
+#     0   uint64  beginSequence - sequence of the frame being written, updated before any other slot field
+#     8   uint64  frameId
+#     16  float64 timestamp     - capture time in seconds since the unix epoch
+#     24  uint32  fingerCount   - number of valid records (<= maxFingers)
+#     28  uint32  padding
+#     32  Record  records[maxFingers]
+#     ..  uint64  endSequence   - sequence of the frame, updated after every other slot field
+#
+#   Record (64 bytes)
+#     0   uint64  frameId
+#     8   float64 timestamp
+#     16  float32 x             - normalized [-1, 1]
+#     20  float32 y             - normalized [-1, 1]
+#     24  float32 d1            - ellipse diameters in pixels
+#     28  float32 d2
+#     32  float32 angle         - ellipse angle in degrees
+#     36  int32   id            - persistent finger id (-1 if untracked)
+#     40  float32 vx            - velocity in normalized units per second
+#     44  float32 vy
+#     48  float32 predictedX    - position extrapolated by the tracker's prediction horizon
+#     52  float32 predictedY
+#     56  float32 ax            - acceleration in normalized units per second squared (see kinematics.py)
+#     60  float32 ay
+#
+# Reading the latest frame:
+#   1. s = header.sequence, if s == 0 nothing has been published yet
+#   2. slot = s % slotCount, read slot.endSequence, copy the slot contents, then read slot.beginSequence
+#   3. The copy is consistent iff beginSequence == endSequence == s, otherwise the writer lapped us so retry from 1
+#
+# Note: readers must use volatile/acquire loads for the sequence fields (e.g. Volatile.Read in C#)
+
+import mmap
+import os
+import time
+import numpy as np
+
+ringBufferMagic = 0x42525054
+ringBufferVersion = 3
+ringBufferHeaderSize = 64
+
+recordDtype = np.dtype({
+    "names":    ["frameId", "timestamp", "x", "y", "d1", "d2", "angle", "id", "vx", "vy", "predictedX", "predictedY", "ax", "ay"],
+    "formats":  ["<u8", "<f8", "<f4", "<f4", "<f4", "<f4", "<f4", "<i4", "<f4", "<f4", "<f4", "<f4", "<f4", "<f4"],
+    "offsets":  [0, 8, 16, 20, 24, 28, 32, 36, 40, 44, 48, 52, 56, 60],
+    "itemsize": 64,
+})
+
+headerDtype = np.dtype({
+    "names":    ["magic", "version", "slotCount", "maxFingers", "slotSize", "recordSize", "reserved", "sequence"],
+    "formats":  ["<u4", "<u4", "<u4", "<u4", "<u4", "<u4", "<u8", "<u8"],
+    "offsets":  [0, 4, 8, 12, 16, 20, 24, 32],
+    "itemsize": ringBufferHeaderSize,
+})
+
+# Writes `fingers` into the preallocated recordDtype array `records` and returns how many fit
+# Note: shared by every binary transport so publishing never builds intermediate lists or arrays
+def fillRecords(records:np.ndarray, frameId:int, timestamp:float, fingers:list):
+
+    fingerCount = min(len(fingers), len(records))
+    for i in range(fingerCount):
+        finger = fingers[i]
+        records[i] = (frameId, timestamp, finger.x, finger.y, finger.d1, finger.d2, finger.angle,
+                      finger.id, finger.vx, finger.vy, finger.predictedX, finger.predictedY, finger.ax, finger.ay)
+
+    return fingerCount
+
+def getSlotDtype(maxFingers:int):
+    recordsSize = maxFingers*recordDtype.itemsize
+
+    return np.dtype({
+        "names":    ["beginSequence", "frameId", "timestamp", "fingerCount", "records", "endSequence"],
+        "formats":  ["<u8", "<u8", "<f8", "<u4", (recordDtype, (maxFingers,)), "<u8"],
+        "offsets":  [0, 8, 16, 24, 32, 32 + recordsSize],
+        "itemsize": 40 + recordsSize,
+    })
+
+def getRingBufferSize(slotCount:int, maxFingers:int):
+    return ringBufferHeaderSize + slotCount*getSlotDtype(maxFingers).itemsize
+
+# Note: Frame capture times are monotonic which isn't comparable across processes so we publish unix time
+def monotonicToUnix(monotonicTime:float):
+    return time.time() - (time.monotonic() - monotonicTime)
+
+class RingBufferWriter:
+
+    def __init__(self, path:str, slotCount:int = 8, maxFingers:int = 16) -> None:
+        assert slotCount > 1, f"slotCount: {slotCount} must be greater than 1"
+        assert maxFingers > 0, f"maxFingers: {maxFingers} must be positive"
+
+        self.path = os.path.abspath(path)
+        self.slotCount = slotCount
+        self.maxFingers = maxFingers
+        self.slotDtype = getSlotDtype(maxFingers)
+
+        size = getRingBufferSize(slotCount, maxFingers)
+        with open(self.path, "wb") as file:
+            file.truncate(size)
+
+        self.file = open(self.path, "r+b")
+        self.buffer = mmap.mmap(self.file.fileno(), size)
+
+        self.header = np.frombuffer(self.buffer, headerDtype, 1, 0)[0]
+        self.slots = np.frombuffer(self.buffer, self.slotDtype, slotCount, ringBufferHeaderSize)
+
+        # Note: sequence is zeroed last so readers never see a valid sequence with a stale layout
+        self.header["sequence"] = 0
+        self.header["magic"] = ringBufferMagic
+        self.header["version"] = ringBufferVersion
+        self.header["slotCount"] = slotCount
+        self.header["maxFingers"] = maxFingers
+        self.header["slotSize"] = self.slotDtype.itemsize
+        self.header["recordSize"] = recordDtype.itemsize
+
+        self.sequence = 0
+
+    def write(self, frameId:int, timestamp:float, fingers:list):
+
+        self.sequence+= 1
+        slot = self.slots[self.sequence % self.slotCount]
+        slot["beginSequence"] = self.sequence
+
+        slot["frameId"] = frameId
+        slot["timestamp"] = timestamp
+        slot["fingerCount"] = fillRecords(slot["records"], frameId, timestamp, fingers)
+
+        slot["endSequence"] = self.sequence
+        self.header["sequence"] = self.sequence
+
+    def publish(self, frame):
+        self.write(frame.frameId, monotonicToUnix(frame.captureTime), frame.fingers)
+
+    def close(self):
+        # Note: numpy views hold references to the mmap so we drop them before closing
+        self.header = None
+        self.slots = None
+        self.buffer.close()
+        self.file.close()
+
+class RingBufferReader:
+
+    def __init__(self, path:str) -> None:
+        self.path = os.path.abspath(path)
+
+        self.file = open(self.path, "rb")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.header = np.frombuffer(self.buffer, headerDtype, 1, 0)[0]
+        assert self.header["magic"] == ringBufferMagic, f"'{self.path}' is not a touchpad ring buffer"
+        assert self.header["version"] == ringBufferVersion, f"Unsupported ring buffer version: {self.header['version']}"
+
+        self.slotCount = int(self.header["slotCount"])
+        self.maxFingers = int(self.header["maxFingers"])
+        self.slots = np.frombuffer(self.buffer, getSlotDtype(self.maxFingers), self.slotCount, ringBufferHeaderSize)
+
+        self.lastSequence = 0
+
+    def getSequence(self):
+        return int(self.header["sequence"])
+
+    # Returns (frameId, timestamp, records) of the newest frame or None if nothing new was published
+    # Note: records is a copy of the frame's recordDtype array
+    def readLatest(self, maxAttempts:int = 10):
+
+        for _ in range(maxAttempts):
+
+            sequence = self.getSequence()
+            if sequence == 0 or sequence == self.lastSequence:
+                return None
+
+            slot = self.slots[sequence % self.slotCount]
+            endSequence = int(slot["endSequence"])
+
+            frameId = int(slot["frameId"])
+            timestamp = float(slot["timestamp"])
+            fingerCount = min(int(slot["fingerCount"]), self.maxFingers)
+            records = slot["records"][:fingerCount].copy()
+
+            beginSequence = int(slot["beginSequence"])
+            if beginSequence == endSequence == sequence:
+                self.lastSequence = sequence
+                return frameId, timestamp, records
+
+        return None
+
+    def close(self):
+        self.header = None
+        self.slots = None
+        self.buffer.close()
+        self.file.close()
@@ -0,0 +1,110 @@
+# Frame budget scheduler
+#
+# Keeps the touchpad's per frame work (detection, publishing and repainting) under a target time by stepping
+# through quality levels that each trade a little more detection quality for time. Levels are cumulative:
+#
+#   0 'full'        - everything as configured
+#   1 'denoise'     - one fewer denoise (open and close) iteration at the detection scale
+#   2 'downscale'   - detection runs one downscale level lower
+#   3 'render'      - debug window repaints are capped
+#   4 'contours'    - only the largest contours (or components) of a frame are considered
+#
+# Frame times are smoothed with an EMA that restarts after every change so each decision only sees the current level.
+# The scheduler steps down when the smoothed time runs over budget and steps back up once it has stayed under
+# `headroom` of the budget for `recoverFrames` frames. Falling straight back from a level it just recovered to
+# doubles the wait before that level is tried again, so a load that sits between two levels doesn't flap.
+
+class QualityLevel:
+
+    # Note: `maxRenderRate` and `maxContours` of 0 leave repaints and contours uncapped
+    def __init__(self, name:str, denoiseReduction:int = 0, extraDownscale:int = 0, maxRenderRate:float = 0, maxContours:int = 0) -> None:
+        self.name = name
+        self.denoiseReduction = denoiseReduction
+        self.extraDownscale = extraDownscale
+        self.maxRenderRate = maxRenderRate
+        self.maxContours = maxContours
+
+qualityLevels = [
+    QualityLevel("full"),
+    QualityLevel("denoise",   denoiseReduction=1),
+    QualityLevel("downscale", denoiseReduction=1, extraDownscale=1),
+    QualityLevel("render",    denoiseReduction=1, extraDownscale=1, maxRenderRate=10),
+    QualityLevel("contours",  denoiseReduction=1, extraDownscale=1, maxRenderRate=10, maxContours=16),
+]
+
+class FrameBudgetScheduler:
+
+    # Note: `budget` is in seconds, `smoothing` is the EMA weight of each frame and `settleFrames` frames have to pass
+    #       after a change before the next one so its effect shows up in the frame times first
+    def __init__(self, budget:float, smoothing:float = .1, headroom:float = .7, settleFrames:int = 10,
+                 recoverFrames:int = 60, maxRecoverFrames:int = 1920) -> None:
+        self.budget = budget
+        self.smoothing = smoothing
+        self.headroom = headroom
+        self.settleFrames = settleFrames
+        self.baseRecoverFrames = recoverFrames
+        self.maxRecoverFrames = maxRecoverFrames
+
+        self.level = 0
+        self.meanFrameTime:float = None
+        self.framesSinceChange = 0
+        self.framesUnderBudget = 0
+        self.steppedUp = False
+        self.levelChanges = 0
+
+        # Note: frames under budget each level waits for before stepping up, see stepDown
+        self.recoverFrames = [recoverFrames]*len(qualityLevels)
+
+    def getQualityLevel(self):
+        return qualityLevels[self.level]
+
+    def setLevel(self, level:int):
+        self.steppedUp = level < self.level
+        self.level = level
+        self.levelChanges+= 1
+
+        self.meanFrameTime = None
+        self.framesSinceChange = 0
+        self.framesUnderBudget = 0
+
+    def stepDown(self):
+
+        # Note: a level we recovered to that runs over budget again sooner than we waited to recover to it doesn't fit the load
+        if self.steppedUp and self.framesSinceChange < self.recoverFrames[self.level + 1]:
+            self.recoverFrames[self.level + 1] = min(self.maxRecoverFrames, 2*self.recoverFrames[self.level + 1])
+        else:
+            self.recoverFrames[self.level + 1] = self.baseRecoverFrames
+
+        self.setLevel(self.level + 1)
+
+    # Adds the seconds of work the last frame took and returns the quality level to run the next frame at
+    def update(self, frameTime:float):
+
+        if self.meanFrameTime is None:
+            self.meanFrameTime = frameTime
+        else:
+            self.meanFrameTime+= self.smoothing*(frameTime - self.meanFrameTime)
+
+        self.framesSinceChange+= 1
+        if self.framesSinceChange < self.settleFrames:
+            return self.level
+
+        if self.meanFrameTime > self.budget:
+            self.framesUnderBudget = 0
+            if self.level < len(qualityLevels) - 1:
+                self.stepDown()
+
+            return self.level
+
+        if self.meanFrameTime < self.headroom*self.budget:
+            self.framesUnderBudget+= 1
+            if self.level > 0 and self.framesUnderBudget >= self.recoverFrames[self.level]:
+                self.setLevel(self.level - 1)
+        else:
+            self.framesUnderBudget = 0
+
+        return self.level
+
+    def __str__(self) -> str:
+        meanStr = "n/a" if self.meanFrameTime is None else f"{self.meanFrameTime*1000:.2f}ms"
+        return f"Quality: {{ level: {self.level} ({self.getQualityLevel().name}) | budget: {self.budget*1000:.2f}ms | mean frame: {meanStr} | changes: {self.levelChanges} }}"
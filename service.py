@@ -0,0 +1,309 @@
+# Asyncio touchpad service with a local JSON control API
+#
+# Detection runs on a worker thread driven by the event loop while the loop itself serves a small HTTP API
+# (and repaints the debug window when there is one), so parameters can be tuned live without the sliders:
+#
+#   GET    /status                      - frame count, latency stats, achieved fps, quality level and camera info
+#   GET    /sliders                     - every slider value (same format as a --config file)
+#   PUT    /sliders                     - set any subset of sliders from a JSON object
+#   GET    /sliders/<name>              - {"value": ..., "min": ..., "max": ...}
+#   PUT    /sliders/<name>              - set one slider from {"value": ...}
+#   GET    /presets                     - names of saved presets
+#   GET    /presets/<name>              - slider values stored in a preset
+#   PUT    /presets/<name>              - save the current slider values (or the JSON body) as a preset
+#   POST   /presets/<name>/load         - apply a preset
+#   DELETE /presets/<name>              - remove a preset
+#   PUT    /camera                      - queue a camera property change from {"property": "EXPOSURE", "value": -7}
+#
+# e.g. `curl -X PUT -d '{"area": [150, 2500]}' http://127.0.0.1:8765/sliders`
+#
+# Presets are --config JSON files in the presets directory. Camera property changes are applied by the capture
+# thread over the next couple of frames (see framesource.CameraSource.setProperty) so they never stall detection.
+
+import asyncio
+import concurrent.futures
+import json
+import os
+import re
+import cv2 as cv
+
+from scheduler import qualityLevels
+
+presetNamePattern = re.compile(r"^[A-Za-z0-9_\-]+$")
+
+httpReasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+class ControlError(Exception):
+    def __init__(self, status:int, message:str) -> None:
+        super().__init__(message)
+        self.status = status
+
+class TouchpadService:
+
+    # Note: `maxFrames` stops the service after that many frames (0 runs forever)
+    def __init__(self, touchpad, host:str = "127.0.0.1", port:int = 8765, presetsPath:str = "presets", maxFrames:int = 0, drawRate:float = 60) -> None:
+        self.touchpad = touchpad
+        self.host = host
+        self.port = port
+        self.presetsPath = os.path.abspath(presetsPath)
+        self.maxFrames = maxFrames
+        self.drawInterval = 1/drawRate
+
+        # Note: a single worker keeps every touchpad.update call on the same thread
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="TouchpadDetect")
+        self.running = False
+
+    def isRunning(self):
+        return self.running and self.touchpad and (self.maxFrames <= 0 or self.touchpad.frameId < self.maxFrames)
+
+    async def run(self):
+        self.running = True
+
+        server = await asyncio.start_server(self.handleConnection, self.host, self.port)
+        print(f"Touchpad control API listening on http://{self.host}:{self.port}")
+
+        tasks = [asyncio.create_task(self.detectLoop())]
+        if not self.touchpad.headless:
+            tasks.append(asyncio.create_task(self.drawLoop()))
+
+        try:
+            await tasks[0]
+
+        finally:
+            self.running = False
+            for task in tasks[1:]:
+                task.cancel()
+
+            server.close()
+            await server.wait_closed()
+            self.executor.shutdown()
+
+    async def detectLoop(self):
+        loop = asyncio.get_running_loop()
+
+        while self.isRunning():
+            await loop.run_in_executor(self.executor, self.touchpad.update)
+
+    # Note: HighGUI has to be driven from the thread that owns the windows which is the event loop's thread.
+    #       Repaints run alongside detection here so they aren't part of a frame's work
+    async def drawLoop(self):
+        while self.running:
+            self.touchpad.draw(inFrameTime=False)
+            await asyncio.sleep(self.drawInterval)
+
+    async def handleConnection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+
+        try:
+            status, response = await self.handleHttpRequest(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+
+        body = json.dumps(response, indent=4).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {httpReasons.get(status, '')}\r\n".encode() +
+            b"Content-Type: application/json\r\n" +
+            f"Content-Length: {len(body)}\r\n".encode() +
+            b"Connection: close\r\n\r\n" +
+            body
+        )
+
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+        writer.close()
+
+    async def handleHttpRequest(self, reader:asyncio.StreamReader):
+
+        requestLine = (await reader.readline()).decode("latin-1").split()
+        if len(requestLine) < 2:
+            return 400, {"error": "Malformed request line"}
+
+        method, target = requestLine[0].upper(), requestLine[1]
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            contentLength = int(headers.get("content-length", 0))
+        except ValueError:
+            return 400, {"error": f"Invalid Content-Length: '{headers['content-length']}'"}
+
+        if contentLength < 0:
+            return 400, {"error": f"Invalid Content-Length: {contentLength}"}
+
+        rawBody = await reader.readexactly(contentLength)
+
+        try:
+            body = json.loads(rawBody) if rawBody.strip() else None
+            return 200, self.handleRequest(method, target.split("?")[0], body)
+
+        except json.JSONDecodeError as e:
+            return 400, {"error": f"Invalid JSON body: {e}"}
+
+        except ControlError as e:
+            return e.status, {"error": str(e)}
+
+    def handleRequest(self, method:str, path:str, body):
+
+        parts = [part for part in path.split("/") if part]
+        route = parts[0] if parts else ""
+
+        if route == "status" and len(parts) == 1:
+            self.checkMethod(method, "GET")
+            return self.getStatus()
+
+        if route == "sliders" and len(parts) == 1:
+            self.checkMethod(method, "GET", "PUT")
+            if method == "PUT":
+                return self.setSliders(self.checkObject(body))
+
+            return self.touchpad.sliders.getConfig()
+
+        if route == "sliders" and len(parts) == 2:
+            self.checkMethod(method, "GET", "PUT")
+            if method == "PUT":
+                config = self.setSliders({parts[1]: self.checkObject(body).get("value")})
+                return {**self.getSlider(parts[1]), "value": config[parts[1]]}
+
+            return self.getSlider(parts[1])
+
+        if route == "presets" and len(parts) == 1:
+            self.checkMethod(method, "GET")
+            return self.getPresetNames()
+
+        if route == "presets" and len(parts) == 2:
+            self.checkMethod(method, "GET", "PUT", "DELETE")
+            if method == "PUT":
+                return self.savePreset(parts[1], body)
+            if method == "DELETE":
+                return self.deletePreset(parts[1])
+
+            return self.loadPresetConfig(parts[1])
+
+        if route == "presets" and len(parts) == 3 and parts[2] == "load":
+            self.checkMethod(method, "POST")
+            return self.setSliders(self.loadPresetConfig(parts[1]))
+
+        if route == "camera" and len(parts) == 1:
+            self.checkMethod(method, "PUT")
+            return self.setCameraProperty(self.checkObject(body))
+
+        raise ControlError(404, f"Unknown endpoint: '{path}'")
+
+    def checkMethod(self, method:str, *allowedMethods:str):
+        if method not in allowedMethods:
+            raise ControlError(405, f"Expected {' or '.join(allowedMethods)}, got: {method}")
+
+    def checkObject(self, body):
+        if not isinstance(body, dict):
+            raise ControlError(400, "Expected a JSON object body")
+
+        return body
+
+    def getStatus(self):
+        return {
+            "frameId": self.touchpad.frameId,
+            "latency": {name: stats.getMean() for name, stats in self.touchpad.latencyStats.items()},
+            "fps": self.touchpad.getAchievedFps(),
+            "quality": {"level": self.touchpad.qualityLevel, "name": qualityLevels[self.touchpad.qualityLevel].name},
+            "camera": self.touchpad.getCameraInfo(),
+        }
+
+    def getSlider(self, name:str):
+        slider = self.touchpad.sliders.getSliders().get(name)
+        if slider is None:
+            raise ControlError(404, f"Unknown slider: '{name}'")
+
+        limits = slider.minSlider if hasattr(slider, "minSlider") else slider
+        return {"value": slider.getValue(), "min": limits.minValue, "max": limits.maxValue}
+
+    # Note: validates every value before applying any so a bad request never leaves sliders half updated.
+    #       The change is queued for the detect thread which applies it as a whole before its next frame and the
+    #       trackbars follow on the next repaint. Returns the slider values once it's applied
+    def setSliders(self, config:dict):
+        self.checkSliderConfig(config)
+        self.touchpad.sliders.queueConfig(config)
+
+        return {**self.touchpad.sliders.getConfig(), **config}
+
+    # Raises a ControlError unless every entry of `config` names a slider and has a value it can take
+    def checkSliderConfig(self, config:dict):
+        sliders = self.touchpad.sliders.getSliders()
+
+        for name, value in config.items():
+            slider = sliders.get(name)
+            if slider is None:
+                raise ControlError(400, f"Unknown slider: '{name}'")
+
+            isPair = hasattr(slider, "minSlider")
+            values = value if isPair and isinstance(value, list) and len(value) == 2 else [value]
+            if (isPair and len(values) != 2) or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+                raise ControlError(400, f"Invalid value for slider '{name}': {value}")
+
+    def getPresetPath(self, name:str):
+        if not presetNamePattern.match(name):
+            raise ControlError(400, f"Invalid preset name: '{name}' (use letters, digits, '-' and '_')")
+
+        return os.path.join(self.presetsPath, name + ".json")
+
+    def getPresetNames(self):
+        if not os.path.isdir(self.presetsPath):
+            return []
+
+        return sorted(os.path.splitext(fileName)[0] for fileName in os.listdir(self.presetsPath) if fileName.endswith(".json"))
+
+    def loadPresetConfig(self, name:str):
+        presetPath = self.getPresetPath(name)
+        if not os.path.isfile(presetPath):
+            raise ControlError(404, f"Unknown preset: '{name}'")
+
+        with open(presetPath) as presetFile:
+            return json.load(presetFile)
+
+    # Note: presets are validated like slider updates so a bad one can't be saved and only fail when it's loaded
+    def savePreset(self, name:str, config:dict = None):
+        presetPath = self.getPresetPath(name)
+        if config is None:
+            config = self.touchpad.sliders.getConfig()
+        else:
+            self.checkSliderConfig(self.checkObject(config))
+
+        os.makedirs(self.presetsPath, exist_ok=True)
+        with open(presetPath, "w") as presetFile:
+            json.dump(config, presetFile, indent=4)
+
+        return config
+
+    def deletePreset(self, name:str):
+        presetPath = self.getPresetPath(name)
+        if not os.path.isfile(presetPath):
+            raise ControlError(404, f"Unknown preset: '{name}'")
+
+        os.remove(presetPath)
+        return self.getPresetNames()
+
+    # Note: `property` is a cv.CAP_PROP_* name (with or without the prefix) or its integer id
+    def setCameraProperty(self, body:dict):
+        property = body.get("property")
+        value = body.get("value")
+
+        if isinstance(property, str):
+            propertyName = property if property.startswith("CAP_PROP_") else "CAP_PROP_" + property.upper()
+            if not hasattr(cv, propertyName):
+                raise ControlError(400, f"Unknown camera property: '{property}'")
+            property = getattr(cv, propertyName)
+
+        if not isinstance(property, int) or not isinstance(value, (int, float)):
+            raise ControlError(400, "Expected {\"property\": name or id, \"value\": number}")
+
+        self.touchpad.setCameraProp(property, value)
+        return {"property": property, "value": value, "queued": True}
@@ -0,0 +1,41 @@
+import numpy as np
+
+from autotune import ExposureResult, ThresholdResult, getBestExposure, searchThresholds
+
+def getHistogram(counts:dict):
+    histogram = np.zeros((256, 256), dtype=np.int64)
+    for (saturation, value), count in counts.items():
+        histogram[saturation, value] = count
+
+    return histogram
+
+# Note: a threshold low enough to take the dim finger pixels also lets a little noise through, the search should
+#       give those up for a threshold that keeps the bright finger pixels and no noise at all
+def test_search_prefers_separation_over_finger_pixels():
+    idleHistogram = getHistogram({(0, 10): 9990, (0, 100): 10})
+    touchHistogram = getHistogram({(0, 10): 5000, (0, 100): 2000, (0, 200): 3000})
+
+    threshold = searchThresholds(idleHistogram, touchHistogram, maxNoiseRate=.01, valueMargin=0)
+
+    assert threshold.noiseRate == 0
+    assert threshold.valueMin > 100
+    assert threshold.fingerRate == .3
+
+    # Note: thresholds between the dim finger pixels and the noise-free ones all let no noise through, the tie goes
+    #       to the one keeping the most finger pixels
+    assert threshold.valueMin == 101
+
+def test_search_respects_max_noise_rate():
+    idleHistogram = getHistogram({(0, 10): 9000, (0, 100): 1000})
+    touchHistogram = getHistogram({(0, 10): 5000, (0, 100): 5000})
+
+    threshold = searchThresholds(idleHistogram, touchHistogram, maxNoiseRate=.05, valueMargin=0)
+
+    assert threshold.noiseRate <= .05
+
+def test_best_exposure_has_the_highest_separation():
+    noisy = ExposureResult(-5, ThresholdResult(40, 100, .5, 1e-3, 1e-5), [0, 255])
+    clean = ExposureResult(-7, ThresholdResult(40, 100, .2, 0, 1e-5), [0, 255])
+    cleaner = ExposureResult(-9, ThresholdResult(40, 100, .1, 0, 1e-5), [0, 255])
+
+    assert getBestExposure([noisy, clean, cleaner]) is clean
@@ -0,0 +1,72 @@
+import cv2 as cv
+import numpy as np
+import pytest
+
+from calibration import Calibration, getTargetGrid
+
+imageSize = (1280, 720)
+
+# Returns the camera pixels a camera with `cameraMatrix` and `distCoeffs` looking down at the table sees `tablePoints` at
+def projectTablePoints(tablePoints, cameraMatrix, distCoeffs, rotation=(.15, -.1, .05), translation=(.1, -.05, 2.5)):
+    objectPoints = np.hstack([tablePoints, np.zeros((len(tablePoints), 1), dtype=np.float32)])
+    cameraPoints, _ = cv.projectPoints(objectPoints, np.float64(rotation), np.float64(translation), cameraMatrix, distCoeffs)
+    return cameraPoints.reshape(-1, 2)
+
+def getCameraMatrix(focalLength:float = 900):
+    return np.float64([[focalLength, 0, imageSize[0]/2], [0, focalLength, imageSize[1]/2], [0, 0, 1]])
+
+def test_homography_maps_touches_back_to_the_table():
+    tablePoints = getTargetGrid(4, 3)
+    cameraPoints = projectTablePoints(tablePoints, getCameraMatrix(), np.zeros(5))
+
+    calibration = Calibration(imageSize)
+    error = calibration.fit(cameraPoints, tablePoints, fitDistortion=False)
+
+    assert error < 1e-4
+    assert not calibration.hasDistortion()
+
+    # Note: points between the targets map just as well
+    testPoints = getTargetGrid(5, 5, margin=.7)
+    assert np.allclose(calibration.apply(projectTablePoints(testPoints, getCameraMatrix(), np.zeros(5))), testPoints, atol=1e-4)
+
+def test_lens_distortion_is_fitted():
+    distCoeffs = np.float64([-.25, .08, 0, 0, 0])
+    tablePoints = getTargetGrid(6, 5, margin=.9)
+    cameraPoints = projectTablePoints(tablePoints, getCameraMatrix(), distCoeffs)
+
+    homographyOnly = Calibration(imageSize)
+    homographyOnly.fit(cameraPoints, tablePoints, fitDistortion=False)
+
+    calibration = Calibration(imageSize)
+    error = calibration.fit(cameraPoints, tablePoints)
+
+    assert calibration.hasDistortion()
+    assert error < homographyOnly.error/10
+
+def test_calibration_round_trips_through_json(tmp_path):
+    tablePoints = getTargetGrid(4, 3)
+    cameraPoints = projectTablePoints(tablePoints, getCameraMatrix(), np.float64([-.2, .05, 0, 0, 0]))
+
+    calibration = Calibration(imageSize)
+    calibration.fit(cameraPoints, tablePoints)
+
+    path = str(tmp_path / "calibration.json")
+    calibration.save(path)
+    loaded = Calibration.load(path)
+
+    assert loaded.imageSize == imageSize
+    assert loaded.error == calibration.error
+    assert np.allclose(loaded.apply(cameraPoints), calibration.apply(cameraPoints))
+
+def test_fit_needs_enough_points():
+    tablePoints = getTargetGrid(3, 2)
+    cameraPoints = projectTablePoints(tablePoints, getCameraMatrix(), np.zeros(5))
+
+    with pytest.raises(AssertionError, match="8 points"):
+        Calibration(imageSize).fit(cameraPoints, tablePoints)
+
+    with pytest.raises(AssertionError, match="4 points"):
+        Calibration(imageSize).fit(cameraPoints[:3], tablePoints[:3], fitDistortion=False)
+
+def test_no_points_map_to_no_points():
+    assert Calibration(imageSize).apply(np.zeros((0, 2))).shape == (0, 2)
@@ -0,0 +1,34 @@
+import pytest
+
+import touchpad
+from benchmark import checkParity, runScenario
+from touchpad import LogLevel
+
+@pytest.fixture(autouse=True)
+def quietLogging(monkeypatch):
+    monkeypatch.setattr(touchpad, "verboseLevel", LogLevel.Error)
+
+# Note: the stationary benchmark is what the subpixel default is tuned on so it has to measure fingers, not an empty table
+def test_subpixel_refinement_steadies_stationary_fingers():
+    results = {
+        subpixel: runScenario(320, 240, 2, 30, noise=8, exposureJitter=.1, seed=0, config={"subpixel": subpixel}, colorMode="value", speed=0)
+        for subpixel in [0, 1]
+    }
+
+    for result in results.values():
+        assert result["recall"] == 1
+        assert result["jitter"] is not None
+
+    assert results[1]["jitter"] < results[0]["jitter"]
+
+# Note: the single channel modes only apply the value sliders so hue and saturation are opened up for the HSV reference.
+#       Touching fingers can merge at slightly different thresholds so these scenarios keep their fingers apart
+@pytest.mark.parametrize("colorMode", ["value", "luma"])
+@pytest.mark.parametrize("numFingers", [1, 3])
+def test_single_channel_modes_match_hsv(colorMode:str, numFingers:int):
+    stats = checkParity(320, 240, numFingers, 30, noise=8, exposureJitter=.1, seed=0, colorMode=colorMode,
+                        config={"hue": [0, 255], "saturation": [0, 255]})
+
+    assert stats.frames == 30
+    assert stats.missing == 0 and stats.extra == 0
+    assert max(stats.positionDeltas, default=0) <= .01
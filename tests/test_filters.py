@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from filters import ExponentialFilter, OneEuroFilter, createFilter, getSmoothingFactor, parseFilterParams
+
+frameRate = 120
+
+# Runs `outputFilter` over (n, 2) `points` sampled at frameRate and returns its outputs
+def runFilter(outputFilter, points:np.ndarray):
+    return np.array([outputFilter.filter(point, frameId/frameRate) for frameId, point in enumerate(points)])
+
+# Note: the default noise is about the half pixel jitter sub-pixel refined centers have at 1280 pixels wide
+def getNoisyPoints(path:np.ndarray, sigma:float = .001, seed:int = 0):
+    return path + np.random.default_rng(seed).normal(0, sigma, path.shape)
+
+def test_smoothing_factor_follows_the_cutoff():
+    assert getSmoothingFactor(1/frameRate, 1) < getSmoothingFactor(1/frameRate, 10) < 1
+    assert getSmoothingFactor(1/frameRate, 1e9) == pytest.approx(1)
+
+def test_ema_blends_each_measurement():
+    emaFilter = ExponentialFilter(alpha=.25)
+
+    outputs = runFilter(emaFilter, np.float64([[0, 0], [1, 1], [1, 1]]))
+
+    assert outputs[:, 0].tolist() == [0, .25, .25 + .75*.25]
+
+    emaFilter.reset()
+    assert emaFilter.filter(np.float64([2, 2]), 0).tolist() == [2, 2]
+
+def test_one_euro_smooths_stationary_fingers():
+    points = getNoisyPoints(np.zeros((240, 2)))
+
+    outputs = runFilter(OneEuroFilter(), points)
+
+    assert np.std(outputs[60:]) < np.std(points[60:])/2
+
+# Note: an EMA smoothing a stationary finger as much as the One Euro filter does lags a moving one far more
+def test_one_euro_follows_fast_moves_with_less_lag_than_an_ema():
+    path = np.stack([np.linspace(0, 1, 120), np.zeros(120)], axis=1)
+    points = getNoisyPoints(path)
+
+    stationaryPoints = getNoisyPoints(np.zeros((240, 2)))
+    oneEuroNoise = np.std(runFilter(OneEuroFilter(), stationaryPoints)[60:])
+
+    alpha = 1
+    while np.std(runFilter(ExponentialFilter(alpha), stationaryPoints)[60:]) > oneEuroNoise:
+        alpha/= 1.25
+
+    oneEuroLag = np.mean(np.abs(runFilter(OneEuroFilter(), points)[30:, 0] - path[30:, 0]))
+    emaLag = np.mean(np.abs(runFilter(ExponentialFilter(alpha), points)[30:, 0] - path[30:, 0]))
+
+    assert oneEuroLag < emaLag/2
+
+def test_one_euro_ignores_repeated_timestamps():
+    oneEuroFilter = OneEuroFilter()
+    oneEuroFilter.filter(np.float64([0, 0]), 0)
+
+    assert oneEuroFilter.filter(np.float64([1, 1]), 0).tolist() == [0, 0]
+
+def test_filters_are_created_by_name():
+    assert createFilter("none") is None
+    assert createFilter("ema", {"alpha": .1}).alpha == .1
+    assert createFilter("oneeuro", parseFilterParams("minCutoff=2, beta=50")).beta == 50
+
+    with pytest.raises(AssertionError, match="Unknown output filter"):
+        createFilter("kalman")
+
+def test_filter_params_parse():
+    assert parseFilterParams("") == {}
+    assert parseFilterParams("minCutoff=.5,beta=20") == {"minCutoff": .5, "beta": 20}
@@ -0,0 +1,45 @@
+from framesource import SyntheticSource, ThreadedSource
+
+# Note: stands in for an unplugged camera, it stays open but every read fails
+class FailingSource:
+    def __init__(self) -> None:
+        self.width = 64
+        self.height = 48
+        self.reads = 0
+
+    def read(self):
+        self.reads+= 1
+        return False, None
+
+    def getFrameTime(self):
+        return None, None
+
+    def isOpen(self):
+        return True
+
+    def close(self):
+        pass
+
+def test_threaded_source_backs_off_and_stops_after_failed_reads():
+    source = FailingSource()
+    threadedSource = ThreadedSource(source, maxFailures=8, failureBackoff=.002, maxFailureBackoff=.01)
+
+    success, _ = threadedSource.read()
+    threadedSource.thread.join(timeout=1)
+
+    assert not success
+    assert not threadedSource.isOpen()
+    assert source.reads == 8
+
+def test_threaded_source_keeps_the_newest_frame():
+    threadedSource = ThreadedSource(SyntheticSource(160, 120, numFrames=20, noise=0))
+    threadedSource.thread.join(timeout=5)
+
+    success, _ = threadedSource.read()
+    assert success
+    assert threadedSource.captured == 20
+    assert threadedSource.dropped == 19
+
+    success, _ = threadedSource.read()
+    assert not success
+    threadedSource.close()
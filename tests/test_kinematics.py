@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from kinematics import fitKinematics, getPolledVelocity, getPredictionError, getTrackKinematics, simulatePucks
+
+# Returns (times, positions) of a quadratic path sampled at jittered frame times
+def getQuadraticTrack(velocity, acceleration, numSamples:int = 30, frameRate:float = 60, seed:int = 0):
+    times = np.arange(numSamples)/frameRate + np.random.default_rng(seed).uniform(-.002, .002, numSamples)
+    positions = np.float64(velocity)*times[:, np.newaxis] + np.float64(acceleration)*(times*times/2)[:, np.newaxis]
+    return times, positions
+
+def test_fit_recovers_quadratic_motion_at_uneven_times():
+    times, positions = getQuadraticTrack((.8, -.4), (3, 1.5))
+
+    velocity, acceleration = fitKinematics((times - times[-1])[np.newaxis], positions[np.newaxis], np.ones((1, len(times)), dtype=bool))
+
+    expectedVelocity = np.float64((.8, -.4)) + np.float64((3, 1.5))*times[-1]
+    assert velocity[0] == pytest.approx(expectedVelocity, abs=1e-6)
+    assert acceleration[0] == pytest.approx((3, 1.5), abs=1e-4)
+
+# Note: rows are padded out to the window so each row has to be fitted from its valid samples only
+def test_batched_rows_ignore_padding():
+    times = np.float64([[-.03, -.02, -.01, 0], [0, 0, -.01, 0], [0, 0, 0, 0]])
+    positions = np.zeros((3, 4, 2))
+    positions[0, :, 0] = times[0]*2
+    positions[1, 2:, 0] = [-.01, 0]
+    positions[1, :2] = 5
+    positions[2, 3] = .5
+
+    valid = np.array([[True]*4, [False, False, True, True], [False, False, False, True]])
+    velocity, acceleration = fitKinematics(times, positions, valid)
+
+    assert velocity[0] == pytest.approx((2, 0), abs=1e-6)
+    assert velocity[1] == pytest.approx((1, 0), abs=1e-6)
+
+    # Note: too few samples for a term leave it at zero rather than making it up
+    assert acceleration[1] == pytest.approx((0, 0))
+    assert velocity[2] == pytest.approx((0, 0)) and acceleration[2] == pytest.approx((0, 0))
+
+def test_track_kinematics_cover_every_sample():
+    times, positions = getQuadraticTrack((.5, .2), (0, 0))
+
+    velocity, acceleration = getTrackKinematics(times, positions, window=6)
+
+    assert velocity.shape == acceleration.shape == (len(times), 2)
+    assert velocity[0] == pytest.approx((0, 0))
+    assert np.allclose(velocity[2:], (.5, .2), atol=1e-6)
+
+def test_acceleration_improves_predictions_of_accelerating_tracks():
+    times, positions = getQuadraticTrack((0, 0), (4, -2), numSamples=60)
+    velocity, acceleration = getTrackKinematics(times, positions, window=6)
+
+    constantVelocityError = getPredictionError(times, positions, velocity, None, .05)
+    constantAccelerationError = getPredictionError(times, positions, velocity, acceleration, .05)
+
+    # Note: the error left is the linear interpolation of where the track actually was between samples
+    assert constantAccelerationError < constantVelocityError/4
+
+def test_polled_velocity_lags_behind_changes():
+    times = np.arange(60)/60
+    positions = np.stack([np.where(times < .5, 0, times - .5), np.zeros_like(times)], axis=1)
+
+    polled = getPolledVelocity(times, positions, .05)
+
+    # Note: the polled velocity only catches up a poll interval after the finger started moving
+    assert polled[31, 0] == 0
+    assert polled[-1, 0] == pytest.approx(1)
+
+# Note: pucks start at rest so only a paddle with a velocity can hit one
+def test_paddle_velocity_drives_puck_impulses():
+    times = np.arange(120)/60
+    positions = np.stack([np.sin(times*6)*.8, np.zeros_like(times)], axis=1)
+    tracks = {0: (times, positions)}
+
+    velocity, _ = getTrackKinematics(times, positions, 6)
+    hits, impulses = simulatePucks(tracks, {0: velocity}, numPucks=256, restitution=.9)
+
+    assert hits > 0
+    assert np.all(impulses > 0)
+
+    assert simulatePucks(tracks, {0: np.zeros_like(positions)}, numPucks=256)[0] == 0
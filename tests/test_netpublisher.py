@@ -0,0 +1,108 @@
+import socket
+import time
+
+import numpy as np
+
+from netpublisher import MessagePacker, TcpPublisher, TcpSubscriber, UdpPublisher, UdpSubscriber, defaultAddress, netLength, parseAddress, unpackMessage
+from ringbuffer import monotonicToUnix
+from touchpad import Finger, Frame
+
+# Note: port 0 lets the OS pick a free port, publishers report the one they got through their socket
+loopbackAddress = ("127.0.0.1", 0)
+
+def createFrame(frameId:int, numFingers:int = 2):
+    frame = Frame(frameId, None, time.monotonic())
+    for i in range(numFingers):
+        finger = Finger(i/4, -i/4, 40, 36, 10)
+        finger.id = i
+        frame.fingers.append(finger)
+
+    return frame
+
+def test_addresses_parse():
+    assert parseAddress(None) == defaultAddress
+    assert parseAddress("6000") == (defaultAddress[0], 6000)
+    assert parseAddress("10.0.0.2:6000") == ("10.0.0.2", 6000)
+
+def test_messages_round_trip():
+    packer = MessagePacker(maxFingers=4)
+    frame = createFrame(9, numFingers=6)
+
+    frameId, timestamp, records = unpackMessage(bytes(packer.pack(frame.frameId, 12.5, frame.fingers)))
+
+    # Note: fingers past maxFingers are dropped
+    assert (frameId, timestamp) == (9, 12.5)
+    assert records["id"].tolist() == [0, 1, 2, 3]
+    assert records["x"].tolist() == [0, .25, .5, .75]
+
+def test_length_prefix_covers_the_message():
+    packer = MessagePacker(maxFingers=4, lengthPrefix=True)
+    message = bytes(packer.pack(1, 0, createFrame(1).fingers))
+
+    length, = netLength.unpack_from(message)
+    assert length == len(message) - netLength.size
+    assert unpackMessage(message[netLength.size:])[0] == 1
+
+def test_other_messages_are_rejected():
+    message = bytearray(MessagePacker().pack(1, 0, []))
+    assert unpackMessage(bytes(message[:-1])) is None
+
+    message[0]^= 0xFF
+    assert unpackMessage(bytes(message)) is None
+
+def test_udp_subscribers_receive_frames():
+    publisher = UdpPublisher(loopbackAddress)
+    subscriber = UdpSubscriber(publisher.socket.getsockname())
+
+    # Note: nothing is sent until a subscriber registers, the first read sends its subscribe request
+    assert subscriber.read(timeout=.05) is None
+
+    frame = createFrame(3)
+    publisher.publish(frame)
+    frameId, timestamp, records = subscriber.read(timeout=1)
+
+    assert frameId == 3
+    assert abs(timestamp - monotonicToUnix(frame.captureTime)) < 1e-3
+    assert records["id"].tolist() == [0, 1]
+
+    subscriber.close()
+    time.sleep(.05)
+    publisher.publish(createFrame(4))
+    assert publisher.subscribers == {}
+
+    publisher.close()
+
+def test_tcp_subscribers_receive_frames_in_order():
+    publisher = TcpPublisher(loopbackAddress)
+    subscriber = TcpSubscriber(publisher.socket.getsockname())
+
+    for frameId in range(1, 4):
+        publisher.publish(createFrame(frameId, numFingers=frameId))
+
+    frames = [subscriber.read(timeout=1) for _ in range(3)]
+    assert [frameId for frameId, _, _ in frames] == [1, 2, 3]
+    assert [len(records) for _, _, records in frames] == [1, 2, 3]
+    assert np.array_equal(frames[-1][2]["y"], np.float32([0, -.25, -.5]))
+
+    subscriber.close()
+    publisher.close()
+
+# Note: a subscriber that stops reading keeps only the message in flight plus the newest ones
+def test_tcp_publisher_drops_frames_for_stalled_subscribers():
+    publisher = TcpPublisher(loopbackAddress, maxQueuedMessages=2)
+    subscriber = TcpSubscriber(publisher.socket.getsockname())
+
+    publisher.publish(createFrame(0))
+    publisher.subscribers[0].connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024)
+
+    # Note: big frames fill the socket buffers quickly
+    for frameId in range(1, 2000):
+        publisher.publish(createFrame(frameId, numFingers=16))
+        if publisher.dropped > 0:
+            break
+
+    assert publisher.dropped > 0
+    assert len(publisher.subscribers[0].messages) <= 2
+
+    subscriber.close()
+    publisher.close()
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from framesource import SyntheticSource
+from recorder import SessionReader, SessionSource, fingerFields, replaySession
+from touchpad import NullPublisher, Touchpad
+
+width, height = 320, 240
+numFrames = 12
+
+# Runs a headless touchpad over synthetic frames while recording them to `path` and returns the pixels it read
+def recordSession(path:str, codec:str):
+    source = SyntheticSource(width, height, numFingers=2, numFrames=numFrames, diameterRange=(36, 44), speed=3)
+    touchpad = Touchpad(source, publisher=NullPublisher(), headless=True, clip=(0, 0, width, height))
+
+    readPixels = []
+    read = source.read
+    def recordingRead():
+        success, pixels = read()
+        if success:
+            readPixels.append(pixels.copy())
+        return success, pixels
+    source.read = recordingRead
+
+    touchpad.startRecording(path, codec)
+    for frameId in range(numFrames):
+        # Note: a slider change halfway through should be recorded with the frame it was applied to
+        if frameId == numFrames//2:
+            touchpad.sliders.maxRadiusAspect.setValue(4)
+        touchpad.update()
+
+    touchpad.stopRecording()
+    touchpad.close()
+    return readPixels
+
+@pytest.mark.parametrize("codec", ["raw", "png"])
+def test_session_round_trips_frames(tmp_path, codec:str):
+    path = str(tmp_path / "session")
+    readPixels = recordSession(path, codec)
+
+    reader = SessionReader(path)
+    assert len(reader) == numFrames
+    assert reader.getMissingFrames() == 0
+    assert (reader.width, reader.height, reader.codec) == (width, height, codec)
+    assert reader.header["fingerFields"] == fingerFields
+
+    for (entry, pixels), expectedPixels in zip(reader, readPixels):
+        assert np.array_equal(pixels, expectedPixels)
+        assert all(len(finger) == len(fingerFields) for finger in entry["fingers"])
+
+    # Note: slider values are only stored when they change
+    sliderFrames = [index for index, entry in enumerate(reader.entries) if "sliders" in entry]
+    assert sliderFrames == [0, numFrames//2]
+    assert reader.entries[numFrames//2]["sliders"]["maxRadiusAspect"] == 4
+
+    reader.close()
+
+def test_replay_reproduces_recorded_fingers(tmp_path):
+    path = str(tmp_path / "session")
+    recordSession(path, "raw")
+
+    reader = SessionReader(path)
+    replayed = [(entry["fingers"], list(frame.fingers)) for entry, frame in replaySession(reader)]
+    reader.close()
+
+    assert len(replayed) == numFrames
+    assert sum(len(recorded) for recorded, _ in replayed) > 0
+
+    for recorded, fingers in replayed:
+        assert len(fingers) == len(recorded)
+        for recordedFinger, finger in zip(recorded, fingers):
+            assert recordedFinger[:2] == [finger.x, finger.y]
+            assert recordedFinger[fingerFields.index("id")] == finger.id
+
+def test_session_source_plays_frames_back(tmp_path):
+    path = str(tmp_path / "session")
+    readPixels = recordSession(path, "png")
+
+    source = SessionSource(path)
+    assert not source.live
+
+    playedPixels = []
+    while source.isOpen():
+        success, pixels = source.read()
+        assert success
+        playedPixels.append(pixels)
+
+    assert source.read() == (False, None)
+    assert len(playedPixels) == numFrames
+    assert all(np.array_equal(played, expected) for played, expected in zip(playedPixels, readPixels))
+
+    source.close()
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from netpublisher import MessagePacker, unpackMessage
+from ringbuffer import fillRecords, recordDtype
+from touchpad import FilePublisher, Finger, Frame
+
+def createFinger(i:int):
+    finger = Finger(i/8, -i/8, 40 + i, 36 - i, 5*i)
+    finger.id = i
+    finger.vx, finger.vy = .5*i, -.25*i
+    finger.ax, finger.ay = 2*i, -i
+    finger.predictedX, finger.predictedY = finger.x + .01, finger.y - .01
+    return finger
+
+def test_fingers_have_no_instance_dict():
+    with pytest.raises(AttributeError):
+        createFinger(0).__dict__
+
+def test_records_hold_every_published_field():
+    fingers = [createFinger(i) for i in range(3)]
+    records = np.zeros(2, dtype=recordDtype)
+
+    assert fillRecords(records, 4, 1.5, fingers) == 2
+
+    for record, finger in zip(records, fingers):
+        assert (record["frameId"], record["timestamp"], record["id"]) == (4, 1.5, finger.id)
+        for field in ["x", "y", "d1", "d2", "angle", "vx", "vy", "predictedX", "predictedY", "ax", "ay"]:
+            assert record[field] == np.float32(getattr(finger, field))
+
+# Note: the packer hands out views of one buffer so packing a frame doesn't allocate a message
+def test_packer_reuses_its_buffer():
+    packer = MessagePacker(maxFingers=4)
+
+    first = packer.pack(1, 0, [createFinger(1)])
+    assert unpackMessage(bytes(first))[2]["id"].tolist() == [1]
+
+    second = packer.pack(2, 0, [createFinger(2), createFinger(3)])
+    assert first.obj is second.obj is packer.buffer
+    assert unpackMessage(bytes(second))[2]["id"].tolist() == [2, 3]
+
+# Note: the file format is read by existing clients so it has to match what str(finger) gave per line before packing
+def test_file_publisher_writes_one_line_per_finger(tmp_path):
+    path = str(tmp_path / "touchpad.out")
+    frame = Frame(12, None, 0)
+    frame.fingers = [createFinger(i) for i in range(3)]
+
+    FilePublisher(path).publish(frame)
+
+    with open(path) as file:
+        lines = file.read().splitlines()
+
+    assert lines == [f"frameId: 12 {finger}" for finger in frame.fingers]
+
+    finger = frame.fingers[1]
+    assert lines[1] == f"frameId: 12 x: {finger.x} y: {finger.y} d1: {finger.d1} d2: {finger.d2} id: {finger.id} " + \
+                       f"vx: {finger.vx} vy: {finger.vy} px: {finger.predictedX} py: {finger.predictedY} ax: {finger.ax} ay: {finger.ay}"
+
+def test_file_publisher_writes_empty_frames(tmp_path):
+    path = str(tmp_path / "touchpad.out")
+
+    FilePublisher(path).publish(Frame(0, None, 0))
+
+    with open(path) as file:
+        assert file.read() == ""
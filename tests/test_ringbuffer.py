@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from ringbuffer import RingBufferReader, RingBufferWriter, getRingBufferSize, recordDtype, ringBufferHeaderSize
+from touchpad import Finger
+
+def createFinger(x:float, y:float, id:int):
+    finger = Finger(x, y, 30, 28, 15)
+    finger.id = id
+    finger.vx, finger.vy = .5, -.25
+    return finger
+
+@pytest.fixture
+def ringBuffer(tmp_path):
+    writer = RingBufferWriter(str(tmp_path / "fingers.ring"), slotCount=4, maxFingers=3)
+    reader = RingBufferReader(writer.path)
+    yield writer, reader
+
+    reader.close()
+    writer.close()
+
+def test_reader_sees_nothing_before_the_first_frame(ringBuffer):
+    _, reader = ringBuffer
+
+    assert reader.getSequence() == 0
+    assert reader.readLatest() is None
+
+def test_frames_round_trip(ringBuffer):
+    writer, reader = ringBuffer
+
+    writer.write(7, 1234.5, [createFinger(.25, -.5, 2), createFinger(-.75, .125, 5)])
+    frameId, timestamp, records = reader.readLatest()
+
+    assert (frameId, timestamp) == (7, 1234.5)
+    assert records.dtype == recordDtype
+    assert records["id"].tolist() == [2, 5]
+    assert records["x"].tolist() == [.25, -.75]
+    assert records["y"].tolist() == [-.5, .125]
+    assert records["vx"].tolist() == [.5, .5]
+    assert np.all(records["frameId"] == 7)
+
+    # Note: each frame is only read once
+    assert reader.readLatest() is None
+
+def test_reader_skips_to_the_newest_frame_after_the_writer_laps_it(ringBuffer):
+    writer, reader = ringBuffer
+
+    for frameId in range(10):
+        writer.write(frameId, frameId/30, [createFinger(0, 0, frameId)])
+
+    frameId, _, records = reader.readLatest()
+    assert frameId == 9
+    assert records["id"].tolist() == [9]
+
+def test_fingers_past_the_slot_capacity_are_dropped(ringBuffer):
+    writer, reader = ringBuffer
+
+    writer.write(0, 0, [createFinger(0, 0, id) for id in range(5)])
+    _, _, records = reader.readLatest()
+
+    assert records["id"].tolist() == [0, 1, 2]
+
+# Note: a slot whose begin and end sequences disagree is being rewritten so the reader has to retry rather than return it
+def test_torn_slots_are_not_returned(ringBuffer):
+    writer, reader = ringBuffer
+
+    writer.write(0, 0, [createFinger(0, 0, 1)])
+    writer.slots[1]["beginSequence"] = 5
+
+    assert reader.readLatest(maxAttempts=3) is None
+    assert reader.lastSequence == 0
+
+def test_file_has_the_documented_layout(ringBuffer):
+    writer, _ = ringBuffer
+
+    assert recordDtype.itemsize == 64
+    assert writer.slotDtype.itemsize == 40 + 3*64
+    assert writer.buffer.size() == getRingBufferSize(4, 3) == ringBufferHeaderSize + 4*writer.slotDtype.itemsize
+    assert int(writer.header["magic"]) == 0x42525054
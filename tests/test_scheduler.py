@@ -0,0 +1,110 @@
+import math
+import types
+
+import touchpad as touchpadModule
+from framesource import SyntheticSource
+from scheduler import qualityLevels
+from touchpad import Frame, NullPublisher, Touchpad
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.
+
+    def monotonic(self):
+        return self.now
+
+# Note: stands in for GridRenderer, every repaint advances the clock by `drawTime`
+class FakeRenderer:
+    def __init__(self, clock:FakeClock, drawTime:float) -> None:
+        self.clock = clock
+        self.drawTime = drawTime
+        self.renderInterval = 0
+        self.lastRenderTime = -math.inf
+
+    def setMaxRenderRate(self, maxRenderRate:float):
+        self.renderInterval = 1/maxRenderRate if maxRenderRate > 0 else 0
+
+    def isDue(self, now:float = None):
+        return self.clock.now - self.lastRenderTime >= self.renderInterval
+
+    def show(self, images:list):
+        if not self.isDue():
+            return False
+
+        self.lastRenderTime = self.clock.now
+        self.clock.now+= self.drawTime
+        return True
+
+def createTouchpad(monkeypatch, clock:FakeClock, drawTime:float, frameBudget:float):
+    monkeypatch.setattr(touchpadModule, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+
+    # Note: unpainted frames still pump window events
+    monkeypatch.setattr(touchpadModule.cv, "pollKey", lambda: -1)
+
+    touchpad = Touchpad(SyntheticSource(160, 120, numFrames=1), publisher=NullPublisher(), headless=True, frameBudget=frameBudget)
+    touchpad.headless = False
+    touchpad.renderer = FakeRenderer(clock, drawTime)
+    return touchpad
+
+# Runs `numFrames` frames of `detectTime` work at `fps` the way Touchpad.update and draw do and returns each frame's quality level
+def runFrames(touchpad:Touchpad, clock:FakeClock, numFrames:int, detectTime:float, fps:float = 60, inFrameTime:bool = True):
+    levels = []
+    for frameId in range(numFrames):
+        frameStart = clock.now
+
+        if touchpad.pendingQualityLevel is not None:
+            touchpad.setQualityLevel(touchpad.pendingQualityLevel)
+            touchpad.pendingQualityLevel = None
+
+        frame = Frame(frameId, None, frameStart)
+        frame.tapLevel = touchpad.getTapLevel()
+        frame.stageTimes.update(detectStart=frameStart, detected=frameStart + detectTime,
+                                publishStart=frameStart + detectTime, published=frameStart + detectTime)
+        clock.now+= detectTime
+
+        touchpad.recordLatency(frame)
+        touchpad.draw(frame, inFrameTime)
+        levels.append(touchpad.qualityLevel)
+
+        clock.now = max(clock.now, frameStart + 1/fps)
+
+    return levels
+
+def test_render_cap_lets_scheduler_recover(monkeypatch):
+    clock = FakeClock()
+    touchpad = createTouchpad(monkeypatch, clock, drawTime=.03, frameBudget=.02)
+
+    # Note: repainting every frame blows the budget but repaints capped by the 'render' level fit it
+    levels = runFrames(touchpad, clock, 1200, detectTime=.004)
+
+    renderLevel = levels.index(3)
+    assert 4 not in levels
+    assert min(levels[renderLevel:]) < 3
+
+def test_concurrent_repaints_are_not_frame_work(monkeypatch):
+    clock = FakeClock()
+    touchpad = createTouchpad(monkeypatch, clock, drawTime=.03, frameBudget=.02)
+
+    levels = runFrames(touchpad, clock, 300, detectTime=.004, inFrameTime=False)
+
+    assert set(levels) == {0}
+    assert touchpad.uncountedDrawTime == 0
+
+def test_degraded_levels_run_fewer_denoise_iterations(monkeypatch):
+    touchpad = createTouchpad(monkeypatch, FakeClock(), drawTime=0, frameBudget=.02)
+    fullIterations = touchpad.getDenoiseIterations()
+
+    for level in range(1, len(qualityLevels)):
+        touchpad.setQualityLevel(level)
+        assert touchpad.getDenoiseIterations() < fullIterations
+
+# Note: the scheduler runs on the detect thread so the renderer only takes the new rate when the drawing thread repaints
+def test_render_rate_changes_wait_for_draw(monkeypatch):
+    clock = FakeClock()
+    touchpad = createTouchpad(monkeypatch, clock, drawTime=0, frameBudget=.02)
+
+    touchpad.setQualityLevel(3)
+    assert touchpad.renderer.renderInterval == 0
+
+    touchpad.draw(Frame(0, None, clock.now))
+    assert touchpad.renderer.renderInterval == 1/qualityLevels[3].maxRenderRate
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+
+import cv2 as cv
+
+from framesource import SyntheticSource
+from service import TouchpadService
+from touchpad import MinMaxSlider, NullPublisher, Touchpad
+
+def createService(tmp_path):
+    touchpad = Touchpad(SyntheticSource(160, 120, numFrames=1), publisher=NullPublisher(), headless=True)
+    return TouchpadService(touchpad, presetsPath=str(tmp_path/"presets"))
+
+def request(service:TouchpadService, rawRequest:bytes):
+
+    async def handle():
+        reader = asyncio.StreamReader()
+        reader.feed_data(rawRequest)
+        reader.feed_eof()
+        return await service.handleHttpRequest(reader)
+
+    return asyncio.run(handle())
+
+def put(path:str, body):
+    rawBody = json.dumps(body).encode()
+    return f"PUT {path} HTTP/1.1\r\nContent-Length: {len(rawBody)}\r\n\r\n".encode() + rawBody
+
+def test_malformed_content_length_is_bad_request(tmp_path):
+    service = createService(tmp_path)
+
+    status, response = request(service, b"PUT /sliders HTTP/1.1\r\nContent-Length: abc\r\n\r\n{}")
+
+    assert status == 400
+    assert "Content-Length" in response["error"]
+
+def test_invalid_presets_are_not_saved(tmp_path):
+    service = createService(tmp_path)
+
+    for preset in [{"notASlider": 1}, {"area": "big"}, {"area": [1, 2, 3]}]:
+        status, _ = request(service, put("/presets/bad", preset))
+        assert status == 400
+
+    assert not os.path.exists(tmp_path/"presets"/"bad.json")
+
+    status, response = request(service, put("/presets/good", {"area": [150, 2500]}))
+    assert status == 200
+    assert response == {"area": [150, 2500]}
+
+# Note: detection runs on another thread than the service so a change is only applied as a whole before the next frame
+def test_slider_changes_apply_together_before_the_next_frame(tmp_path):
+    service = createService(tmp_path)
+    touchpad = service.touchpad
+    minArea, maxArea = touchpad.sliders.area.getValue()
+
+    status, response = request(service, put("/sliders", {"area": [minArea + 100, maxArea - 100], "motionThreshold": 3}))
+    assert status == 200
+    assert response["area"] == [minArea + 100, maxArea - 100]
+    assert touchpad.sliders.area.getValue() == (minArea, maxArea)
+
+    touchpad.detectFingers(touchpad.captureFrame())
+    assert touchpad.sliders.area.getValue() == (minArea + 100, maxArea - 100)
+    assert touchpad.sliders.motionThreshold.getValue() == 3
+
+def test_trackbars_follow_values_set_without_them(monkeypatch):
+    trackbars = {}
+    monkeypatch.setattr(cv, "createTrackbar", lambda name, window, value, count, onChange: trackbars.__setitem__(name, value))
+    monkeypatch.setattr(cv, "setTrackbarPos", lambda name, window, value: trackbars.__setitem__(name, value))
+
+    slider = MinMaxSlider("area", "window", 0, 100, 10, 90)
+    slider.setValue((20, 80))
+    slider.syncTrackbar()
+
+    assert trackbars == {"area min\n": 20, "area max\n": 80}
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+import touchpad as touchpadModule
+from calibration import Calibration
+from framesource import SyntheticFinger, SyntheticSource, renderSyntheticFrame
+from touchpad import Frame, NullPublisher, Touchpad
+from tracker import FingerTracker
+
+width, height = 320, 240
+
+def createTouchpad(**kwargs):
+    return Touchpad(SyntheticSource(width, height, numFrames=1), publisher=NullPublisher(), headless=True, **kwargs)
+
+# Returns a frame of `fingers` detected after an empty frame the background is learned from
+def detect(touchpad:Touchpad, fingers:list[SyntheticFinger]):
+    touchpad.detectFingers(Frame(0, renderSyntheticFrame(width, height, []), 0))
+
+    frame = Frame(1, renderSyntheticFrame(width, height, fingers), 1/30)
+    touchpad.detectFingers(frame)
+    return frame
+
+# Note: a disc this small only leaves a hole that passes the default area slider when the gradient ring (or the erosion
+#       the components detector matches it with) is one iteration thick
+@pytest.mark.parametrize("detector", [Touchpad.Detector.Contours, Touchpad.Detector.Components])
+def test_default_sliders_accept_small_fingers(detector:int):
+    touchpad = createTouchpad()
+    touchpad.sliders.detector.setValue(detector)
+
+    fingers = detect(touchpad, [SyntheticFinger(width/2, height/2, 22, 22, 0, 0, 0)]).fingers
+
+    assert len(fingers) == 1
+    assert np.hypot(fingers[0].cameraX - width/2, fingers[0].cameraY - height/2) < 1
+
+# Note: pipelined overlays are drawn on the GUI thread after detection, possibly after the scheduler changed the detection region
+def test_overlay_maps_contours_with_the_region_they_were_detected_in(monkeypatch):
+    touchpad = createTouchpad()
+    frame = detect(touchpad, [SyntheticFinger(width/2, height/2, 30, 30, 0, 0, 0)])
+    assert len(frame.contours) > 0
+
+    touchpad.setQualityLevel(2)
+
+    drawnContours = []
+    monkeypatch.setattr(touchpadModule.cv, "drawContours", lambda pixels, contours, *args, **kwargs: drawnContours.extend(contours))
+    touchpad.drawOverlay(frame)
+
+    # Note: the finger's ring is the only thing in the frame so every contour should be centered on it
+    centers = [np.mean(contour.reshape(-1, 2), axis=0) for contour in drawnContours]
+    assert all(np.hypot(x - width/2, y - height/2) < 2 for x, y in centers)
+
+# Note: the tracker smooths the fingers it's given in place so idle frames must not feed its output back in as detections
+def test_idle_frames_republish_raw_detections(monkeypatch):
+    touchpad = createTouchpad(tracker=FingerTracker(outputFilter="ema"))
+
+    trackedPositions = []
+    update = touchpad.tracker.update
+    def recordingUpdate(fingers, timestamp):
+        trackedPositions.append([(finger.x, finger.y) for finger in fingers])
+        update(fingers, timestamp)
+    monkeypatch.setattr(touchpad.tracker, "update", recordingUpdate)
+
+    touchpad.detectFingers(Frame(0, renderSyntheticFrame(width, height, []), 0))
+
+    # Note: a moving finger leaves the smoothed positions lagging behind the detections
+    for frameId in range(1, 6):
+        pixels = renderSyntheticFrame(width, height, [SyntheticFinger(width/4 + 20*frameId, height/2, 30, 30, 0, 0, 0)])
+        touchpad.detectFingers(Frame(frameId, pixels, frameId/30))
+
+    idleFrame = Frame(6, pixels, 6/30)
+    touchpad.detectFingers(idleFrame)
+
+    # Note: idle frames skip contour detection
+    assert idleFrame.contours == ()
+    assert len(trackedPositions[-1]) == 1
+    assert trackedPositions[-1] == trackedPositions[-2]
+
+def test_calibration_must_match_frame_size():
+    createTouchpad(calibration=Calibration((width, height)))
+
+    with pytest.raises(AssertionError, match="640x480"):
+        createTouchpad(calibration=Calibration((640, 480)))
+
+# Note: presentation timestamps of files and recordings give their nominal rate rather than the achieved one
+@pytest.mark.parametrize("live, expectedFps", [(True, 30), (False, 100)])
+def test_achieved_fps_uses_driver_times_of_live_sources_only(live:bool, expectedFps:float):
+    touchpad = createTouchpad()
+    touchpad.source.live = live
+
+    for frameId in range(10):
+        touchpad.recordFrameTimes(Frame(frameId, None, frameId/100, frameId/30))
+
+    assert touchpad.getAchievedFps() == pytest.approx(expectedFps)
+
+# Note: fingers resting on the table when the touchpad starts are in the first frame the background is seeded from
+def test_fingers_present_from_the_first_frame_are_detected():
+    source = SyntheticSource(width, height, numFingers=2, numFrames=10, speed=0, diameterRange=(30, 40), seed=1)
+    touchpad = Touchpad(source, publisher=NullPublisher(), headless=True, clip=(0, 0, width, height))
+
+    for _ in range(10):
+        frame = touchpad.captureFrame()
+        touchpad.detectFingers(frame)
+
+        assert len(frame.fingers) == len(source.groundTruth)
+
+# Note: the components detector labels a 2x2 pooled copy of the holes but measures each finger from its own holes pixels,
+#       so fingers a few pixels apart at odd offsets should come out where the contour detector puts them
+def test_components_match_contours_for_neighboring_fingers():
+    fingers = [SyntheticFinger(width/2 - 24, height/2 + .5, 30, 30, 0, 0, 0), SyntheticFinger(width/2 + 18, height/2 + 9.5, 30, 30, 0, 0, 0)]
+
+    centers = {}
+    for detector in [Touchpad.Detector.Contours, Touchpad.Detector.Components]:
+        touchpad = createTouchpad()
+        touchpad.sliders.detector.setValue(detector)
+        centers[detector] = sorted((finger.cameraX, finger.cameraY) for finger in detect(touchpad, fingers).fingers)
+
+    assert len(centers[Touchpad.Detector.Components]) == len(fingers)
+    assert np.allclose(centers[Touchpad.Detector.Components], centers[Touchpad.Detector.Contours], atol=1)
@@ -0,0 +1,97 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from touchpad import Finger
+from tracker import FingerTracker, solveAssignment
+
+frameRate = 60
+
+def getTotalCost(cost:np.ndarray, pairs:list):
+    return sum(cost[row, col] for row, col in pairs)
+
+@pytest.mark.parametrize("shape", [(4, 4), (3, 5), (5, 3), (1, 4)])
+def test_assignment_is_optimal(shape:tuple):
+    rng = np.random.default_rng(sum(shape))
+
+    for _ in range(20):
+        cost = rng.random(shape)
+        pairs = solveAssignment(cost)
+
+        numPairs = min(shape)
+        assert len(pairs) == numPairs
+        assert len({row for row, _ in pairs}) == len({col for _, col in pairs}) == numPairs
+
+        # Note: brute force over every way of matching the smaller side
+        if shape[0] <= shape[1]:
+            best = min(sum(cost[row, col] for row, col in enumerate(cols)) for cols in itertools.permutations(range(shape[1]), shape[0]))
+        else:
+            best = min(sum(cost[row, col] for col, row in enumerate(rows)) for rows in itertools.permutations(range(shape[0]), shape[1]))
+
+        assert getTotalCost(cost, pairs) == pytest.approx(best)
+
+def test_empty_assignment():
+    assert solveAssignment(np.zeros((0, 3))) == []
+
+# Runs `tracker` over frames of finger positions and returns the fingers of every frame
+def track(tracker:FingerTracker, positionsPerFrame:list):
+    frames = []
+    for frameId, positions in enumerate(positionsPerFrame):
+        fingers = [Finger(x, y, 30, 30, 0) for x, y in positions]
+        tracker.update(fingers, frameId/frameRate)
+        frames.append(fingers)
+
+    return frames
+
+def test_ids_follow_moving_fingers():
+    tracker = FingerTracker()
+
+    # Note: detection order changes every frame so ids can't just follow list positions
+    positionsPerFrame = []
+    for frameId in range(10):
+        positions = [(-.5 + .02*frameId, 0), (.5 - .02*frameId, .2)]
+        positionsPerFrame.append(positions if frameId % 2 == 0 else positions[::-1])
+
+    frames = track(tracker, positionsPerFrame)
+
+    idsByRow = [{round(finger.y, 1): finger.id for finger in fingers} for fingers in frames]
+    assert all(ids == idsByRow[0] for ids in idsByRow)
+    assert sorted(idsByRow[0].values()) == [0, 1]
+
+def test_far_detections_start_new_tracks():
+    tracker = FingerTracker(maxDistance=.1)
+
+    frames = track(tracker, [[(0, 0)], [(.5, .5)]])
+
+    assert frames[1][0].id != frames[0][0].id
+
+def test_tracks_survive_missed_frames_then_expire():
+    tracker = FingerTracker(maxMissedFrames=2)
+
+    frames = track(tracker, [[(0, 0)], [], [], [(0, 0)]])
+    assert frames[3][0].id == frames[0][0].id
+
+    frames = track(tracker, [[], [], [], [(0, 0)]])
+    assert frames[3][0].id != 0
+    assert len(tracker.tracks) == 1
+
+def test_velocity_and_prediction_follow_constant_motion():
+    tracker = FingerTracker(predictionHorizon=.05)
+    velocity = np.array([.6, -.3])
+
+    frames = track(tracker, [[tuple(velocity*frameId/frameRate)] for frameId in range(20)])
+    finger = frames[-1][0]
+
+    assert (finger.vx, finger.vy) == pytest.approx(tuple(velocity), abs=1e-6)
+    assert (finger.ax, finger.ay) == pytest.approx((0, 0), abs=1e-4)
+    assert (finger.predictedX, finger.predictedY) == pytest.approx(tuple(velocity*(19/frameRate + .05)), abs=1e-3)
+
+def test_reset_restarts_ids():
+    tracker = FingerTracker()
+    track(tracker, [[(0, 0), (.5, .5)]])
+
+    tracker.reset()
+    frames = track(tracker, [[(0, 0)]])
+
+    assert frames[0][0].id == 0
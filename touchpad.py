@@ -1,9 +1,29 @@
 import argparse
+import asyncio
+import collections
+import contextlib
+import json
 import math
 import os
+import threading
+import time
 import cv2 as cv
 import numpy as np
 
+from autotune import defaultProfilePath, loadProfile
+from background import ActivityGate, BackgroundModel
+from calibration import Calibration
+from filters import outputFilters, parseFilterParams
+from framesource import CameraSource, ThreadedSource, captureProfiles, openFrameSource
+from metrics import MetricsRegistry, MetricsServer
+from netpublisher import TcpPublisher, UdpPublisher, parseAddress
+from recorder import SessionRecorder
+from renderer import GridRenderer
+from ringbuffer import RingBufferWriter
+from scheduler import FrameBudgetScheduler, qualityLevels
+from service import TouchpadService
+from tracker import FingerTracker
+
 def inRange(value, min, max):
     return value >= min and value <= max
 
@@ -26,11 +46,15 @@ class LogLevel:
 
 verboseLevel:int = LogLevel.Debug
 
+def isLogging(logLevel = LogLevel.Debug):
+    return verboseLevel >= logLevel
+
+# Note: `msg` can be a callable that builds the message so hot paths don't pay for formatting when it won't be printed
 def log(msg, logLevel = LogLevel.Debug):
     global verboseLevel
 
     if(verboseLevel >= logLevel):
-        print(msg)
+        print(msg() if callable(msg) else msg)
 
 # NOTE: Colors are in BGR to align with opencv
 class Color:
@@ -42,6 +66,7 @@ class Color:
     blue  = (255,   0,   0)
 
 
+# Note: Sliders with a window of None are headless and only hold their value
 class Slider:
     
     def __init__(self, name:str, window:str, minValue:int = 0, maxValue:int = 255, defaultValue:int = None, onSetValue = None) -> None:
@@ -56,8 +81,11 @@ class Slider:
         assert inRange(defaultValue, minValue, maxValue), f"DefaultValue: {defaultValue} is out of range: [{minValue}, {maxValue}]"
         self.setValue(defaultValue)
 
+        # Note: where the trackbar currently sits, see syncTrackbar
+        self.trackbarValue = self._value
 
-        cv.createTrackbar(self.name, self.window, self._value, self.maxValue, self.setValue)
+        if self.window is not None:
+            cv.createTrackbar(self.name, self.window, self._value, self.maxValue, self.onTrackbar)
 
     def getValue(self):
         return self._value
@@ -69,12 +97,28 @@ class Slider:
 
         self._value = int(clamp(value, self.minValue, self.maxValue))
 
+    def onTrackbar(self, value:int):
+        self.trackbarValue = value
+        self.setValue(value)
+
+    # Moves the trackbar to a value that was set without it (e.g. through the control service)
+    # Note: HighGUI has to be driven from the thread that owns the windows so this is called when drawing
+    def syncTrackbar(self):
+        if self.window is None or self.trackbarValue == self._value:
+            return
+
+        self.trackbarValue = self._value
+        cv.setTrackbarPos(self.name, self.window, self._value)
+
 
 class NamedImage:
 
-    def __init__(self, name:str, pixels:cv.Mat, nameOrigin:tuple[int, int] = None) -> None:
+    # Note: `pixels` can also be a callable that produces the pixels the first time getPixels is called
+    #       so debug images that are never displayed are never built
+    def __init__(self, name:str, pixels, nameOrigin:tuple[int, int] = None) -> None:
         self.name = name
-        self.pixels = pixels
+        self.pixels = None if callable(pixels) else pixels
+        self.pixelsFactory = pixels if callable(pixels) else None
 
         self.font = cv.FONT_HERSHEY_DUPLEX
         self.fontColor = Color.white
@@ -92,29 +136,41 @@ class NamedImage:
         textWidth, textHeight  = cv.getTextSize(text, self.font, self.fontSize, self.getShadowThickness())[0]
         return (textWidth, textHeight)
 
+    # Note: the default origin is laid out on first use so unused images never measure their name
     def setNameOrigin(self, nameOrigin:tuple[int, int]):
+        self.nameOrigin = nameOrigin
 
-        if nameOrigin is None:
+    def getNameOrigin(self):
 
+        if self.nameOrigin is None:
             _, nameHeight  = self.getTextSize(self.name)
             self.nameOrigin = (self.defaultFontPadding[0], nameHeight + self.defaultFontPadding[1])
-        
-        else:
-            self.nameOrigin = nameOrigin 
+
+        return self.nameOrigin
+
+    def getPixels(self):
+
+        if self.pixels is None and self.pixelsFactory is not None:
+            self.pixels = self.pixelsFactory()
+            self.pixelsFactory = None
+
+        return self.pixels
 
     def getShadowThickness(self):
         return self.fontThickness + self.fontShadowSize
 
-    def drawText(self, text:str, origin:tuple[int, int]):
+    # Note: draws into `pixels` when given (e.g. a render tile) so the image itself stays untouched
+    def drawText(self, text:str, origin:tuple[int, int], pixels:cv.Mat = None):
 
         # Note: opencv requires integer position for text
         intOrigin = (int(origin[0]), int(origin[1]))
+        pixels = self.pixels if pixels is None else pixels
 
-        shadowImage = cv.putText(self.pixels, text, intOrigin, self.font, self.fontSize, self.fontShadowColor, self.getShadowThickness(), cv.LINE_AA)
+        shadowImage = cv.putText(pixels, text, intOrigin, self.font, self.fontSize, self.fontShadowColor, self.getShadowThickness(), cv.LINE_AA)
         return cv.putText(shadowImage, text, intOrigin, self.font, self.fontSize, self.fontColor, self.fontThickness, cv.LINE_AA)
 
-    def getImage(self):
-        return self.drawText(self.name, self.nameOrigin)
+    def drawLabel(self, pixels:cv.Mat):
+        return self.drawText(self.name, self.getNameOrigin(), pixels)
 
 class MinMaxSlider:
 
@@ -130,7 +186,26 @@ class MinMaxSlider:
     def getMaxValue(self):
         return self.maxSlider.getValue()        
 
+    def getValue(self):
+        return (self.getMinValue(), self.getMaxValue())
+
+    def setValue(self, value:tuple[int, int]):
+        minValue, maxValue = value
+        self.minSlider.setValue(minValue)
+        self.maxSlider.setValue(maxValue)
+
+    def syncTrackbar(self):
+        self.minSlider.syncTrackbar()
+        self.maxSlider.syncTrackbar()
+
+# Note: `%s` formats exactly like the f-string fields it replaced, see Finger.__str__ for the token layout
+fingerFormat = "x: %s y: %s d1: %s d2: %s id: %s vx: %s vy: %s px: %s py: %s ax: %s ay: %s"
+
+# Note: slots keep fingers small and attribute access fast since a few are created every frame
 class Finger:
+
+    __slots__ = ("x", "y", "d1", "d2", "angle", "cameraX", "cameraY", "id", "vx", "vy", "ax", "ay", "predictedX", "predictedY")
+
     def __init__(self, x, y, d1, d2, angle) -> None:
         self.x = x
         self.y = y
@@ -138,22 +213,247 @@ class Finger:
         self.d2 = d2
         self.angle = angle
 
-    # TODO: This is a hack to get things working, we really want to use a
-    #       a clipping rectangle and transform coordinates to that
-    def correctY(self, y):
-        ret = y * 2
-        if ret > 1:
-            return 1
-        elif ret < -1:
-            return -1
-        else:
-            return ret
+        # Note: ellipse center in camera pixels when known (not published)
+        self.cameraX = None
+        self.cameraY = None
+
+        # Note: filled in by FingerTracker, id is -1 for untracked fingers
+        self.id = -1
+        self.vx = 0
+        self.vy = 0
+        self.ax = 0
+        self.ay = 0
+        self.predictedX = x
+        self.predictedY = y
 
     def __str__(self) -> str:
 
         # TODO: replace d1, d2 with width/height and add angle
         #       Make sure this doesn't break loren's airhockey code!
-        return f"x: {self.x} y: {self.correctY(self.y)} d1: {self.d1} d2: {self.d2}"
+        # Note: tracking fields are appended so the existing token positions stay the same
+        return fingerFormat % (self.x, self.y, self.d1, self.d2, self.id, self.vx, self.vy, self.predictedX, self.predictedY, self.ax, self.ay)
+
+class Frame:
+    def __init__(self, frameId:int, pixels:cv.Mat, captureTime:float, driverTime:float = None) -> None:
+        self.frameId = frameId
+        self.captureTime = captureTime
+
+        # Note: timestamp the camera driver gave the frame on its own clock, None when the source doesn't have one
+        self.driverTime = driverTime
+
+        self.rawImage = NamedImage("Raw", pixels)
+
+        self.fingers:list[Finger] = []
+        self.renderImages:list[NamedImage] = []
+
+        # Note: highest RenderLevel tapped for this frame or None if nobody was watching when it was detected
+        self.tapLevel:int = None
+
+        # Note: contours found in the detection image, kept for the overlay
+        self.contours = ()
+
+        # Note: where the detection image sat in the frame when it was detected, maps the contours back for the overlay
+        #       since the detection region can change (see Touchpad.setQualityLevel) before the frame is drawn
+        self.clipOffset = np.int32((0, 0))
+        self.downscaleFactor = 1
+
+        # Note: monotonic time each pipeline stage reached the frame, keyed by stage name
+        self.stageTimes:dict[str, float] = {"captured": captureTime}
+
+        # Note: quality level (see scheduler.qualityLevels) the frame was detected at
+        self.qualityLevel = 0
+
+    def markStage(self, stage:str):
+        self.stageTimes[stage] = time.monotonic()
+
+    def getStageDelta(self, fromStage:str, toStage:str):
+        return self.stageTimes[toStage] - self.stageTimes[fromStage]
+
+class LatencyStats:
+    def __init__(self, name:str) -> None:
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0
+        self.min = math.inf
+        self.max = 0
+        self.last = 0
+
+    def add(self, seconds:float):
+        self.count+= 1
+        self.total+= seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+    def getMean(self):
+        return self.total / self.count if self.count > 0 else 0
+
+    def __str__(self) -> str:
+        if self.count == 0:
+            return f"{self.name}: n/a"
+
+        return f"{self.name}: mean {self.getMean()*1000:.2f}ms | min {self.min*1000:.2f}ms | max {self.max*1000:.2f}ms | n {self.count}"
+
+class ProfiledStage:
+    def __init__(self, stats:LatencyStats) -> None:
+        self.stats = stats
+
+    def __enter__(self):
+        self.startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, *exceptionInfo):
+        self.stats.add(time.perf_counter() - self.startTime)
+
+# Note: Times named stages of the detection hot path. When disabled `stage` returns a shared
+#       no-op context so instrumented code costs next to nothing
+class StageProfiler:
+
+    disabledStage = contextlib.nullcontext()
+
+    def __init__(self, enabled:bool = False) -> None:
+        self.enabled = enabled
+        self.stats:dict[str, LatencyStats] = {}
+
+    def stage(self, name:str):
+        if not self.enabled:
+            return self.disabledStage
+
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = LatencyStats(name)
+
+        return ProfiledStage(stats)
+
+    def reset(self):
+        self.stats.clear()
+
+    def getInfo(self):
+        infoStr = "Stage Timings: {\n"
+        for stats in self.stats.values():
+            infoStr+= f"\t{stats}\n"
+
+        return infoStr+"}\n"
+
+# Note: Bounded queue that drops its oldest entry instead of blocking the producer
+#       so consumers always work on the newest frame
+class LatestQueue:
+    def __init__(self, maxSize:int = 1) -> None:
+        assert maxSize > 0, f"maxSize: {maxSize} must be positive"
+
+        self.maxSize = maxSize
+        self.items = collections.deque()
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) >= self.maxSize:
+                self.items.popleft()
+                self.dropped+= 1
+
+            self.items.append(item)
+            self.condition.notify()
+
+    # Returns the oldest queued item or None if the queue timed out or was closed
+    def get(self, timeout:float = None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.items or self.closed, timeout)
+            return self.items.popleft() if self.items else None
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+class FilePublisher:
+
+    lineFormat = "frameId: %s " + fingerFormat + "\n"
+
+    def __init__(self, outputFilePath:str) -> None:
+
+        # setup tmp output files
+        self.outputFilePath = os.path.abspath(outputFilePath)        
+        self.tmpOutputFilePath = self.outputFilePath+".tmp"
+
+        # Note: os.replace failures we retried (e.g. the reader had the file open on Windows)
+        self.retries = 0
+
+    def publish(self, frame:Frame):
+
+        # write output to tmpFile
+        # Note: formats every line in one pass and writes them with a single call
+        frameId = frame.frameId
+        lineFormat = self.lineFormat
+        output = "".join([
+            lineFormat % (frameId, finger.x, finger.y, finger.d1, finger.d2, finger.id, finger.vx, finger.vy, finger.predictedX, finger.predictedY, finger.ax, finger.ay)
+            for finger in frame.fingers
+        ])
+
+        with open(self.tmpOutputFilePath, "w") as tmpFile:
+            tmpFile.write(output)
+
+            tmpFile.flush()
+            os.fsync(tmpFile.fileno())
+
+        # Atomic move tmp file to output file
+        # Note: we sleep instead of cv.waitKey between attempts because publishing may run off the GUI thread
+        maxPublishAttempts = 10
+        publishAttemptDelay = .01
+        for i in range(0, maxPublishAttempts):
+            try:
+                os.replace(self.tmpOutputFilePath, self.outputFilePath)
+                break
+            except Exception as e:
+                self.retries+= 1
+                log(f"Failed to publish fingers on attempt {i+1}/{maxPublishAttempts}", LogLevel.Warn)
+                time.sleep(publishAttemptDelay)
+
+    def close(self):
+        pass
+
+class NullPublisher:
+
+    def publish(self, frame:Frame):
+        pass
+
+    def close(self):
+        pass
+
+publisherTransports = ["file", "ring", "udp", "tcp"]
+
+# Note: `outputFilePath` is used by the file and ring transports, `address` ("host:port") by udp and tcp
+def createPublisher(transport:str, outputFilePath:str = "touchpad.out", address:str = None):
+
+    if transport == "ring":
+        return RingBufferWriter(outputFilePath)
+
+    if transport == "udp":
+        return UdpPublisher(parseAddress(address))
+
+    if transport == "tcp":
+        return TcpPublisher(parseAddress(address))
+
+    return FilePublisher(outputFilePath)
+
+# Note: 'hsv' thresholds hue, saturation and value of the color image.
+#       'value' and 'luma' reduce frames to a single intensity channel right after clipping and only apply the value
+#       sliders, so background subtraction, thresholding and morphology touch a third of the data. 'value' is the
+#       brightest channel (identical to HSV value) and 'luma' is the cheaper weighted gray conversion.
+#       Single channel frames (e.g. mono IR cameras) always take the intensity path.
+colorModes = ["hsv", "value", "luma"]
+
+# Note: 'contours' rings the mask with a gradient and fits ellipses to the leaf holes of the full contour hierarchy.
+#       'components' labels the eroded mask (the same holes) with connectedComponentsWithStats and takes each blob's
+#       area, centroid and second moment ellipse from its moments. Both take about the same time (about 2.1ms at 1280x720
+#       with 5 fingers, see benchmark.py -b) and find the same fingers, 'contours' stays the default.
+#       Indexed by the detector slider (see Touchpad.Detector)
+detectorBackends = ["contours", "components"]
+
 class Touchpad:
     
     class RenderLevel:
@@ -161,12 +461,19 @@ class Touchpad:
         Internal = 2
         Debug    = 1
         Minimal  = 0        
+
+    # Note: see detectorBackends
+    class Detector:
+        Contours   = 0
+        Components = 1
+
     class Sliders:
-        def __init__(self, touchpad) -> None:
+        def __init__(self, touchpad, config:dict = None) -> None:
 
             # Note: The original width of the window sets the width of the trackbars
             self.sliderWidth = 400 
-            cv.resizeWindow(touchpad.propertiesWindowName, self.sliderWidth, 0)
+            if not touchpad.headless:
+                cv.resizeWindow(touchpad.propertiesWindowName, self.sliderWidth, 0)
 
             self.hue = MinMaxSlider("hue", touchpad.propertiesWindowName, 
                 defaultMinValue = clamp(touchpad.targetHSVColor[0] - touchpad.targetHSVTolerance[0], 0, 255), 
@@ -230,6 +537,33 @@ class Touchpad:
                 )
             )
 
+            # Note: background learning rate is in thousandths per frame, 0 disables background subtraction
+            self.backgroundRate = Slider("bg rate\n", touchpad.propertiesWindowName,
+                minValue = 0,
+                maxValue = 100,
+                defaultValue = 5
+            )
+
+            # Note: max gray level change before a frame counts as active, 0 processes every frame
+            self.motionThreshold = Slider("motion thr.\n", touchpad.propertiesWindowName,
+                minValue = 0,
+                maxValue = 255,
+                defaultValue = 16
+            )
+
+            self.detector = Slider("detector\n", touchpad.propertiesWindowName,
+                minValue = touchpad.Detector.Contours,
+                maxValue = touchpad.Detector.Components,
+                defaultValue = touchpad.Detector.Contours
+            )
+
+            # Note: 1 moves each finger center to the intensity weighted centroid under its ellipse (see refineCenters)
+            self.subpixel = Slider("subpixel\n", touchpad.propertiesWindowName,
+                minValue = 0,
+                maxValue = 1,
+                defaultValue = 1
+            )
+
             self.renderLevel = Slider("Render\n", touchpad.propertiesWindowName,
                 minValue = touchpad.RenderLevel.Minimal,                          
                 maxValue = touchpad.RenderLevel.All,                          
@@ -237,39 +571,113 @@ class Touchpad:
             )
 
             # Note: resize the properties window to fit two sliders side-by side (plus 25% padding)
-            cv.resizeWindow(touchpad.propertiesWindowName, int(self.sliderWidth*2.25), 0)
+            if not touchpad.headless:
+                cv.resizeWindow(touchpad.propertiesWindowName, int(self.sliderWidth*2.25), 0)
+
+            # Note: changes from other threads wait here for the detect thread, see queueConfig
+            self.pendingConfig = {}
+            self.pendingLock = threading.Lock()
+
+            if config is not None:
+                self.setConfig(config)
+
+        def getSliders(self) -> dict:
+            return {name: value for name, value in vars(self).items() if isinstance(value, (Slider, MinMaxSlider))}
+
+        # Note: config maps slider attribute names to a value (or a [min, max] pair for MinMaxSliders)
+        def getConfig(self) -> dict:
+            return {name: slider.getValue() for name, slider in self.getSliders().items()}
+
+        def setConfig(self, config:dict):
+            sliders = self.getSliders()
+
+            for name, value in config.items():
+                slider = sliders.get(name)
+                if slider is None:
+                    log(f"Ignoring unknown slider in config: '{name}'", LogLevel.Warn)
+                    continue
+
+                slider.setValue(value)
+
+        # Queues `config` to be applied as one change before the next frame is detected (see applyPendingConfig)
+        # Note: setting sliders directly from another thread could let a frame see half of a change, e.g. a new min with the old max
+        def queueConfig(self, config:dict):
+            with self.pendingLock:
+                self.pendingConfig.update(config)
+
+        def applyPendingConfig(self):
+            with self.pendingLock:
+                config, self.pendingConfig = self.pendingConfig, {}
+
+            if config:
+                self.setConfig(config)
+
+        def syncTrackbars(self):
+            for slider in self.getSliders().values():
+                slider.syncTrackbar()
+
+    # Note: `source` is a camera port or any frame source from framesource.py
+    #       When `headless` no windows are created and slider values come from `config` (see Sliders.setConfig)
+    #       `clip` and `downscale` configure the detection region (see setDetectionRegion)
+    #       With a `calibration` fingers are published in calibrated table coordinates instead of clip coordinates
+    #       `renderRate` caps debug window repaints per second so viewing doesn't slow down tracking (0 repaints every frame)
+    #       `metrics` is an enabled MetricsRegistry to export stage timings, latency histograms and counters to (see setMetrics)
+    #       `colorMode` picks what is thresholded (see colorModes)
+    #       `frameBudget` is the per frame work in seconds a FrameBudgetScheduler degrades quality to stay under (0 never degrades)
+    def __init__(self, source, windowName:str=None, outputFilePath="touchpad.out", publisher=None, headless:bool = False, config:dict = None,
+                 clip = None, downscale:int = 0, tracker:FingerTracker = None, calibration:Calibration = None,
+                 renderRate:float = 0, metrics:MetricsRegistry = None, colorMode:str = "hsv", frameBudget:float = 0) -> None:
+
+        assert colorMode in colorModes, f"Unknown colorMode: '{colorMode}' (expected one of {colorModes})"
+        self.colorMode = colorMode
+
+        # Note: publisher can be any object with `publish(frame)` and `close()`, defaults to the touchpad.out text file
+        self.publisher = publisher if publisher is not None else FilePublisher(outputFilePath)
+
+        # Configure frame source
+        self.source = CameraSource(source) if isinstance(source, int) else source
+        self.cameraWidth  = self.source.width
+        self.cameraHeight = self.source.height
 
-                
-    def __init__(self, cameraPort:int, windowName:str=None, outputFilePath="touchpad.out") -> None:
+        print(self.getCameraInfo())
 
-        # setup tmp output files
-        self.outputFilePath = os.path.abspath(outputFilePath)        
-        self.tmpOutputFilePath = self.outputFilePath+".tmp"
+        # Note: calibrations are fitted in camera pixels so they only hold for the frame size (i.e. capture mode) they were made at
+        assert calibration is None or calibration.imageSize == (self.cameraWidth, self.cameraHeight), \
+            f"Calibration is for {calibration.imageSize[0]}x{calibration.imageSize[1]} frames but the source delivers {self.cameraWidth}x{self.cameraHeight} " \
+            "(recalibrate or use the capture profile it was made with)"
 
-        # Configure Camera
-        self.camera_port = cameraPort
-        self.camera = cv.VideoCapture(cameraPort)
+        self.frameId = 0
+        self.lastFrame:Frame = None
+        self.calibration = calibration
+        self.renderImages:list[NamedImage] = []
+        self.fingers:list[Finger] = []
 
-        self.cameraHeight = 720
-        self.cameraWidth  = 1280
-        self.camera.set(cv.CAP_PROP_FRAME_HEIGHT, self.cameraHeight)
-        self.camera.set(cv.CAP_PROP_FRAME_WIDTH, self.cameraWidth)
+        # Note: objects with `getTapLevel()` that want debug images in addition to the window (see tap)
+        self.tapSubscribers = []
+        self.tapLevel:int = None
 
-        self.cameraFPS = 30
-        self.camera.set(cv.CAP_PROP_FPS, self.cameraFPS)
+        # Note: see startRecording
+        self.recorder:SessionRecorder = None
 
-        self.setCameraProp(cv.CAP_PROP_AUTO_EXPOSURE, -1)
-        # self.camera.set(cv.CAP_PROP_AUTO_WB, 0)
+        self.latencyStats = {name: LatencyStats(name) for name in ["captureToDetect", "detect", "publish", "captureToPublish", "frameInterval", "driverToCapture"]}
+        self.lastFrameTimes = (None, None)
+        self.profiler = StageProfiler()
 
-        print(self.getCameraInfo())
+        self.lastPublishTime:float = None
+        self.setMetrics(metrics if metrics is not None else MetricsRegistry())
 
-        self.frameId = 0
-        self.renderImages:list[NamedImage] = []
-        self.fingers:list[Finger] = []
+        self.backgroundModel = BackgroundModel()
+        self.activityGate = ActivityGate()
+        self.lastDetections:list[tuple] = []
+
+        # Note: pass a configured FingerTracker to tune association and prediction
+        self.tracker = tracker if tracker is not None else FingerTracker()
 
         # Configure filters
         # TODO: Make these sliders?
-        self.ellipseIterations = 2
+        # Note: the gradient ran a single iteration when the area and diameter slider defaults were tuned (the iteration count
+        #       used to land in morphologyEx's `dst` argument) and every extra one shrinks the holes it leaves by a kernel radius
+        self.ellipseIterations = 1
         self.ellipseKernelSize = (5, 5)
         self.ellipseKernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, self.ellipseKernelSize)
 
@@ -277,127 +685,221 @@ class Touchpad:
         self.denoiseKernelSize = (5, 5)
         self.denoiseKernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, self.denoiseKernelSize)
 
+        self.setDetectionRegion(clip, downscale)
+
+        # Note: configured quality the scheduler degrades from (see setQualityLevel), 0 maxContours considers every contour
+        self.baseDownscale = downscale
+        self.renderRate = renderRate
+        self.denoiseReduction = 0
+        self.maxContours = 0
+
+        self.qualityLevel = 0
+        self.pendingQualityLevel:int = None
+        self.pendingRenderRate:float = None
+        self.scheduler = FrameBudgetScheduler(frameBudget) if frameBudget > 0 else None
+
+        # Note: repaint time the scheduler hasn't counted in a frame's work yet (see draw)
+        self.uncountedDrawTime = 0
+
         # create windows
-        self.windowName = windowName if windowName is not None else f"Touchpad: {cameraPort}"
-        self.propertiesWindowName = self.windowName + " - Properties"
-        cv.namedWindow(self.windowName, cv.WINDOW_NORMAL|cv.WINDOW_KEEPRATIO)
-        cv.namedWindow(self.propertiesWindowName, cv.WINDOW_NORMAL|cv.WINDOW_KEEPRATIO)
+        self.headless = headless
+        self.windowName = windowName if windowName is not None else f"Touchpad: {source}"
+        self.propertiesWindowName = None if headless else self.windowName + " - Properties"
+        if not headless:
+            cv.namedWindow(self.windowName, cv.WINDOW_NORMAL|cv.WINDOW_KEEPRATIO)
+            cv.namedWindow(self.propertiesWindowName, cv.WINDOW_NORMAL|cv.WINDOW_KEEPRATIO)
+
+        self.renderer = None if headless else GridRenderer(self.windowName, renderRate)
         
         targetRGB = np.uint8([[[210, 203, 227 ]]])
-        self.targetHSVColor = cv.cvtColor( np.uint8(targetRGB),cv.COLOR_RGB2HSV).reshape(3)
+        # Note: cast to int so the tolerance math below doesn't wrap around in uint8
+        self.targetHSVColor = cv.cvtColor( np.uint8(targetRGB),cv.COLOR_RGB2HSV).reshape(3).astype(int)
         self.targetHSVTolerance = [100, 100, 150]
 
         # create sliders
-        self.sliders = self.Sliders(self)
+        self.sliders = self.Sliders(self, config)
+
+    # Registers the touchpad's metrics with `registry`
+    # Note: an enabled registry also enables the stage profiler since stage timings are exported from it
+    def setMetrics(self, registry:MetricsRegistry):
+        self.metrics = registry
+        if registry.enabled:
+            self.profiler.enabled = True
+
+        self.framesMetric = registry.counter("frames_total", "Frames captured")
+        registry.callbackGauge("quality_level", "Quality level detection currently runs at (see scheduler.qualityLevels)", lambda: self.qualityLevel)
+        self.idleFramesMetric = registry.counter("idle_frames_total", "Frames the activity gate skipped detection for")
+        self.captureToPublishMetric = registry.histogram("capture_to_publish_seconds", "Time from capture until the frame's fingers were published")
+        self.publishIntervalMetric = registry.histogram("publish_interval_seconds", "Time between consecutive publishes")
+        self.frameIntervalMetric = registry.histogram("frame_interval_seconds", "Time between consecutive captured frames",
+                                                      [.004, .006, .0085, .0125, .017, .025, .034, .05, .1, .25])
+
+        self.rejectedContourMetrics = {
+            reason: registry.counter("rejected_contours_total", "Leaf contours rejected by the finger filter", {"reason": reason})
+            for reason in ["points", "area", "extent", "diameter", "aspect", "ellipseError"]
+        }
+
+        registry.callbackCounter("publish_retries_total", "Publish attempts that had to be retried", lambda: getattr(self.publisher, "retries", 0))
+        registry.callbackCounter("dropped_frames_total", "Frames dropped before they were processed",
+                                 lambda: getattr(self.source, "dropped", 0), {"queue": "capture"})
+        registry.callbackCounter("dropped_frames_total", "Frames dropped before they were processed", 
+                                 lambda: 0 if self.recorder is None else self.recorder.dropped, {"queue": "recorder"})
+        registry.callbackCounter("dropped_frames_total", "Frames dropped before they were processed",
+                                 lambda: getattr(self.publisher, "dropped", 0), {"queue": "publisher"})
+        registry.statsSummary("stage_seconds", "Time spent in each pipeline stage", lambda: self.profiler.stats.values(), "stage")
 
     def setCameraProp(self, property:int, value:int):
+        self.source.setProperty(property, value)
 
-        # Note: Hack to get camera properties to apply
-        #       self.camera.get doesn't report properties correctly
-        #       from experimentation camera properties only apply themselves
-        #       if there is a change from the value they are currently set to
-        self.camera.set(property, value-1)
-        self.camera.read()
-        cv.waitKey(100)
-        
-        self.camera.set(property, value)
-        self.camera.read()
-        cv.waitKey(100)
+    # Note: `clip` is either a rectangle (x, y, width, height) or a polygon [(x, y), ...] in camera pixels
+    #       that bounds the touch surface. Only the clipped region is processed and finger coordinates
+    #       are normalized to its bounding rectangle. `downscale` is the number of pyrDown levels applied
+    #       to the clipped region before detection.
+    #       The default clip is the middle half of the frame which is where the table sits in our rig
+    def setDetectionRegion(self, clip = None, downscale:int = 0):
+
+        assert downscale >= 0, f"downscale: {downscale} can't be negative"
+
+        if clip is None:
+            clip = (0, self.cameraHeight//4, self.cameraWidth, self.cameraHeight//2)
+
+        self.clip = clip
+
+        clipPolygon = None
+        if len(clip) == 4 and np.isscalar(clip[0]):
+            x, y, width, height = (int(value) for value in clip)
+        else:
+            clipPolygon = np.int32(clip).reshape(-1, 2)
+            assert len(clipPolygon) >= 3, f"Clip polygon needs at least 3 points, got: {len(clipPolygon)}"
+            x, y, width, height = cv.boundingRect(clipPolygon)
+
+        # Clamp clip rect to the frame
+        x = clamp(x, 0, self.cameraWidth - 1)
+        y = clamp(y, 0, self.cameraHeight - 1)
+        width = clamp(width, 1, self.cameraWidth - x)
+        height = clamp(height, 1, self.cameraHeight - y)
+
+        self.clipRect = (x, y, width, height)
+        self.clipOffset = np.int32((x, y))
+        self.downscale = downscale
+        self.downscaleFactor = 2**downscale
+
+        # Note: pyrDown rounds odd dimensions up
+        scaledWidth, scaledHeight = width, height
+        for _ in range(downscale):
+            scaledWidth, scaledHeight = (scaledWidth + 1)//2, (scaledHeight + 1)//2
+
+        self.detectionSize = (scaledWidth, scaledHeight)
+
+        # Precompute polygon mask at the resolution we detect at
+        self.clipMask = None
+        if clipPolygon is not None:
+            clipMask = np.zeros((height, width), dtype=np.uint8)
+            cv.fillPoly(clipMask, [clipPolygon - (x, y)], 255)
+            self.clipMask = cv.resize(clipMask, (scaledWidth, scaledHeight), interpolation=cv.INTER_NEAREST)
+
+    # Returns the clipped and downscaled region of `pixels` that detection runs on
+    def getDetectionImage(self, pixels:cv.Mat):
+        x, y, width, height = self.clipRect
+
+        detectionPixels = pixels[y:y+height, x:x+width]
+        for _ in range(self.downscale):
+            detectionPixels = cv.pyrDown(detectionPixels)
+
+        return detectionPixels
+
+    # Maps an (n, 2) array of camera pixel points to the published coordinate space
+    def getTablePoints(self, cameraPoints:np.ndarray):
+
+        if self.calibration is not None:
+            return self.calibration.apply(cameraPoints)
+
+        # Normalize to the clip rect
+        clipX, clipY, clipWidth, clipHeight = self.clipRect
+        return (cameraPoints - (clipX, clipY)) / (clipWidth, clipHeight) * 2 - 1
+
+    # Note: morphology kernels are fixed size so we scale iterations to keep their reach in full frame pixels roughly constant
+    def getScaledIterations(self, iterations:int):
+        return max(1, round(iterations/self.downscaleFactor))
+
+    # Note: the quality level's reduction applies after scaling so it removes an iteration whenever there is more than one to run
+    def getDenoiseIterations(self):
+        return max(1, self.getScaledIterations(self.denoiseIterations) - self.denoiseReduction)
+
+    # Maps contour points from detection image coordinates back to full frame pixels
+    def getFrameContour(self, contour):
+        return contour*self.downscaleFactor + self.clipOffset if self.downscale > 0 else contour + self.clipOffset
 
     def __bool__(self):
+        if not self.source.isOpen():
+            return False
+
+        if self.headless:
+            return True
+
         return cv.getWindowProperty(self.windowName, cv.WND_PROP_VISIBLE) == 1 and \
                cv.getWindowProperty(self.propertiesWindowName, cv.WND_PROP_VISIBLE) == 1
 
     def getCameraInfo(self):
-        props = [
-            "CAP_PROP_APERTURE",
-            "CAP_PROP_AUTOFOCUS",
-            "CAP_PROP_AUTO_EXPOSURE",
-            "CAP_PROP_AUTO_WB",
-            "CAP_PROP_BACKLIGHT",
-            "CAP_PROP_BITRATE",
-            "CAP_PROP_BRIGHTNESS",
-            "CAP_PROP_CODEC_PIXEL_FORMAT",
-            "CAP_PROP_CONTRAST",
-            "CAP_PROP_CONVERT_RGB",
-            "CAP_PROP_EXPOSURE",
-            "CAP_PROP_FPS",
-            "CAP_PROP_FRAME_HEIGHT",
-            "CAP_PROP_FRAME_WIDTH",
-            "CAP_PROP_GAIN",
-            "CAP_PROP_GAMMA",
-            "CAP_PROP_ISO_SPEED",
-            "CAP_PROP_MODE",
-            "CAP_PROP_MONOCHROME",
-            "CAP_PROP_SATURATION",
-            "CAP_PROP_SETTINGS",
-            "CAP_PROP_SHARPNESS",
-            "CAP_PROP_SPEED",
-            "CAP_PROP_WB_TEMPERATURE",
-            "CAP_PROP_ZOOM",
-        ]
+        return self.source.getInfo()
+
+    def close(self):
+        self.stopRecording()
+        self.source.close()
+        self.publisher.close()
+
+    # Returns what a replay needs to reproduce this touchpad's detection (see recorder.py)
+    def getSessionHeader(self):
+        return {
+            "width": self.cameraWidth,
+            "height": self.cameraHeight,
+            "clip": np.asarray(self.clip).tolist(),
+            "downscale": self.baseDownscale,
+            "colorMode": self.colorMode,
+            "predictionHorizon": self.tracker.predictionHorizon,
+            "outputFilter": self.tracker.outputFilter,
+            "filterParams": self.tracker.filterParams,
+            "calibration": None if self.calibration is None else self.calibration.toDict(),
+        }
+
+    # Records every detected frame's raw pixels, slider values and fingers to the session directory `path`
+    def startRecording(self, path:str, codec:str = "raw"):
+        self.stopRecording()
+        self.recorder = SessionRecorder(path, self.getSessionHeader(), codec)
+
+    def stopRecording(self):
+        if self.recorder is None:
+            return
 
-        infoStr = "Camera Info: {\n"
-        for prop in props:
-            infoStr+= f"\t{prop}: {self.camera.get(getattr(cv, prop))}\n"
+        recorder = self.recorder
+        self.recorder = None
+        recorder.close()
 
-        return infoStr+"}\n"
+        log(f"Recorded {recorder.recorded} frames to '{recorder.path}' ({recorder.dropped} dropped)", LogLevel.Warn)
 
-    def draw(self):
-        
-        # Create a blank window image buffer
-        _, _, windowWidth, windowHeight = windowRect = cv.getWindowImageRect(self.windowName)
-        windowImage = np.zeros((windowHeight, windowWidth, 3), dtype=np.uint8)
+    # Note: `inFrameTime` repaints hold up the next frame so the scheduler counts them. Repaints running on another thread
+    #       than detection (e.g. pipelined) don't so they're left out
+    def draw(self, frame:Frame = None, inFrameTime:bool = True):
 
-        # Compute layout of image grid 
-        numImages = len(self.renderImages)
-        numXImages = max(1, int(math.ceil(np.sqrt(numImages))))
-        numYImages = max(1, int(math.ceil(numImages/numXImages)))
+        if self.headless:
+            return
 
-        maxImageWidth  = int(windowWidth/numXImages)
-        maxImageHeight = int(windowHeight/numYImages)
+        self.sliders.syncTrackbars()
+        self.applyPendingRenderRate()
 
-        maxImageAspect = maxImageWidth/maxImageHeight
+        frame = self.lastFrame if frame is None else frame
+        if frame is None or frame.tapLevel is None:
+            # Note: nothing was tapped for this frame but we still need to pump window events
+            cv.pollKey()
+            return
 
-        # Blit images to window image buffer
-        for i in range(0, numImages):
-                
-            row = i//numXImages
-            col = i - row*numXImages
+        drawStartTime = time.monotonic()
+        with self.profiler.stage("draw"):
+            self.renderer.show(frame.renderImages)
 
-            y = row*maxImageHeight
-            x = col*maxImageWidth
+        if inFrameTime:
+            self.uncountedDrawTime+= time.monotonic() - drawStartTime
 
-            image = self.renderImages[i].getImage()
-            imageAspect = image.shape[1] / image.shape[0]
-    
-            if imageAspect >= maxImageAspect:
-    
-                # Fit to width of image
-                imageWidth = maxImageWidth
-                imageHeight = int(imageWidth/imageAspect + .5)
-                y+= (maxImageHeight - imageHeight)//2
-
-            else:
-                # Fit to height of image
-                imageHeight = maxImageHeight
-                imageWidth = int(imageAspect*imageHeight + .5)
-                x+= (maxImageWidth - imageWidth)//2
-
-            resizedImage = cv.resize(image, (imageWidth, imageHeight), interpolation=cv.INTER_LANCZOS4)
-
-            # Note: We add empty color dimension to the resized image if its monochromatic so numpy
-            #       can broadcast it to 3 color channel destination   
-            if(len(resizedImage.shape) == 2):
-                resizedImage = resizedImage[..., np.newaxis]
-
-            windowImage[y:y+imageHeight, x:x+imageWidth] = resizedImage 
-
-        # Display window image buffer
-        # Note: We need to pause via waitKey to allow opencv to display frame
-        cv.imshow(self.windowName, windowImage)
-        cv.waitKey(1)
-        
 
     def getMinHSV(self):
         return (
@@ -414,159 +916,716 @@ class Touchpad:
             self.sliders.value.getMaxValue()
         ) 
 
-    # Note: appends render image if current render level is greater than or equal to `minRenderLevel`
-    def addRenderImage(self, image:NamedImage, minRenderLevel:int):
+    def subscribeTaps(self, subscriber):
+        self.tapSubscribers.append(subscriber)
 
-        if self.sliders.renderLevel.getValue() >= minRenderLevel:
-            self.renderImages.append(image)
+    def unsubscribeTaps(self, subscriber):
+        self.tapSubscribers.remove(subscriber)
 
-    def update(self):
-        
-        # clear out last frame
-        self.fingers.clear()
-        self.renderImages.clear()
+    # Returns the highest RenderLevel anyone wants for the next frame or None if nobody is watching
+    # Note: the window only counts when its next repaint is due so capped repaint rates skip tapping entirely
+    def getTapLevel(self):
+        tapLevel = None
+
+        if not self.headless and self.renderer.isDue():
+            tapLevel = self.sliders.renderLevel.getValue()
+
+        for subscriber in self.tapSubscribers:
+            subscriberLevel = subscriber.getTapLevel()
+            if subscriberLevel is not None and (tapLevel is None or subscriberLevel > tapLevel):
+                tapLevel = subscriberLevel
+
+        return tapLevel
+
+    # Note: returns True if images at `minRenderLevel` are tapped for the frame being detected
+    def isRendering(self, minRenderLevel:int):
+        return self.tapLevel is not None and self.tapLevel >= minRenderLevel
+
+    # Registers a debug image for the frame being detected if anyone is watching at `minRenderLevel`
+    # Note: `pixels` can be a callable so images that need extra work (e.g. the overlay) are only built when displayed.
+    #       Stage outputs are never written to after they're tapped so they're shared rather than copied
+    def tap(self, name:str, pixels, minRenderLevel:int):
+
+        if self.isRendering(minRenderLevel):
+            self.renderImages.append(NamedImage(name, pixels))
+
+    def captureFrame(self):
+
+        with self.profiler.stage("capture"):
+            success, rawPixels = self.source.read()
+
+        # Note: sources that know when the frame arrived (e.g. before it was decoded or while we were busy) report it,
+        #       otherwise read blocks until the camera delivers a frame so now is our best estimate
+        captureTime, driverTime = self.source.getFrameTime()
+        if captureTime is None:
+            captureTime = time.monotonic()
+
+        if not success:
+            log(f"Failed to read frame from {self.windowName}", LogLevel.Warn)
+            return None
 
         self.frameId+= 1 
-        _, rawPixels = self.camera.read()
-        
-        rawImage = NamedImage("Raw", rawPixels)
-        self.addRenderImage(rawImage, self.RenderLevel.Minimal)
-        
+        self.framesMetric.inc()
+
+        frame = Frame(self.frameId, rawPixels, captureTime, driverTime)
+        self.recordFrameTimes(frame)
+        return frame
+
+    # Note: frame intervals of live sources come from driver timestamps when there are some since they don't include our scheduling jitter.
+    #       Files and recordings only have presentation timestamps, which give their nominal rate rather than the one we achieved,
+    #       so they're timed on the capture clock. Driver delay is only known when the driver stamps frames with the monotonic
+    #       clock (V4L2 does) so other clocks are skipped
+    def recordFrameTimes(self, frame:Frame):
+        lastCaptureTime, lastDriverTime = self.lastFrameTimes
+        isLive = getattr(self.source, "live", False)
+
+        if lastCaptureTime is not None:
+            useDriverTime = isLive and frame.driverTime is not None and lastDriverTime is not None
+            interval = frame.driverTime - lastDriverTime if useDriverTime else frame.captureTime - lastCaptureTime
+
+            if interval > 0:
+                self.latencyStats["frameInterval"].add(interval)
+                self.frameIntervalMetric.observe(interval)
+
+        if isLive and frame.driverTime is not None and 0 <= frame.captureTime - frame.driverTime < 1:
+            self.latencyStats["driverToCapture"].add(frame.captureTime - frame.driverTime)
+
+        self.lastFrameTimes = (frame.captureTime, frame.driverTime)
+
+    def getAchievedFps(self):
+        meanInterval = self.latencyStats["frameInterval"].getMean()
+        return 1/meanInterval if meanInterval > 0 else 0
+
+    def detectFingers(self, frame:Frame):
+        frame.markStage("detectStart")
+
+        # Note: slider and quality changes from other threads are applied here so a detection never sees them half done.
+        #       The detection region also can't change under a running detection
+        self.sliders.applyPendingConfig()
+
+        if self.pendingQualityLevel is not None:
+            self.setQualityLevel(self.pendingQualityLevel)
+            self.pendingQualityLevel = None
+
+        frame.qualityLevel = self.qualityLevel
+        frame.clipOffset = self.clipOffset
+        frame.downscaleFactor = self.downscaleFactor
+
+        # Note: fitEllipse and tap work on the touchpad's current lists
+        #       so we point them at the frame being processed
+        self.fingers = frame.fingers
+        self.renderImages = frame.renderImages
+        self.tapLevel = frame.tapLevel = self.getTapLevel()
+
+        # Note: the overlay reads the frame's contours and fingers when it's drawn so it can be tapped up front
+        self.tap("Raw", lambda: self.drawOverlay(frame), self.RenderLevel.Minimal)
+
         # TODO: Rename this to something better
-        self.fitEllipse(rawImage)
+        frame.contours = self.fitEllipse(frame.rawImage)
+
+        with self.profiler.stage("track"):
+            self.tracker.update(frame.fingers, frame.captureTime)
+
+        frame.markStage("detected")
+
+        # Note: every detected frame is recorded, even ones the pipeline later drops before publishing, so replay
+        #       sees exactly what the detector saw. Recording happens after the detected stage so it isn't counted as detection time
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.record(frame, self.sliders.getConfig())
+
+    def update(self):
         
-        self.publishFingers()
+        frame = self.captureFrame()
+        if frame is None:
+            return
 
-    def publishFingers(self):
+        self.detectFingers(frame)
+        self.publishFingers(frame)
+        self.recordLatency(frame)
 
-        # write output to tmpFile
-        frameStr = f"frameId: {self.frameId} "
-        with open(self.tmpOutputFilePath, "w") as tmpFile:
-            for finger in self.fingers:
-                tmpFile.write(frameStr + str(finger)+"\n")
+        self.lastFrame = frame
 
-            tmpFile.flush()
-            os.fsync(tmpFile.fileno())
+    def recordLatency(self, frame:Frame):
+        self.latencyStats["captureToDetect"].add(frame.getStageDelta("captured", "detectStart"))
+        self.latencyStats["detect"].add(frame.getStageDelta("detectStart", "detected"))
+        self.latencyStats["publish"].add(frame.getStageDelta("publishStart", "published"))
+        self.latencyStats["captureToPublish"].add(frame.getStageDelta("captured", "published"))
+        self.captureToPublishMetric.observe(frame.getStageDelta("captured", "published"))
 
-        # Atomic move tmp file to output file
-        maxPublishAttempts = 10
-        publishAttemptDelay = 10
-        for i in range(0, maxPublishAttempts):
-            try:
-                os.replace(self.tmpOutputFilePath, self.outputFilePath)
-                break
-            except Exception as e:
-                log(f"Failed to publish fingers on attempt {i+1}/{maxPublishAttempts}", LogLevel.Warn)
-                cv.waitKey(publishAttemptDelay)
+        # Note: the frame's work excludes time spent waiting on the camera or in pipeline queues. Repaints are counted once,
+        #       by the frame after them, so frames skipped by a capped repaint rate don't pay for one
+        if self.scheduler is not None:
+            frameTime = frame.getStageDelta("detectStart", "detected") + frame.getStageDelta("publishStart", "published") + self.uncountedDrawTime
+            self.uncountedDrawTime = 0
+
+            level = self.scheduler.update(frameTime)
+            if level != self.qualityLevel:
+                self.pendingQualityLevel = level
+
+    def applyPendingRenderRate(self):
+        renderRate, self.pendingRenderRate = self.pendingRenderRate, None
+        if renderRate is not None:
+            self.renderer.setMaxRenderRate(renderRate)
+
+    # Applies the scheduler.qualityLevels entry `level` on top of the configured detection settings
+    # Note: the background is rescaled rather than relearned when the downscale changes so fingers on the table aren't adopted into it
+    def setQualityLevel(self, level:int):
+        quality = qualityLevels[level]
+
+        self.denoiseReduction = quality.denoiseReduction
+        self.maxContours = quality.maxContours
+
+        downscale = self.baseDownscale + quality.extraDownscale
+        if downscale != self.downscale:
+            self.setDetectionRegion(self.clip, downscale)
+            self.backgroundModel.rescale(*self.detectionSize)
+
+        # Note: the renderer belongs to the thread that draws, which picks the new rate up before its next repaint (see draw)
+        if self.renderer is not None:
+            capsRenderRate = quality.maxRenderRate > 0 and (self.renderRate <= 0 or quality.maxRenderRate < self.renderRate)
+            self.pendingRenderRate = quality.maxRenderRate if capsRenderRate else self.renderRate
+
+        if level != self.qualityLevel:
+            log(f"Quality level {self.qualityLevel} -> {level} ({quality.name})", LogLevel.Warn)
+
+        self.qualityLevel = level
+
+    def getLatencyInfo(self):
+        infoStr = "Latency Stats: {\n"
+        for stats in self.latencyStats.values():
+            infoStr+= f"\t{stats}\n"
+
+        infoStr+= f"\tachieved fps: {self.getAchievedFps():.1f}\n"
+        if self.scheduler is not None:
+            infoStr+= f"\t{self.scheduler}\n"
+
+        return infoStr+"}\n"
+
+    def publishFingers(self, frame:Frame):
+        frame.markStage("publishStart")
+
+        with self.profiler.stage("publish"):
+            self.publisher.publish(frame)
+
+        frame.markStage("published")
+
+        if self.lastPublishTime is not None:
+            self.publishIntervalMetric.observe(frame.stageTimes["published"] - self.lastPublishTime)
+        self.lastPublishTime = frame.stageTimes["published"]
+
+    # Returns a copy of the frame's raw pixels annotated with every contour (red) and finger (green)
+    def drawOverlay(self, frame:Frame):
+
+        overlayImage = NamedImage("Raw", frame.rawImage.pixels.copy())
+
+        cv.drawContours(overlayImage.pixels, [contour*frame.downscaleFactor + frame.clipOffset for contour in frame.contours], -1, color=Color.red)
+
+        for finger in frame.fingers:
+            if finger.cameraX is None:
+                continue
+
+            cv.ellipse(overlayImage.pixels, ((finger.cameraX, finger.cameraY), (finger.d1, finger.d2), finger.angle), Color.green, 2)
+            overlayImage.drawText(f"[{np.round(finger.cameraX, 2)}, {np.round(finger.cameraY, 2)}]", (finger.cameraX, finger.cameraY))
+
+        return overlayImage.pixels
         
         
     def getMask(self, image, colorLower, colorUpper):        
 
         # Note: OPEN is erosion followed by dilation (AKA standard denoise)
-        denoisedImage = cv.morphologyEx(image, cv.MORPH_OPEN, self.denoiseKernel, iterations=self.denoiseIterations)
-        self.addRenderImage(NamedImage("Denoised", denoisedImage), self.RenderLevel.Internal)
+        with self.profiler.stage("open"):
+            denoisedImage = cv.morphologyEx(image, cv.MORPH_OPEN, self.denoiseKernel, iterations=self.getDenoiseIterations())
+        self.tap("Denoised", denoisedImage, self.RenderLevel.Internal)
 
         # Note: closing is dilation followed by erosion
-        closedImage = cv.morphologyEx(denoisedImage, cv.MORPH_CLOSE, self.denoiseKernel, iterations=self.denoiseIterations)
-        self.addRenderImage(NamedImage("Closed", closedImage), self.RenderLevel.Internal)
+        with self.profiler.stage("close"):
+            closedImage = cv.morphologyEx(denoisedImage, cv.MORPH_CLOSE, self.denoiseKernel, iterations=self.getDenoiseIterations())
+        self.tap("Closed", closedImage, self.RenderLevel.Internal)
 
-        boundedImage = cv.inRange(closedImage, colorLower, colorUpper)
+        with self.profiler.stage("inRange"):
+            boundedImage = cv.inRange(closedImage, colorLower, colorUpper)
 
         return boundedImage
-        
-    # Returns the ellipse that fits the contour and satisfies the current constraints or None if no ellipse if found
-    def getConstrainedEllipse(self, contour):
 
-        # Note: opencv requires at least 5 vertices to fit ellipse
-        if len(contour) < 5:
-            return None
+    # Returns the single channel `colorMode` intensity of a BGR image
+    def getIntensityImage(self, pixels:cv.Mat):
+        if self.colorMode == "luma":
+            return cv.cvtColor(pixels, cv.COLOR_BGR2GRAY)
 
-        # Ignore obvious small or giant splotches
-        minArea = self.sliders.area.getMinValue()
-        maxArea = self.sliders.area.getMaxValue()
-        contourArea = cv.contourArea(contour)
-        if not inRange(contourArea, minArea, maxArea):
-            return None 
+        blue, green, red = cv.split(pixels)
+        return cv.max(cv.max(blue, green), red)
 
-        ellipse = cv.fitEllipse(contour)
-        (x, y), (d1, d2), angle = ellipse
+    # Thresholds a single channel intensity image with the value sliders and denoises the binary mask
+    # Note: erosion and dilation commute with thresholding against a lower bound so (with the value max at 255)
+    #       opening and closing the mask matches opening and closing the image first like getMask does
+    def getIntensityMask(self, image):
 
-        # TODO: Make sure that x, y is inbounds of clipping rect!
+        with self.profiler.stage("inRange"):
+            boundedImage = cv.inRange(image, self.sliders.value.getMinValue(), self.sliders.value.getMaxValue())
 
-        # Make sure the ellipse isn't to small/big
-        minDiameter = self.sliders.diameter.getMinValue()
-        maxDiameter = self.sliders.diameter.getMaxValue()        
-        if not (inRange(d1, minDiameter, maxDiameter) and 
-                inRange(d2, minDiameter, maxDiameter)):
-            return None 
+        with self.profiler.stage("open"):
+            denoisedImage = cv.morphologyEx(boundedImage, cv.MORPH_OPEN, self.denoiseKernel, iterations=self.getDenoiseIterations())
+        self.tap("Denoised", denoisedImage, self.RenderLevel.Internal)
 
-        # Make sure the ellipse isn't to stretched 
-        aspectRatio = np.abs(d1/d2)
+        with self.profiler.stage("close"):
+            closedImage = cv.morphologyEx(denoisedImage, cv.MORPH_CLOSE, self.denoiseKernel, iterations=self.getDenoiseIterations())
+        self.tap("Closed", closedImage, self.RenderLevel.Internal)
+
+        return closedImage
+
+    # Returns the ellipses (in full frame pixels) that fit leaf contours and satisfy the current constraints
+    # Note: The cheap checks on contour area and point extents run vectorized over every candidate
+    #       so cv.fitEllipse only runs on contours that can still pass
+    def getConstrainedEllipses(self, contours, hierarchy):
+
+        # Note: opencv requires at least 5 vertices to fit ellipse and
+        #       we only care about the inner hole of a ring (contours without children)
+        pointCounts = np.fromiter((len(contour) for contour in contours), dtype=np.int64, count=len(contours))
+        isLeaf = hierarchy[:, 2] == -1
+        candidates = np.nonzero(isLeaf & (pointCounts >= 5))[0]
+
+        if self.metrics.enabled:
+            self.rejectedContourMetrics["points"].inc(int(np.count_nonzero(isLeaf)) - len(candidates))
+
+        if len(candidates) == 0:
+            return []
+
+        # Note: when the contour count is capped (see setQualityLevel) the contours with the most points are kept
+        #       since finger rings are long and noise specks are short
+        if 0 < self.maxContours < len(candidates):
+            candidates = np.sort(candidates[np.argpartition(-pointCounts[candidates], self.maxContours)[:self.maxContours]])
+
+        minArea, maxArea = self.sliders.area.getValue()
+        minDiameter, maxDiameter = self.sliders.diameter.getValue()
         maxRadiusAspect = self.sliders.maxRadiusAspect.getValue()
-        if not inRange(aspectRatio, 1/maxRadiusAspect, maxRadiusAspect):
-            return None
+
+        # Pack candidate points into a single array indexed by contour start offsets
+        # Note: constraints are in full frame pixels so we map the points back before checking them
+        counts = pointCounts[candidates]
+        starts = np.zeros_like(counts)
+        np.cumsum(counts[:-1], out=starts[1:])
+
+        points = self.getFrameContour(np.concatenate([contours[i] for i in candidates]).reshape(-1, 2))
+        x = points[:, 0].astype(np.float64)
+        y = points[:, 1].astype(np.float64)
+
+        # Contour areas via the shoelace formula (same as cv.contourArea)
+        nextIndices = np.arange(1, len(points) + 1)
+        nextIndices[starts + counts - 1] = starts
+        contourAreas = np.abs(np.add.reduceat(x*y[nextIndices] - x[nextIndices]*y, starts))/2
+
+        spanX = np.maximum.reduceat(x, starts) - np.minimum.reduceat(x, starts)
+        spanY = np.maximum.reduceat(y, starts) - np.minimum.reduceat(y, starts)
+        minSpan = np.minimum(spanX, spanY)
+        maxSpan = np.maximum(spanX, spanY)
+
+        # Ignore obvious small or giant splotches
+        # Note: an ellipse's axis aligned extents lie between its minor and major diameter so the span checks
+        #       only reject contours the fitted ellipse would fail too (give or take a pixel of fitting slack)
+        passedArea = (contourAreas >= minArea) & (contourAreas <= maxArea)
+        passed = passedArea & \
+                 (minSpan + 1 >= minDiameter) & (maxSpan - 1 <= maxDiameter) & \
+                 (maxSpan - 1 <= maxRadiusAspect*(minSpan + 1))
+
+        # Note: rejections are attributed to the first check that failed
+        if self.metrics.enabled:
+            numPassedArea = int(np.count_nonzero(passedArea))
+            self.rejectedContourMetrics["area"].inc(len(candidates) - numPassedArea)
+            self.rejectedContourMetrics["extent"].inc(numPassedArea - int(np.count_nonzero(passed)))
+
+        survivors = np.nonzero(passed)[0]
+        log(lambda: f"CONTOURS: candidates: {len(candidates)} | passed cheap checks: {len(survivors)}")
+        if len(survivors) == 0:
+            return []
+
+        ellipses = [cv.fitEllipse(points[starts[i]:starts[i] + counts[i]]) for i in survivors]
+        return self.getGoodEllipses(ellipses, contourAreas[survivors])
+
+    # Returns the `ellipses` that aren't too small/big, too stretched or a poor fit for the region `areas` they came from
+    def getGoodEllipses(self, ellipses, areas:np.ndarray):
+
+        minDiameter, maxDiameter = self.sliders.diameter.getValue()
+        maxRadiusAspect = self.sliders.maxRadiusAspect.getValue()
+        maxNormalizedEllipseError = self.sliders.maxNormalizedEllipseErrorPercent.getValue()/100
+
+        # TODO: Make sure that x, y is inbounds of clipping rect!
+
+        diameters = np.array([diameter for _, diameter, _ in ellipses])
+        d1 = diameters[:, 0]
+        d2 = diameters[:, 1]
 
         # Make sure the fit ellipse is actually approximates a decent ellipse
         # Note: ellipse area is pi*r1*r2
-        ellipseArea = math.pi*d1*d2/4
-        normalizedEllipseError = (ellipseArea - contourArea) / ellipseArea
+        with np.errstate(divide="ignore", invalid="ignore"):
+            aspectRatios = np.abs(d1/d2)
+            ellipseAreas = math.pi*d1*d2/4
+            normalizedEllipseErrors = (ellipseAreas - areas) / ellipseAreas
+
+        # Make sure the ellipse isn't to small/big, to stretched or a poor fit
+        goodDiameter = (d1 >= minDiameter) & (d1 <= maxDiameter) & (d2 >= minDiameter) & (d2 <= maxDiameter)
+        goodAspect = goodDiameter & (aspectRatios >= 1/maxRadiusAspect) & (aspectRatios <= maxRadiusAspect)
+        good = goodAspect & (np.abs(normalizedEllipseErrors) <= maxNormalizedEllipseError)
+
+        if self.metrics.enabled:
+            numGoodDiameter = int(np.count_nonzero(goodDiameter))
+            numGoodAspect = int(np.count_nonzero(goodAspect))
+            self.rejectedContourMetrics["diameter"].inc(len(ellipses) - numGoodDiameter)
+            self.rejectedContourMetrics["aspect"].inc(numGoodDiameter - numGoodAspect)
+            self.rejectedContourMetrics["ellipseError"].inc(numGoodAspect - int(np.count_nonzero(good)))
+
+        if isLogging(LogLevel.Debug):
+            for i in range(len(ellipses)):
+                status = "ELLIPSE" if good[i] else "IGNORING"
+                log(f"{status}: diameter: [{d1[i]}, {d2[i]}] | AspectRatio: {aspectRatios[i]} | contourArea: {areas[i]} | ellipseArea: {ellipseAreas[i]} | error: {normalizedEllipseErrors[i]}")
+
+        # Bingo - we got good ellipses!
+        return [ellipse for ellipse, isGood in zip(ellipses, good) if isGood]
+
+    # Returns the ellipses (in full frame pixels) of the connected components of the eroded `mask` that satisfy the current constraints
+    # Note: eroding by the gradient's reach leaves exactly the holes the contour detector fits so both backends share the sliders.
+    #       Labeling is the expensive part so it runs on the holes max pooled 2x2, which keeps every component and its bounding
+    #       box while touching a quarter of the pixels. The cheap checks run on those conservative stats and only survivors get
+    #       exact moments, computed from their own pixels in a crop of the full detection resolution holes
+    def getComponentEllipses(self, mask):
+
+        with self.profiler.stage("erode"):
+            holes = cv.erode(mask, self.ellipseKernel, iterations=self.getScaledIterations(self.ellipseIterations))
+        self.tap("HOLES", holes, self.RenderLevel.Debug)
+
+        with self.profiler.stage("components"):
+            # Note: area interpolation halving the size averages 2x2 blocks so a pooled pixel is set if any of its block is.
+            #       Odd sizes get a blank row or column so blocks stay aligned
+            height, width = holes.shape
+            if height % 2 or width % 2:
+                holes = cv.copyMakeBorder(holes, 0, height % 2, 0, width % 2, cv.BORDER_CONSTANT, value=0)
+
+            pooledHoles = cv.resize(holes, ((width + 1)//2, (height + 1)//2), interpolation=cv.INTER_AREA)
+
+            # Note: Grana's block based labeling is about 3x faster than the default on our masks
+            numLabels, labels, stats, _ = cv.connectedComponentsWithStatsWithAlgorithm(pooledHoles, 8, cv.CV_32S, cv.CCL_GRANA)
+
+        # Note: label 0 is the background
+        stats = stats[1:].astype(np.float64)
+        if numLabels <= 1:
+            return []
+
+        minArea, maxArea = self.sliders.area.getValue()
+        minDiameter, maxDiameter = self.sliders.diameter.getValue()
+        maxRadiusAspect = self.sliders.maxRadiusAspect.getValue()
 
-        maxNormalizedEllipseError = self.sliders.maxNormalizedEllipseErrorPercent.getValue()/100
-        if abs(normalizedEllipseError) > maxNormalizedEllipseError:
-            log(f"IGNORING - normalizedEllipseError: {normalizedEllipseError} | ellipseArea: {ellipseArea} | contourArea: {contourArea}")
-            return None
+        # Note: constraints are in full frame pixels. A pooled pixel covers 1 to 4 holes pixels and a pooled span of n
+        #       covers 2n-2 to 2n of them, so components are only dropped here if no pixel count or span they could have passes
+        scale = 2*self.downscaleFactor
+        maxAreas = stats[:, cv.CC_STAT_AREA] * scale**2
+        minAreas = stats[:, cv.CC_STAT_AREA] * self.downscaleFactor**2
+        minSpan = np.minimum(stats[:, cv.CC_STAT_WIDTH], stats[:, cv.CC_STAT_HEIGHT]) * scale
+        maxSpan = np.maximum(stats[:, cv.CC_STAT_WIDTH], stats[:, cv.CC_STAT_HEIGHT]) * scale - 2*self.downscaleFactor
+
+        passedArea = (maxAreas >= minArea) & (minAreas <= maxArea)
+        passed = passedArea & \
+                 (minSpan + 1 >= minDiameter) & (maxSpan - 1 <= maxDiameter) & \
+                 (maxSpan - 1 <= maxRadiusAspect*(minSpan + 1))
+
+        if self.metrics.enabled:
+            numPassedArea = int(np.count_nonzero(passedArea))
+            self.rejectedContourMetrics["area"].inc(len(stats) - numPassedArea)
+            self.rejectedContourMetrics["extent"].inc(numPassedArea - int(np.count_nonzero(passed)))
+
+        survivors = np.nonzero(passed)[0]
+        log(lambda: f"COMPONENTS: candidates: {len(stats)} | passed cheap checks: {len(survivors)}")
+        if len(survivors) == 0:
+            return []
+
+        # Note: when the component count is capped (see setQualityLevel) the largest ones are kept
+        if 0 < self.maxContours < len(survivors):
+            survivors = np.sort(survivors[np.argpartition(-maxAreas[survivors], self.maxContours)[:self.maxContours]])
+
+        # Central moments of each survivor from its pixels in its bounding box
+        # Note: the box can hold pixels of a neighboring component, the pooled labels scaled back up tell them apart
+        moments = np.empty((len(survivors), 6))
+        for row, i in enumerate(survivors):
+            x, y, width, height = stats[i, :4].astype(int)
+            ownPixels = cv.resize(labels[y:y+height, x:x+width], None, fx=2, fy=2, interpolation=cv.INTER_NEAREST) == i + 1
+
+            x, y = 2*x, 2*y
+            holesCrop = holes[y:y+2*height, x:x+2*width]
+            componentPixels = holesCrop & ownPixels[:holesCrop.shape[0], :holesCrop.shape[1]].view(np.uint8)
+
+            componentMoments = cv.moments(componentPixels, binaryImage=True)
+            moments[row] = (componentMoments["m00"], x + componentMoments["m10"]/componentMoments["m00"], y + componentMoments["m01"]/componentMoments["m00"],
+                            componentMoments["mu20"], componentMoments["mu02"], componentMoments["mu11"])
+
+        # Note: the area check is repeated on the exact pixel counts
+        areas = moments[:, 0] * self.downscaleFactor**2
+        exactArea = (areas >= minArea) & (areas <= maxArea)
+        if self.metrics.enabled:
+            self.rejectedContourMetrics["area"].inc(len(moments) - int(np.count_nonzero(exactArea)))
+
+        moments = moments[exactArea]
+        areas = areas[exactArea]
+        if len(moments) == 0:
+            return []
+
+        m00, centerX, centerY, mu20, mu02, mu11 = moments.T
+
+        # Note: a uniform ellipse with covariance eigenvalues l1, l2 has diameters 4*sqrt(l1) and 4*sqrt(l2)
+        covarianceXX, covarianceYY, covarianceXY = mu20/m00, mu02/m00, mu11/m00
+        halfTrace = (covarianceXX + covarianceYY)/2
+        spread = np.sqrt(((covarianceXX - covarianceYY)/2)**2 + covarianceXY**2)
+        majorDiameters = 4*np.sqrt(halfTrace + spread) * self.downscaleFactor
+        minorDiameters = 4*np.sqrt(np.maximum(halfTrace - spread, 0)) * self.downscaleFactor
+        angles = np.degrees(np.arctan2(2*covarianceXY, covarianceXX - covarianceYY)/2)
+
+        centers = self.getFrameContour(np.stack([centerX, centerY], axis=1))
+        ellipses = [
+            ((float(cx), float(cy)), (float(major), float(minor)), float(angle))
+            for (cx, cy), major, minor, angle in zip(centers, majorDiameters, minorDiameters, angles)
+        ]
 
-        # Bingo - we got a good ellipse!
-        log(f"ELLIPSE: diameter: [{d1}, {d2}] | AspectRatio: {aspectRatio} | contourArea: {contourArea} | ellipseArea: {ellipseArea} | error: {normalizedEllipseError}")
-        return ellipse
+        return self.getGoodEllipses(ellipses, areas)
 
+    # Returns the contours found in the detection image (empty when the frame was skipped)
     def fitEllipse(self, namedImage:NamedImage):
 
-        # Convert image to HSV
-        hsvImage = cv.cvtColor(namedImage.pixels, cv.COLOR_BGR2HSV)
-        self.addRenderImage(NamedImage("HSV", hsvImage), self.RenderLevel.Debug)
+        with self.profiler.stage("clip"):
+            detectionPixels = self.getDetectionImage(namedImage.pixels)
+
+        if self.colorMode != "hsv" and detectionPixels.ndim == 3:
+            with self.profiler.stage("intensity"):
+                detectionPixels = self.getIntensityImage(detectionPixels)
+
+        # Skip the rest of the pipeline if nothing moved since the last processed frame and republish its fingers
+        self.activityGate.threshold = self.sliders.motionThreshold.getValue()
+        with self.profiler.stage("activity"):
+            isIdle = self.activityGate.isIdle(detectionPixels)
+
+        if isIdle:
+            self.idleFramesMetric.inc()
+            self.appendDetections(self.lastDetections)
+            return ()
+
+        self.lastDetections = []
+
+        # Remove ambient IR picked up by the background model
+        self.backgroundModel.learningRate = self.sliders.backgroundRate.getValue()/1000
+        with self.profiler.stage("background"):
+            foregroundPixels = self.backgroundModel.apply(detectionPixels)
+        self.tap("Foreground", foregroundPixels, self.RenderLevel.Internal)
 
         # Get image binary mask
-        hsvMask = self.getMask(hsvImage, self.getMinHSV(), self.getMaxHSV())
-        self.addRenderImage(NamedImage("MASK", hsvMask), self.RenderLevel.Internal)
+        if foregroundPixels.ndim == 2:
+            fingerMask = self.getIntensityMask(foregroundPixels)
+
+        else:
+            # Convert image to HSV
+            with self.profiler.stage("cvtColor"):
+                hsvImage = cv.cvtColor(foregroundPixels, cv.COLOR_BGR2HSV)
+            self.tap("HSV", hsvImage, self.RenderLevel.Debug)
+
+            fingerMask = self.getMask(hsvImage, self.getMinHSV(), self.getMaxHSV())
+
+        if self.clipMask is not None:
+            fingerMask = cv.bitwise_and(fingerMask, self.clipMask)
+        self.tap("MASK", fingerMask, self.RenderLevel.Internal)
+
+        # Note: fingers are kept out of the background by masking them from the update
+        with self.profiler.stage("background"):
+            self.backgroundModel.update(detectionPixels, fingerMask)
+
+        if self.sliders.detector.getValue() == self.Detector.Components:
+            with self.profiler.stage("filter"):
+                fingerEllipses = self.getComponentEllipses(fingerMask)
+
+            self.addFingers(self.refineCenters(fingerEllipses, foregroundPixels, fingerMask))
+
+            return ()
 
         # Preform a gradient on the mask to form 'rings' around fingers
-        gradientEllipse = cv.morphologyEx(hsvMask, cv.MORPH_GRADIENT, self.ellipseKernel, self.ellipseIterations)
-        self.addRenderImage(NamedImage("GRADIENT", gradientEllipse), self.RenderLevel.Debug)
+        with self.profiler.stage("gradient"):
+            gradientEllipse = cv.morphologyEx(fingerMask, cv.MORPH_GRADIENT, self.ellipseKernel, iterations=self.getScaledIterations(self.ellipseIterations))
+        self.tap("GRADIENT", gradientEllipse, self.RenderLevel.Debug)
     
-        contours, hierarchies = cv.findContours(gradientEllipse, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+        with self.profiler.stage("findContours"):
+            contours, hierarchies = cv.findContours(gradientEllipse, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
         if hierarchies is None:
+            return contours
+
+        with self.profiler.stage("filter"):
+
+            # TODO: Also make sure that parent contour is matches all constraints!
+            fingerEllipses = self.getConstrainedEllipses(contours, hierarchies[0])
+
+        self.addFingers(self.refineCenters(fingerEllipses, foregroundPixels, fingerMask))
+        return contours
+
+    # Returns `fingerEllipses` with their centers moved to the intensity weighted centroid of the masked
+    # foreground under each (slightly grown) ellipse when the subpixel slider is on
+    # Note: IR fingers are brightest where they press hardest so this is steadier than the outline alone,
+    #       which moves by whole pixels as the mask edge flickers
+    def refineCenters(self, fingerEllipses, foregroundPixels, mask):
+
+        if len(fingerEllipses) == 0 or self.sliders.subpixel.getValue() == 0:
+            return fingerEllipses
+
+        with self.profiler.stage("subpixel"):
+
+            imageHeight, imageWidth = mask.shape
+            reach = self.ellipseKernelSize[0]//2 * self.getScaledIterations(self.ellipseIterations)
+
+            refinedEllipses = []
+            for (centerX, centerY), (d1, d2), angle in fingerEllipses:
+
+                # Note: ellipses are in full frame pixels and the images are in detection pixels
+                x = (centerX - self.clipOffset[0])/self.downscaleFactor
+                y = (centerY - self.clipOffset[1])/self.downscaleFactor
+                width = d1/self.downscaleFactor + 2*reach
+                height = d2/self.downscaleFactor + 2*reach
+
+                radius = int(max(width, height)/2) + 1
+                left, top = max(0, int(x) - radius), max(0, int(y) - radius)
+                right, bottom = min(imageWidth, int(x) + radius + 1), min(imageHeight, int(y) + radius + 1)
+
+                ellipseMask = np.zeros((bottom - top, right - left), dtype=np.uint8)
+                cv.ellipse(ellipseMask, ((x - left, y - top), (width, height), angle), 255, -1)
+                cv.bitwise_and(ellipseMask, mask[top:bottom, left:right], dst=ellipseMask)
+
+                intensity = foregroundPixels[top:bottom, left:right]
+                if intensity.ndim == 3:
+                    intensity = cv.max(cv.max(intensity[..., 0], intensity[..., 1]), intensity[..., 2])
+
+                moments = cv.moments(cv.bitwise_and(intensity, intensity, mask=ellipseMask))
+                if moments["m00"] > 0:
+                    x = left + moments["m10"]/moments["m00"]
+                    y = top + moments["m01"]/moments["m00"]
+                    centerX = x*self.downscaleFactor + self.clipOffset[0]
+                    centerY = y*self.downscaleFactor + self.clipOffset[1]
+
+                refinedEllipses.append(((float(centerX), float(centerY)), (d1, d2), angle))
+
+        return refinedEllipses
+
+    # Appends a Finger for each of `fingerEllipses` (in full frame pixels)
+    def addFingers(self, fingerEllipses):
+
+        if len(fingerEllipses) == 0:
             return
 
-        # Draw all contours in red (we'll draw over the good ones with green when we detect a finger)
-        cv.drawContours(namedImage.pixels, contours, -1, color=Color.red)
+        # Map finger centers to table coordinates in one batch
+        cameraPoints = np.float64([center for center, _, _ in fingerEllipses])
+        tablePoints = self.getTablePoints(cameraPoints)
+
+        # Note: the tracker smooths published fingers in place so idle frames republish these raw detections instead (see fitEllipse)
+        self.lastDetections = [(fingerEllipse, float(tableX), float(tableY)) for fingerEllipse, (tableX, tableY) in zip(fingerEllipses, tablePoints)]
+        self.appendDetections(self.lastDetections)
+
+    # Appends a Finger for each (ellipse, tableX, tableY) of `detections`
+    def appendDetections(self, detections:list[tuple]):
+
+        for fingerEllipse, tableX, tableY in detections:
+
+            (fingerX, fingerY), (fingerWidth, fingerHeight), fingerAngle = fingerEllipse
+
+            finger = Finger(tableX, tableY, fingerWidth, fingerHeight, fingerAngle)
+            finger.cameraX = fingerX
+            finger.cameraY = fingerY
+            self.fingers.append(finger)
+
+# Note: Runs capture, detection and publishing on their own threads connected by small LatestQueues
+#       so a slow publish or repaint never holds up the camera. Rendering stays on the calling thread
+#       because HighGUI has to be driven from the thread that owns the windows
+class TouchpadPipeline:
+
+    def __init__(self, touchpad:Touchpad, queueSize:int = 1) -> None:
+        self.touchpad = touchpad
+
+        self.detectQueue  = LatestQueue(queueSize)
+        self.publishQueue = LatestQueue(queueSize)
+        self.renderQueue  = LatestQueue(1)
 
-        for i, (contour, hierarchy) in enumerate(zip(contours, hierarchies[0])):
+        self.running = False
+        self.threads:list[threading.Thread] = []
 
-            nextContour, prevContour, childContour, parentContour = hierarchy
+        for queueName, queue in [("detect", self.detectQueue), ("publish", self.publishQueue), ("render", self.renderQueue)]:
+            touchpad.metrics.callbackCounter("dropped_frames_total", "Frames dropped before they were processed",
+                                             lambda queue=queue: queue.dropped, {"queue": queueName})
 
-            # we only care about the inner hole of a ring
-            if childContour != -1:
+    def start(self):
+        assert not self.running, "Pipeline is already running"
+
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self.captureLoop, name="TouchpadCapture", daemon=True),
+            threading.Thread(target=self.detectLoop,  name="TouchpadDetect",  daemon=True),
+            threading.Thread(target=self.publishLoop, name="TouchpadPublish", daemon=True),
+        ]
+
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        
+        for queue in [self.detectQueue, self.publishQueue, self.renderQueue]:
+            queue.close()
+
+        for thread in self.threads:
+            thread.join()
+
+        self.threads.clear()
+
+    def getDroppedFrames(self):
+        return {
+            "detect":  self.detectQueue.dropped,
+            "publish": self.publishQueue.dropped,
+            "render":  self.renderQueue.dropped,
+        }
+
+    def captureLoop(self):
+        while self.running:
+            frame = self.touchpad.captureFrame()
+            if frame is not None:
+                self.detectQueue.put(frame)
+
+            elif not self.touchpad.source.isOpen():
+                break
+
+    def detectLoop(self):
+        while self.running:
+            frame = self.detectQueue.get()
+            if frame is None:
                 continue
 
-            fingerEllipse = self.getConstrainedEllipse(contour) 
-            if fingerEllipse is None:
+            self.touchpad.detectFingers(frame)
+            self.publishQueue.put(frame)
+
+            # Note: frames nobody tapped have nothing to show
+            if frame.tapLevel is not None:
+                self.renderQueue.put(frame)
+
+    def publishLoop(self):
+        while self.running:
+            frame = self.publishQueue.get()
+            if frame is None:
                 continue
 
-            # TODO: Also make sure that parent contour is matches all constraints!
-            # if parentContour
+            self.touchpad.publishFingers(frame)
+            self.touchpad.recordLatency(frame)
 
-            (fingerX, fingerY), (fingerWidth, fingerHeight), fingerAngle = fingerEllipse
+    # Note: Must be called from the GUI thread
+    def draw(self, timeout:float = .01):
 
-            # Draw ellipse on image
-            cv.ellipse(namedImage.pixels, fingerEllipse, Color.green, 2)        
-            namedImage.drawText(f"[{np.round(fingerX, 2)}, {np.round(fingerY, 2)}]", (fingerX, fingerY))
+        frame = self.renderQueue.get(timeout)
+        if self.touchpad.headless:
+            return
 
-            # Normalize finger coordinates and add to queue
-            normalizedX = normalize(fingerX, 0, self.cameraWidth, -1, 1)
-            normalizedY = normalize(fingerY, 0, self.cameraHeight, -1, 1)
-            self.fingers.append(Finger(normalizedX, normalizedY, fingerWidth, fingerHeight, fingerAngle))
+        if frame is None:
+            # Note: keep pumping window events even when there is nothing new to show
+            self.touchpad.sliders.syncTrackbars()
+            cv.waitKey(1)
+            return
 
+        self.touchpad.draw(frame, inFrameTime=False)
 
 def main():
 
@@ -576,8 +1635,37 @@ def main():
     )
 
     argParser.add_argument("-p", "--port", metavar="n", action="store", default=0, required=False, help="IR Camera port number")
+    argParser.add_argument("-i", "--input", metavar="source", action="store", default=None, required=False, help="Reads frames from a video file, image directory or 'synthetic' instead of the camera")
+    argParser.add_argument("--capture-profile", metavar="name", action="store", default=None, choices=list(captureProfiles), required=False, help="Camera resolution, frame rate and pixel format, e.g. 'mjpeg120' (see framesource.captureProfiles). Simulated by 'synthetic' inputs")
+    argParser.add_argument("--threaded-capture", action="store_true", required=False, help="Read and decode frames on a worker thread that keeps only the newest one")
+    argParser.add_argument("--loop", action="store_true", required=False, help="Loop video file and image directory inputs")
+    argParser.add_argument("--headless", action="store_true", required=False, help="Run without windows, slider values come from --config")
+    argParser.add_argument("-c", "--config", metavar="path", action="store", default=None, required=False, help="JSON file of slider values to start with")
+    argParser.add_argument("--profile", metavar="path", action="store", default=defaultProfilePath, required=False, help="Threshold and exposure profile from autotune.py, loaded when it exists (--config values take precedence)")
+    argParser.add_argument("--clip", metavar="x,y,w,h", action="store", default=None, required=False, help="Touch surface as a rectangle 'x,y,w,h' or polygon 'x1,y1,x2,y2,...' in camera pixels")
+    argParser.add_argument("--downscale", metavar="n", action="store", default="0", required=False, help="Number of times to halve the clipped region before detection")
+    argParser.add_argument("--color-mode", metavar="mode", action="store", default="hsv", choices=colorModes, required=False, help="What detection thresholds: 'hsv', or the single channel 'value' or 'luma' fast paths")
+    argParser.add_argument("--detector", metavar="backend", action="store", default=None, choices=detectorBackends, required=False, help="Finger detector backend: 'contours' or 'components' (also the detector slider)")
+    argParser.add_argument("--calibration", metavar="path", action="store", default=None, required=False, help="Publish fingers in table coordinates using a calibration from calibration.py")
+    argParser.add_argument("--predict", metavar="seconds", action="store", default="0.05", required=False, help="How far ahead predicted finger positions are extrapolated")
+    argParser.add_argument("--filter", metavar="name", action="store", default="oneeuro", choices=outputFilters, required=False, help="Smooths published finger positions per track: 'none', 'ema' or 'oneeuro' (see filters.py)")
+    argParser.add_argument("--filter-params", metavar="name=value,...", action="store", default=None, required=False, help="Filter settings, e.g. 'minCutoff=1,beta=100' for oneeuro or 'alpha=.5' for ema")
+    argParser.add_argument("-n", "--frames", metavar="n", action="store", default="0", required=False, help="Stop after n frames (0 runs forever)")
     argParser.add_argument("-o", "--output", metavar="path", action="store", default="touchpad.out", required=False, help="Output filepath to write finger positions to")
     argParser.add_argument("-v", "--verbose", metavar="path", action="store", default="0", required=False, help="Sets the verbose level (higher means more logging)")
+    argParser.add_argument("-t", "--transport", metavar="type", action="store", default="file", choices=publisherTransports, required=False, help="How fingers are published: 'file' (text file), 'ring' (memory-mapped ring buffer), 'udp' or 'tcp' (see netpublisher.py)")
+    argParser.add_argument("--address", metavar="host:port", action="store", default=None, required=False, help="Address the udp and tcp transports publish on (defaults to 127.0.0.1:5005)")
+    argParser.add_argument("--frame-budget", metavar="ms", action="store", default="0", required=False, help="Per frame detection, publish and repaint time to degrade quality to stay under (see scheduler.py, 0 disables)")
+    argParser.add_argument("--pipelined", action="store_true", required=False, help="Run capture, detection and publishing on separate threads")
+    argParser.add_argument("--render-rate", metavar="fps", action="store", default="0", required=False, help="Maximum debug window repaints per second (0 repaints every frame)")
+    argParser.add_argument("--record", metavar="path", action="store", default=None, required=False, help="Record raw frames, slider values and published fingers to a session directory (replay with recorder.py)")
+    argParser.add_argument("--record-codec", metavar="codec", action="store", default="raw", choices=["raw", "png"], required=False, help="How recorded frames are stored: 'raw' pixels or lossless 'png'")
+    argParser.add_argument("--metrics-port", metavar="port", action="store", default="0", required=False, help="Serve Prometheus metrics on http://127.0.0.1:port/metrics (0 disables)")
+    argParser.add_argument("--metrics-file", metavar="path", action="store", default=None, required=False, help="Periodically write a JSON snapshot of the metrics to path")
+    argParser.add_argument("--metrics-interval", metavar="seconds", action="store", default="5", required=False, help="Seconds between metrics snapshots")
+    argParser.add_argument("--control-port", metavar="port", action="store", default="0", required=False, help="Run as a service with a JSON control API on http://127.0.0.1:port (see service.py, 0 disables)")
+    argParser.add_argument("--presets", metavar="path", action="store", default="presets", required=False, help="Directory the control API saves and loads slider presets in")
+    argParser.add_argument("--stats", metavar="seconds", action="store", default="0", required=False, help="Print latency stats every n seconds (0 disables)")
 
     args = argParser.parse_args()
     
@@ -586,15 +1674,110 @@ def main():
 
     log(f"Touchpad: [\n"+
         f"\tPort: {args.port}\n"+        
+        f"\tInput: {args.input}\n"+        
+        f"\tHeadless: {args.headless}\n"+        
         f"\tOutputFile: {args.output}\n"+        
+        f"\tTransport: {args.transport}\n"+        
+        f"\tPipelined: {args.pipelined}\n"+        
+        f"\tCaptureProfile: {args.capture_profile}\n"+        
+        f"\tThreadedCapture: {args.threaded_capture}\n"+        
         f"]\n"
     )
 
-    touchpad = Touchpad(cameraPort=int(args.port), windowName="Touchpad", outputFilePath=args.output)
+    config = None
+    if os.path.isfile(args.profile):
+        config = loadProfile(args.profile)["sliders"]
+        log(f"Loaded profile '{args.profile}': {config}", LogLevel.Warn)
+
+    if args.config is not None:
+        with open(args.config) as configFile:
+            config = {**(config or {}), **json.load(configFile)}
+
+    if args.detector is not None:
+        config = {**(config or {}), "detector": detectorBackends.index(args.detector)}
+
+    metricsPort = int(args.metrics_port)
+    metrics = MetricsRegistry(enabled=metricsPort > 0 or args.metrics_file is not None)
+
+    source = CameraSource(int(args.port), args.capture_profile or "default") if args.input is None else openFrameSource(args.input, args.loop, args.capture_profile)
+    if args.threaded_capture:
+        source = ThreadedSource(source)
+
+    publisher = createPublisher(args.transport, args.output, args.address)
+    clip = None
+    if args.clip is not None:
+        clipValues = [int(value) for value in args.clip.split(",")]
+        clip = clipValues if len(clipValues) == 4 else list(zip(clipValues[0::2], clipValues[1::2]))
+
+    touchpad = Touchpad(source, windowName="Touchpad", publisher=publisher, headless=args.headless, config=config,
+                        clip=clip, downscale=int(args.downscale), tracker=FingerTracker(predictionHorizon=float(args.predict), outputFilter=args.filter, filterParams=parseFilterParams(args.filter_params)),
+                        calibration=None if args.calibration is None else Calibration.load(args.calibration),
+                        renderRate=float(args.render_rate), metrics=metrics, colorMode=args.color_mode, frameBudget=float(args.frame_budget)/1000)
+
+    if args.record is not None:
+        touchpad.startRecording(args.record, args.record_codec)
+
+    maxFrames = int(args.frames)
+
+    statsInterval = float(args.stats)
+    lastStatsTime = time.monotonic()
+
+    metricsServer = None
+    if metricsPort > 0:
+        metricsServer = MetricsServer(metrics, metricsPort)
+        log(f"Serving metrics on {metricsServer.getAddress()}", LogLevel.Warn)
+
+    metricsInterval = float(args.metrics_interval)
+    lastMetricsTime = time.monotonic()
+
+    controlPort = int(args.control_port)
+    if controlPort > 0:
+        if args.pipelined:
+            log("--pipelined is ignored when running with --control-port", LogLevel.Warn)
+
+        service = TouchpadService(touchpad, port=controlPort, presetsPath=args.presets, maxFrames=maxFrames)
+        try:
+            asyncio.run(service.run())
+        except KeyboardInterrupt:
+            pass
+
+    pipeline = None
+    if args.pipelined and controlPort <= 0:
+        pipeline = TouchpadPipeline(touchpad)
+        pipeline.start()
+
+    while controlPort <= 0 and touchpad and (maxFrames <= 0 or touchpad.frameId < maxFrames):
+
+        if pipeline is None:
+            touchpad.update()
+            touchpad.draw()
+        else:
+            pipeline.draw()
+
+        if statsInterval > 0 and time.monotonic() - lastStatsTime >= statsInterval:
+            lastStatsTime = time.monotonic()
+            print(touchpad.getLatencyInfo())
+
+            if pipeline is not None:
+                print(f"Dropped Frames: {pipeline.getDroppedFrames()}\n")
+
+        if args.metrics_file is not None and time.monotonic() - lastMetricsTime >= metricsInterval:
+            lastMetricsTime = time.monotonic()
+            metrics.writeSnapshot(args.metrics_file)
+
+    if pipeline is not None:
+        pipeline.stop()
+
+    if statsInterval > 0:
+        print(touchpad.getLatencyInfo())
+
+    if args.metrics_file is not None:
+        metrics.writeSnapshot(args.metrics_file)
+
+    if metricsServer is not None:
+        metricsServer.close()
 
-    while touchpad:
-        touchpad.update()
-        touchpad.draw()
+    touchpad.close()
 
 
 
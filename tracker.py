@@ -0,0 +1,224 @@
+# Temporal finger tracking
+#
+# Associates detections across frames with a minimum cost assignment on distance, gives every
+# finger a persistent id and runs a constant velocity (alpha-beta) filter per track so we can
+# publish velocities and a short horizon predicted position that hides camera/transport latency.
+# Published positions can also be smoothed by a per track output filter (see filters.py).
+# Published velocities and accelerations come from a fit over each track's recent detections (see kinematics.py).
+
+import collections
+import itertools
+import numpy as np
+
+from filters import createFilter
+from kinematics import fitKinematics
+
+# Returns [(row, col), ...] that minimizes the total cost of a rectangular cost matrix (Hungarian algorithm)
+def solveAssignment(cost):
+
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.size == 0:
+        return []
+
+    # Note: the algorithm below needs rows <= cols
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+
+    numRows, numCols = cost.shape
+
+    # Note: index 0 is a sentinel so rows and cols are 1-based
+    u = np.zeros(numRows + 1)
+    v = np.zeros(numCols + 1)
+    colToRow = np.zeros(numCols + 1, dtype=int)
+    way = np.zeros(numCols + 1, dtype=int)
+
+    for row in range(1, numRows + 1):
+
+        colToRow[0] = row
+        col0 = 0
+        minV = np.full(numCols + 1, np.inf)
+        used = np.zeros(numCols + 1, dtype=bool)
+
+        while True:
+            used[col0] = True
+            row0 = colToRow[col0]
+
+            freeCols = np.nonzero(~used)[0]
+            reduced = cost[row0 - 1, freeCols - 1] - u[row0] - v[freeCols]
+
+            improved = reduced < minV[freeCols]
+            minV[freeCols[improved]] = reduced[improved]
+            way[freeCols[improved]] = col0
+
+            col1 = freeCols[np.argmin(minV[freeCols])]
+            delta = minV[col1]
+
+            usedCols = np.nonzero(used)[0]
+            u[colToRow[usedCols]]+= delta
+            v[usedCols]-= delta
+            minV[freeCols]-= delta
+
+            col0 = col1
+            if colToRow[col0] == 0:
+                break
+
+        # Walk the augmenting path back to the sentinel
+        while col0 != 0:
+            col1 = way[col0]
+            colToRow[col0] = colToRow[col1]
+            col0 = col1
+
+    pairs = [(colToRow[col] - 1, col - 1) for col in range(1, numCols + 1) if colToRow[col] != 0]
+    return [(col, row) for row, col in pairs] if transposed else pairs
+
+class Track:
+    def __init__(self, trackId:int, x:float, y:float, timestamp:float, outputFilter = None, kinematicsWindow:int = 6) -> None:
+        self.id = trackId
+        self.outputFilter = outputFilter
+        self.x = x
+        self.y = y
+        self.vx = 0
+        self.vy = 0
+        self.timestamp = timestamp
+        self.age = 1
+        self.missedFrames = 0
+
+        # Note: (timestamp, x, y) of the raw detections the kinematics are fitted to
+        self.history = collections.deque([(timestamp, x, y)], maxlen=kinematicsWindow)
+
+    def getPredicted(self, timestamp:float):
+        dt = timestamp - self.timestamp
+        return self.x + self.vx*dt, self.y + self.vy*dt
+
+    # Note: alpha-beta filter update with measurement (x, y)
+    def correct(self, x:float, y:float, timestamp:float, alpha:float, beta:float):
+        dt = timestamp - self.timestamp
+        predictedX, predictedY = self.getPredicted(timestamp)
+
+        residualX = x - predictedX
+        residualY = y - predictedY
+
+        self.x = predictedX + alpha*residualX
+        self.y = predictedY + alpha*residualY
+
+        if dt > 0:
+            self.vx+= beta*residualX/dt
+            self.vy+= beta*residualY/dt
+
+        self.timestamp = timestamp
+        self.age+= 1
+        self.missedFrames = 0
+        self.history.append((timestamp, x, y))
+
+    # Returns the output filtered position of a measurement (x, y) at `timestamp`
+    def smooth(self, x:float, y:float, timestamp:float):
+        if self.outputFilter is None:
+            return x, y
+
+        smoothedX, smoothedY = self.outputFilter.filter(np.array((x, y)), timestamp)
+        return float(smoothedX), float(smoothedY)
+
+class FingerTracker:
+
+    # Note: distances are in normalized touchpad units and times are in seconds
+    #       `maxDistance` gates associations, tracks are dropped after `maxMissedFrames` frames without a detection
+    #       and `predictionHorizon` is how far ahead predictedX/predictedY extrapolate
+    #       `outputFilter` names the filter (see filters.outputFilters) that smooths each track's published x, y with `filterParams`
+    #       and published velocities and accelerations are fitted to each track's last `kinematicsWindow` detections
+    def __init__(self, maxDistance:float = .25, maxMissedFrames:int = 3, predictionHorizon:float = .05, alpha:float = .85, beta:float = .3,
+                 outputFilter:str = "none", filterParams:dict = None, kinematicsWindow:int = 6) -> None:
+        self.maxDistance = maxDistance
+        self.maxMissedFrames = maxMissedFrames
+        self.predictionHorizon = predictionHorizon
+        self.alpha = alpha
+        self.beta = beta
+        self.outputFilter = outputFilter
+        self.filterParams = filterParams or {}
+        self.kinematicsWindow = kinematicsWindow
+
+        # Note: fail on bad filter settings now rather than on the first finger
+        createFilter(outputFilter, self.filterParams)
+
+        self.tracks:list[Track] = []
+        self.trackIds = itertools.count()
+
+    def reset(self):
+        self.tracks.clear()
+        self.trackIds = itertools.count()
+
+    # Assigns id, vx, vy, ax, ay, predictedX and predictedY to each finger detected at `timestamp` and smooths its x, y
+    # Note: association, the alpha-beta filter and the kinematics fit always see the raw detections
+    def update(self, fingers:list, timestamp:float):
+
+        assignments = []
+        if self.tracks and fingers:
+            predicted = np.array([track.getPredicted(timestamp) for track in self.tracks])
+            detected = np.array([(finger.x, finger.y) for finger in fingers])
+
+            distances = np.linalg.norm(predicted[:, np.newaxis, :] - detected[np.newaxis, :, :], axis=2)
+
+            # Note: gated pairs get a cost no valid assignment can beat so they're only chosen when nothing else fits
+            gatedCost = self.maxDistance*(len(self.tracks) + len(fingers) + 1)
+            cost = np.where(distances <= self.maxDistance, distances, gatedCost)
+
+            assignments = [(trackIndex, fingerIndex) for trackIndex, fingerIndex in solveAssignment(cost)
+                           if distances[trackIndex, fingerIndex] <= self.maxDistance]
+
+        matchedTracks = set()
+        matchedFingers = set()
+        for trackIndex, fingerIndex in assignments:
+            track = self.tracks[trackIndex]
+            track.correct(fingers[fingerIndex].x, fingers[fingerIndex].y, timestamp, self.alpha, self.beta)
+
+            matchedTracks.add(trackIndex)
+            matchedFingers.add(fingerIndex)
+            self.assignTrack(fingers[fingerIndex], track, timestamp)
+
+        # Age out tracks that weren't seen this frame
+        survivingTracks = []
+        for trackIndex, track in enumerate(self.tracks):
+            if trackIndex not in matchedTracks:
+                track.missedFrames+= 1
+                if track.missedFrames > self.maxMissedFrames:
+                    continue
+
+            survivingTracks.append(track)
+
+        # Start new tracks for unmatched detections
+        for fingerIndex, finger in enumerate(fingers):
+            if fingerIndex in matchedFingers:
+                continue
+
+            track = Track(next(self.trackIds), finger.x, finger.y, timestamp, createFilter(self.outputFilter, self.filterParams), self.kinematicsWindow)
+            survivingTracks.append(track)
+            self.assignTrack(finger, track, timestamp)
+
+        self.tracks = survivingTracks
+        self.assignKinematics(fingers, timestamp)
+
+    # Note: every track seen this frame is fitted in one batch, rows are padded out to the window
+    def assignKinematics(self, fingers:list, timestamp:float):
+        if not fingers:
+            return
+
+        tracks = {track.id: track for track in self.tracks}
+        times = np.zeros((len(fingers), self.kinematicsWindow))
+        positions = np.zeros((len(fingers), self.kinematicsWindow, 2))
+        valid = np.zeros((len(fingers), self.kinematicsWindow), dtype=bool)
+
+        for row, finger in enumerate(fingers):
+            history = np.array(tracks[finger.id].history)
+            times[row, :len(history)] = history[:, 0] - timestamp
+            positions[row, :len(history)] = history[:, 1:]
+            valid[row, :len(history)] = True
+
+        velocity, acceleration = fitKinematics(times, positions, valid)
+        for row, finger in enumerate(fingers):
+            finger.vx, finger.vy = float(velocity[row, 0]), float(velocity[row, 1])
+            finger.ax, finger.ay = float(acceleration[row, 0]), float(acceleration[row, 1])
+
+    def assignTrack(self, finger, track:Track, timestamp:float):
+        finger.x, finger.y = track.smooth(finger.x, finger.y, timestamp)
+        finger.id = track.id
+        finger.predictedX, finger.predictedY = track.getPredicted(track.timestamp + self.predictionHorizon)